@@ -1,5 +1,6 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+import os
 import rasterio
 from PyInstaller.utils.hooks import collect_submodules
 from PyInstaller.building.build_main import Analysis, PYZ, EXE, COLLECT
@@ -13,6 +14,14 @@ hidden = [
     'psycopg2._psycopg'
 ]
 
+# Variante di build: 'onefile' (predefinita) estrae tutto in una cartella temporanea a ogni avvio,
+# 'onedir' produce una cartella con l'eseguibile e le librerie già estratte e si avvia più velocemente.
+# Uso: SWE_BUILD_MODE=onedir pyinstaller SWE_data_uploader.spec
+build_mode = os.environ.get('SWE_BUILD_MODE', 'onefile')
+
+# Moduli non usati dall'applicazione, esclusi per ridurre la dimensione del pacchetto
+excluded = ['matplotlib', 'IPython', 'notebook', 'jupyter_client', 'pytest', 'scipy']
+
 # Analisi del file principale
 a = Analysis(
     ['swe_convert_upload.py'],
@@ -22,29 +31,59 @@ a = Analysis(
     hiddenimports=hidden,
     hookspath=[],
     runtime_hooks=[],
-    excludes=[],
+    excludes=excluded,
     noarchive=False,
 )
 
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='SWE_data_uploader',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=False,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+if build_mode == 'onedir':
+    # Eseguibile senza librerie incorporate, raccolte accanto all'eseguibile da COLLECT;
+    # UPX disattivato perché la decompressione delle librerie rallenta l'avvio
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='SWE_data_uploader',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='SWE_data_uploader',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='SWE_data_uploader',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
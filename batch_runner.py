@@ -0,0 +1,487 @@
+'''
+Questo modulo esegue la conversione e il caricamento di più file GeoTIFF a pipeline. \n
+L'elaborazione è divisa in tre fasi collegate da code limitate, che lavorano contemporaneamente su file diversi:
+    - lettura e conversione: un thread legge i GeoTIFF e li converte in dataframe (a blocchi con chunk_mb); con più
+      'workers' la conversione, che impegna la CPU, viene distribuita su un pool di processi;
+    - controllo: un thread controlla CRS e ID di ogni blocco e aggiunge le geometrie mancanti;
+    - caricamento: un unico scrittore, nel thread chiamante, carica i blocchi con COPY e registra il manifest.
+Così il file successivo viene decodificato e controllato mentre il precedente viene copiato nel database.
+I blocchi attraversano le fasi nell'ordine dei file, cioè in ordine di data, come richiesto dalla modalità 'delta'. \n
+La dimensione delle code (queue_size) limita la memoria: oltre ai file in conversione nel pool (al massimo 2 * workers)
+restano in attesa al più queue_size blocchi convertiti prima del controllo e queue_size blocchi controllati prima del caricamento. \n
+Lo stop_event interrompe tutte le fasi: lo scrittore termina il blocco in corso, le altre fasi smettono di leggere
+e di controllare, le conversioni non ancora iniziate nel pool vengono annullate e i processi del pool con conversioni
+già avviate vengono terminati, perché il loro risultato verrebbe scartato. Con cancel_on_stop anche il blocco
+in corso viene interrotto: le query in esecuzione vengono annullate (vedi UploadSession.cancel), la loro transazione
+viene annullata con un rollback e, senza pool, i file vengono sempre letti a finestre di DEFAULT_CHUNK_MB MB, così la
+lettura si ferma al termine della finestra in corso invece che alla fine del file. \n
+Gli eventi di avanzamento vengono notificati con le stesse tuple usate dalla coda dell'interfaccia grafica:
+("update", file, idx), ("log", messaggio) e ("error", file, errore). \n
+Le misure delle fasi di ogni file vengono raccolte con il modulo metrics e, al termine, salvate in un report JSON/CSV. \n
+I moduli di conversione e di accesso al database vengono importati alla prima elaborazione,
+per non rallentare l'avvio dell'interfaccia grafica e della riga di comando. \n
+'''
+import os
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Full, Queue
+import metrics
+from functions import is_valid_file, nivological_year
+
+# Numero predefinito di blocchi in attesa in ogni coda tra due fasi
+DEFAULT_QUEUE_SIZE = 2
+# Intervallo in secondi con cui le fasi in attesa su una coda controllano l'interruzione
+_POLL_SECONDS = 0.1
+# Segnaposto della fine del flusso tra due fasi
+_END = None
+
+
+# Funzione per ordinare i file per data, separando quelli con nome non valido
+def sort_files_by_date(file_paths: list) -> tuple[list, list]:
+    '''
+    Ordina i file per data estratta dal nome. \n
+    Args:
+        file_paths: La lista dei percorsi dei file GeoTIFF. \n
+    Returns:
+        tuple: La lista dei file validi ordinati per data e la lista di coppie (file, errore) dei file con nome non valido. \n
+    '''
+    dated = []
+    invalid = []
+    for file_path in file_paths:
+        try:
+            dated.append((is_valid_file(os.path.basename(file_path)), file_path))
+        except (ValueError, IndexError) as e:
+            invalid.append((file_path, e))
+    dated.sort()
+    return [file_path for _, file_path in dated], invalid
+
+
+# Funzione per inserire un elemento in una coda limitata, interrompibile
+def _put(queue: Queue, item, halt: threading.Event) -> bool:
+    '''Attende lo spazio libero e inserisce l'elemento nella coda; restituisce False se l'elaborazione è stata interrotta.'''
+    while not halt.is_set():
+        try:
+            queue.put(item, timeout=_POLL_SECONDS)
+            return True
+        except Full:
+            pass
+    return False
+
+
+# Funzione per prelevare un elemento da una coda, interrompibile
+def _get(queue: Queue, halt: threading.Event):
+    '''Attende e preleva il prossimo elemento della coda; restituisce _END se l'elaborazione è stata interrotta.'''
+    while not halt.is_set():
+        try:
+            return queue.get(timeout=_POLL_SECONDS)
+        except Empty:
+            pass
+    return _END
+
+
+# Funzione per eseguire la conversione e il caricamento di un gruppo di file
+def run_batch(file_paths: list, db_url: str, workers: int = None, notify=None, stop_event: threading.Event = None,
+              geometry_table: str = 'cell_geom_table', swe_table: str = 'cell_daily_swe_table', chunk_mb: int = None,
+              sparse_mode: str = None, tolerance: float = 0.0, force: bool = False, report_path: str = None,
+              raster_table: str = None, parquet_dir: str = None, resampling: str = None,
+              queue_size: int = DEFAULT_QUEUE_SIZE, check_mode: str = 'local', reprocess: bool = False,
+              zone_table: str = None, zonal_table: str = None, cancel_on_stop: bool = False) -> list:
+    '''
+    Converte e carica un gruppo di file GeoTIFF a pipeline (lettura e conversione, controllo, caricamento),
+    convertendo fino a 'workers' file in parallelo. \n
+    Args:
+        file_paths: La lista dei percorsi dei file GeoTIFF.
+        db_url: L'URL di connessione al database PostgreSQL. Se None i file vengono scritti solo nel dataset Parquet di parquet_dir.
+        workers: Il numero di processi di conversione. Se None usa il numero di core; con 1 la conversione avviene nel thread di lettura.
+        notify: Funzione chiamata con una tupla per ogni evento di avanzamento (ad esempio queue.put).
+        stop_event: Evento che, se impostato, interrompe tutte le fasi dell'elaborazione.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        swe_table: Il nome della tabella dei dati SWE nel database.
+        chunk_mb: Se indicato, ogni file viene letto e caricato a blocchi di circa chunk_mb MB nel processo corrente.
+        sparse_mode: La modalità di archiviazione ridotta ('zero' o 'delta', vedi sparse_storage), oppure None per salvare tutte le righe.
+        tolerance: La tolleranza in mm usata dalla modalità di archiviazione ridotta.
+        force: Se True vengono caricati anche i file che il manifest indica come già caricati e invariati.
+            Senza force, con parquet_dir e database, i file già caricati nel database ma non ancora nel dataset Parquet
+            (secondo la voce del dataset nel manifest) vengono convertiti e scritti solo nel dataset Parquet.
+        report_path: Il percorso, senza estensione, del report delle fasi. Se None viene creato in metrics.REPORT_DIR.
+        raster_table: Se indicato, ogni file viene salvato per intero come un'unica riga di questa tabella (vedi raster_storage).
+        parquet_dir: Se indicata, i dati convertiti vengono scritti anche nel dataset Parquet in questa cartella (vedi parquet_sink).
+        resampling: Se indicato, i file vengono riproiettati sulla griglia della tabella delle geometrie con questo metodo
+            di ricampionamento (vedi reprojection) invece di essere scartati se CRS o pixel non corrispondono.
+        queue_size: Il numero massimo di blocchi in attesa in ogni coda tra due fasi.
+        check_mode: 'local' per controllare gli ID con l'indice locale dei cell_id, 'server' con un anti-join sul database
+            senza scaricare gli ID della tabella delle geometrie (vedi geoTIFF_converter.geometry_check_server).
+        reprocess: Se True, per i raster corretti, le righe già presenti vengono aggiornate solo se il valore è cambiato
+            (vedi geoTIFF_converter.dataframe_to_postgresql). I file invariati restano saltati grazie al manifest.
+        zone_table: Se indicata, la tabella PostGIS delle zone (colonne zone_id e geom) di cui calcolare, per ogni file caricato,
+            le statistiche zonali (vedi zonal_stats). Le maschere delle zone vengono rasterizzate una sola volta per griglia.
+        zonal_table: La tabella delle statistiche zonali. Se None viene usato '<zone_table>_swe'.
+        cancel_on_stop: Se True lo stop_event annulla anche le query in corso, invece di attendere la fine del blocco;
+            senza pool e senza chunk_mb i file vengono letti a finestre, per interrompere anche la lettura in corso. \n
+    Returns:
+        list: La lista dei file per cui la conversione o il caricamento sono falliti. \n
+    '''
+    from contextlib import nullcontext
+    from db_session import UploadSession
+    from parquet_sink import ParquetSink
+    from reprojection import warp_target
+    from zonal_stats import ZonalStats
+    if db_url is None and not parquet_dir:
+        raise ValueError("Indicare l'URL del database o la cartella del dataset Parquet.")
+    if resampling and db_url is None:
+        raise ValueError("La riproiezione richiede il database, da cui legge la griglia della tabella delle geometrie.")
+    if reprocess and sparse_mode:
+        raise ValueError("La rielaborazione non è compatibile con l'archiviazione ridotta.")
+    if zone_table and db_url is None:
+        raise ValueError("Le statistiche zonali richiedono il database, da cui leggono le zone.")
+    if queue_size < 1:
+        raise ValueError("La dimensione delle code deve essere almeno 1.")
+    parquet_sink = ParquetSink(parquet_dir) if parquet_dir else None
+    notify = notify or (lambda event: None)
+    stop_event = stop_event or threading.Event()
+    workers = max(1, workers or os.cpu_count() or 1)
+    # La conversione a blocchi avviene nel thread di lettura, per non trasferire i blocchi tra processi
+    if chunk_mb and workers > 1:
+        logging.info("Conversione a blocchi attiva: i file vengono convertiti nel processo corrente.")
+        workers = 1
+    # I raster salvati per intero non vengono convertiti in righe: non serve il pool di processi
+    if raster_table:
+        workers = 1
+    # Per poter interrompere la lettura nel thread corrente, il file viene letto a finestre invece che per intero
+    elif cancel_on_stop and workers == 1 and not chunk_mb:
+        from geoTIFF_converter import DEFAULT_CHUNK_MB
+        chunk_mb = DEFAULT_CHUNK_MB
+
+    # Ordina i file per data e segnala subito quelli con nome non valido
+    ordered, invalid = sort_files_by_date(file_paths)
+    failed = []
+    for file_path, error in invalid:
+        logging.error(f"Errore nel nome del file {os.path.basename(file_path)}: {error}")
+        failed.append(file_path)
+        notify(("error", file_path, str(error)))
+    logging.info(f"Elaborazione di {len(ordered)} file con {workers} processi di conversione.")
+
+    # Apre un'unica sessione sul database per tutti i file e raccoglie le misure delle fasi
+    run_metrics = metrics.start_run()
+    try:
+        with UploadSession(db_url) if db_url else nullcontext() as session:
+            warp = warp_target(session, geometry_table, resampling) if resampling else None
+            zonal = ZonalStats(session, zone_table, zonal_table) if zone_table else None
+            # Salta, prima della conversione, i file già caricati e invariati secondo il manifest; i file già caricati
+            # nel database ma non nel dataset Parquet vengono scritti solo nel dataset
+            indexed = list(enumerate(ordered, start=len(invalid) + 1))
+            sink_only = set()
+            if not force and session is not None:
+                manifest = session.manifest(raster_table or swe_table)
+                sink_manifest = session.manifest(parquet_sink.manifest_key) if parquet_sink is not None and not raster_table else None
+                to_load, already_loaded = [], 0
+                for idx, file_path in indexed:
+                    try:
+                        loaded = manifest.is_loaded(file_path)
+                        if loaded and sink_manifest is not None and not sink_manifest.is_loaded(file_path):
+                            loaded = False
+                            sink_only.add(idx)
+                    except OSError as e:
+                        # File scomparso o non leggibile: viene segnalato senza interrompere gli altri
+                        logging.error(f"Errore nella lettura del file {os.path.basename(file_path)}: {e}")
+                        failed.append(file_path)
+                        notify(("error", file_path, str(e)))
+                        continue
+                    if loaded:
+                        already_loaded += 1
+                        notify(("update", file_path, idx))
+                        notify(("log", f"Già caricato, saltato: {file_path}"))
+                    else:
+                        to_load.append((idx, file_path))
+                if already_loaded:
+                    logging.info(f"File già caricati e invariati saltati: {already_loaded}.")
+                if sink_only:
+                    logging.info(f"File già caricati nel database da scrivere solo nel dataset Parquet: {len(sink_only)}.")
+                indexed = to_load
+
+            # Le fasi di lettura e controllo lavorano in thread separati, collegati allo scrittore da code limitate
+            halt = threading.Event()
+            converted, checked = Queue(maxsize=queue_size), Queue(maxsize=queue_size)
+            options = {'session': session, 'geometry_table': geometry_table, 'swe_table': swe_table,
+                       'sparse_mode': sparse_mode, 'tolerance': tolerance, 'parquet_sink': parquet_sink, 'check_mode': check_mode,
+                       'reprocess': reprocess}
+            stages = [
+                threading.Thread(target=_read_stage, name='swe-read', daemon=True,
+                                 args=(indexed, workers, chunk_mb, None if raster_table else options, warp, converted, halt, sink_only,
+                                       None if raster_table else zonal)),
+                threading.Thread(target=_check_stage, name='swe-check', daemon=True, args=(converted, checked, halt)),
+            ]
+            if cancel_on_stop and session is not None:
+                stages.append(threading.Thread(target=_cancel_stage, name='swe-cancel', daemon=True, args=(session, stop_event, halt)))
+            for thread in stages:
+                thread.start()
+            try:
+                _write_stage(checked, session, raster_table, swe_table, warp, reprocess, zonal, failed, notify, stop_event)
+            finally:
+                # Ferma le fasi ancora attive (interruzione o errore dello scrittore) e attende che terminino
+                halt.set()
+                for thread in stages:
+                    thread.join()
+    finally:
+        metrics.end_run()
+        # Salva il report delle fasi, anche se l'elaborazione è stata interrotta
+        try:
+            json_path, csv_path = run_metrics.write_report(report_path)
+            notify(("log", f"Report dell'elaborazione salvato in: {json_path}, {csv_path}"))
+        except OSError as e:
+            logging.error(f"Impossibile salvare il report dell'elaborazione: {e}")
+    return failed
+
+
+# Funzione della fase di lettura e conversione
+def _read_stage(indexed: list, workers: int, chunk_mb: int, options: dict, warp: dict, output: Queue, halt: threading.Event,
+                sink_only: set = frozenset(), zonal=None) -> None:
+    '''
+    Legge e converte i file, indicati come coppie (indice, percorso) ordinate, e inserisce nella coda di uscita
+    gli elementi (tipo, indice, percorso, caricamento, dati) nell'ordine dei file: ('file', ...) all'inizio di ogni file,
+    ('chunk', ..., blocco) per ogni blocco convertito, ('end', ..., statistiche zonali) alla fine del file
+    o ('error', ..., eccezione). Con zonal le somme per zona vengono calcolate qui dai blocchi convertiti
+    e allo scrittore arrivano solo le statistiche delle zone (None senza zonal).
+    Senza options (raster salvati per intero) i file non vengono convertiti e lo scrittore li elabora per intero.
+    I file con indice in sink_only vengono scritti solo nel dataset Parquet, senza sessione sul database. \n
+    '''
+    from geoTIFF_converter import FileUpload, add_zone_chunk, convert_file_with_stats, iter_file_chunks, zone_accumulator
+
+    # Funzione che prepara il caricamento di un file
+    def new_upload(idx, file_path):
+        return FileUpload(file_path, **(dict(options, session=None) if idx in sink_only else options))
+
+    try:
+        # Esecuzione nel thread corrente
+        if workers == 1:
+            for idx, file_path in indexed:
+                upload = None
+                try:
+                    zones = None
+                    if options is not None:
+                        upload = new_upload(idx, file_path)
+                        date = is_valid_file(os.path.basename(file_path))
+                        chunks = iter_file_chunks(file_path, date, nivological_year(date), chunk_mb, warp)
+                        if zonal is not None and idx not in sink_only:
+                            zones = zone_accumulator(file_path, date, zonal, warp)
+                    else:
+                        chunks = []
+                    if not _put(output, ('file', idx, file_path, upload, None), halt):
+                        return
+                    with metrics.for_file(file_path):
+                        for chunk in chunks:
+                            if zones is not None:
+                                add_zone_chunk(zones, chunk)
+                            if not _put(output, ('chunk', idx, file_path, upload, chunk), halt):
+                                return
+                    item = ('end', idx, file_path, upload, zones.results() if zones is not None else None)
+                except Exception as e:
+                    item = ('error', idx, file_path, upload, e)
+                if not _put(output, item, halt):
+                    return
+            return
+
+        # Esecuzione con un pool di processi: al massimo 2 * workers file in conversione o convertiti in attesa
+        context = multiprocessing.get_context('spawn')
+        # Ogni processo del pool comunica il proprio pid all'avvio, per poterlo terminare con l'interruzione
+        worker_pids = context.Queue()
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_report_worker_pid,
+                                       initargs=(worker_pids,))
+        try:
+            files = iter(indexed)
+            pending = deque()
+
+            # Funzione che sottomette il prossimo file al pool
+            def submit_next():
+                item = next(files, None)
+                if item is not None:
+                    idx, file_path = item
+                    pending.append((idx, file_path, executor.submit(convert_file_with_stats, file_path, warp)))
+
+            for _ in range(2 * workers):
+                submit_next()
+            try:
+                # I file vengono passati alle fasi successive nell'ordine di sottomissione, cioè in ordine di data
+                while pending and not halt.is_set():
+                    idx, file_path, future = pending.popleft()
+                    submit_next()
+                    # Attende la conversione controllando l'interruzione
+                    while not future.done():
+                        if halt.wait(_POLL_SECONDS):
+                            return
+                    try:
+                        (date, snow_year, df, crs, transform), records = future.result()
+                        metrics.add_records(records)
+                        logging.info(f"File '{os.path.basename(file_path)}' convertito: {len(df)} righe non nulle")
+                        upload = new_upload(idx, file_path)
+                        zone_results = None
+                        if zonal is not None and idx not in sink_only:
+                            with metrics.for_file(file_path):
+                                zones = zone_accumulator(file_path, date, zonal, warp)
+                                add_zone_chunk(zones, (df, crs, transform))
+                            zone_results = zones.results()
+                        items = [('file', idx, file_path, upload, None), ('chunk', idx, file_path, upload, (df, crs, transform)),
+                                 ('end', idx, file_path, upload, zone_results)]
+                    except Exception as e:
+                        items = [('error', idx, file_path, None, e)]
+                    for item in items:
+                        if not _put(output, item, halt):
+                            return
+            finally:
+                # Annulla le conversioni non ancora iniziate
+                for _, _, future in pending:
+                    future.cancel()
+        finally:
+            # Con l'interruzione termina le conversioni già avviate, il cui risultato verrebbe scartato
+            if halt.is_set():
+                _terminate_workers(executor, worker_pids)
+            executor.shutdown(wait=not halt.is_set(), cancel_futures=True)
+            worker_pids.close()
+    finally:
+        _put(output, _END, halt)
+
+
+# Funzione per terminare i processi di un pool
+def _terminate_workers(executor: ProcessPoolExecutor, worker_pids) -> None:
+    '''
+    Termina i processi del pool, interrompendo le conversioni in corso: da Python 3.14 con ProcessPoolExecutor.terminate_workers,
+    altrimenti con i pid comunicati dai processi all'avvio (vedi _report_worker_pid). \n
+    Args:
+        executor: Il pool di processi.
+        worker_pids: La coda multiprocessing in cui i processi del pool hanno scritto il proprio pid. \n
+    '''
+    terminate = getattr(executor, 'terminate_workers', None)
+    if terminate is not None:
+        terminate()
+        return
+    while True:
+        try:
+            pid = worker_pids.get_nowait()
+        except Empty:
+            return
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            # Processo già terminato
+            pass
+
+
+# Funzione eseguita all'avvio di ogni processo del pool
+def _report_worker_pid(worker_pids) -> None:
+    '''Scrive il pid del processo nella coda, così il processo può essere terminato con l'interruzione (vedi _terminate_workers).'''
+    worker_pids.put(os.getpid())
+
+
+# Funzione della fase di controllo delle geometrie
+def _check_stage(source: Queue, output: Queue, halt: threading.Event) -> None:
+    '''
+    Controlla CRS e ID dei blocchi ricevuti dalla fase di lettura, aggiungendo le geometrie mancanti, e li passa allo scrittore. \n
+    Un errore di controllo viene passato allo scrittore al posto del blocco e i blocchi successivi dello stesso file vengono scartati.
+    '''
+    failed = set()
+    try:
+        while True:
+            item = _get(source, halt)
+            if item is _END:
+                return
+            kind, idx, file_path, upload, data = item
+            if idx in failed:
+                continue
+            if kind == 'chunk':
+                try:
+                    with metrics.for_file(file_path):
+                        upload.check(data)
+                except Exception as e:
+                    failed.add(idx)
+                    item = ('error', idx, file_path, upload, e)
+            if not _put(output, item, halt):
+                return
+    finally:
+        _put(output, _END, halt)
+
+
+# Funzione che annulla le query in corso quando viene richiesta l'interruzione
+def _cancel_stage(session, stop_event: threading.Event, halt: threading.Event) -> None:
+    '''
+    Attende lo stop_event e, finché le fasi non sono terminate, annulla le query in corso sulla sessione:
+    l'annullamento viene ripetuto perché una query avviata subito dopo il primo annullamento non resti in esecuzione. \n
+    '''
+    logged = False
+    while not halt.wait(_POLL_SECONDS):
+        if stop_event.is_set():
+            cancelled = session.cancel()
+            if not logged:
+                logging.warning(f"Interruzione: annullamento delle query in corso su {cancelled} connessioni.")
+                logged = True
+
+
+# Funzione della fase di caricamento
+def _write_stage(source: Queue, session, raster_table: str, swe_table: str, warp: dict, reprocess: bool, zonal, failed: list, notify,
+                 stop_event: threading.Event) -> None:
+    '''
+    Carica i blocchi controllati nell'ordine ricevuto, salva le statistiche zonali dei file completati (con zonal),
+    registra i file caricati nel manifest (anche nella voce del dataset Parquet) e notifica l'esito di ogni file.
+    Si ferma alla fine del flusso o, tra un blocco e l'altro, quando viene impostato lo stop_event. \n
+    '''
+    from geoTIFF_converter import upload_file
+    # File in caricamento: indice -> istante di inizio; file falliti, di cui scartare i blocchi successivi
+    started = {}
+    skipped = set()
+    while True:
+        item = _get(source, stop_event)
+        if stop_event.is_set():
+            notify(("log", "Elaborazione interrotta."))
+            return
+        if item is _END:
+            return
+        kind, idx, file_path, upload, data = item
+        if idx in skipped:
+            continue
+        try:
+            if kind == 'error':
+                raise data
+            if kind == 'file':
+                started[idx] = time.time()
+                notify(("update", file_path, idx))
+                if upload is not None:
+                    upload.start()
+            elif kind == 'chunk':
+                with metrics.for_file(file_path):
+                    upload.load(data)
+            else:
+                date = is_valid_file(os.path.basename(file_path))
+                # Raster salvati per intero: lettura e caricamento avvengono nello scrittore
+                if upload is None:
+                    counts = upload_file(file_path, date, nivological_year(date), session, raster_table=raster_table, warp=warp,
+                                         reprocess=reprocess, zonal=zonal)
+                else:
+                    counts = upload.finish()
+                # I file scritti solo nel dataset Parquet sono già caricati nel database
+                loaded_in_db = session is not None and (upload is None or upload.session is not None)
+                # Statistiche zonali sommate dalla fase di lettura (i raster per intero le salvano in upload_file)
+                if zonal is not None and data is not None:
+                    with metrics.for_file(file_path):
+                        zonal.write(data, reprocess)
+                if loaded_in_db:
+                    session.manifest(raster_table or swe_table).record(file_path, date, counts)
+                if session is not None and upload is not None and upload.parquet_sink is not None:
+                    session.manifest(upload.parquet_sink.manifest_key).record(file_path, date, counts)
+                notify(("log", f"Completato: {file_path}"))
+                logging.info(f"Tempo totale di esecuzione per '{os.path.basename(file_path)}': "
+                             f"{time.time() - started.pop(idx):.2f} secondi")
+        except Exception as e:
+            # Con l'interruzione le query annullate non sono errori del file, che verrà caricato alla prossima elaborazione
+            if stop_event.is_set():
+                logging.warning(f"Elaborazione di '{os.path.basename(file_path)}' interrotta: transazione in corso annullata.")
+                notify(("log", "Elaborazione interrotta."))
+                return
+            logging.error(f"Errore durante l'elaborazione di '{os.path.basename(file_path)}': {e}", exc_info=True)
+            skipped.add(idx)
+            started.pop(idx, None)
+            failed.append(file_path)
+            notify(("error", file_path, str(e)))
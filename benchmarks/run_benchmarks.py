@@ -0,0 +1,276 @@
+'''
+Questo modulo esegue i benchmark della conversione e del caricamento su GeoTIFF sintetici. \n
+Per ogni combinazione di dimensione, frazione di noData e tipo di dato viene generato un raster (vedi synthetic.py)
+e vengono misurate le fasi della pipeline: lettura del raster, conversione in dataframe (costruzione degli ID),
+controllo delle geometrie con indice freddo, inserimento delle geometrie mancanti, controllo con indice caldo
+e caricamento nella tabella SWE. Per ogni fase vengono registrati durata, righe/s, MB/s (riferiti ai byte del raster)
+e picco di memoria residente (RSS) del processo; per la conversione anche la crescita del picco per megapixel
+del raster, da confrontare con l'obiettivo geoTIFF_converter.PEAK_MB_PER_MEGAPIXEL. \n
+Ogni caso viene eseguito in un processo separato, così il picco di memoria è relativo al solo caso.
+Il database è un'istanza PostgreSQL/PostGIS temporanea creata con initdb e pg_ctl (che devono essere nel PATH o indicati
+con --pg-bin), oppure un database esistente indicato con --db-url, in cui vengono create e poi eliminate tabelle di prova. \n
+I risultati vengono salvati in un file JSON con il commit corrente, per confrontare esecuzioni su commit diversi (--compare). \n
+Esempio:
+    python benchmarks/run_benchmarks.py --sizes 1000x1000 4000x4000 --nodata 0.3 --dtypes float32 int16
+    python benchmarks/run_benchmarks.py --db-url postgresql+psycopg2://user:pw@localhost/bench --compare results_old.json
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Rende importabili i moduli dell'applicazione e il generatore sintetico
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+for path in (REPO_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Tabelle di prova create nel database dei benchmark
+GEOMETRY_TABLE = 'bench_cell_geom_table'
+SWE_TABLE = 'bench_cell_daily_swe_table'
+
+
+# Classe per un'istanza PostgreSQL temporanea
+class LocalPostgres:
+    '''Istanza PostgreSQL temporanea, creata in una cartella temporanea e distrutta all'uscita.'''
+    # Metodo di inizializzazione della classe LocalPostgres
+    def __init__(self, pg_bin: str = None):
+        '''Inizializza l'istanza, cercando initdb e pg_ctl in pg_bin o nel PATH.'''
+        self.pg_bin = pg_bin
+        self.data_dir = None
+        self.port = None
+
+    # Metodo per ottenere il percorso di un eseguibile di PostgreSQL
+    def _exe(self, name: str) -> str:
+        path = os.path.join(self.pg_bin, name) if self.pg_bin else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise RuntimeError(f"Eseguibile '{name}' di PostgreSQL non trovato: indicare --pg-bin oppure --db-url.")
+        return path
+
+    def __enter__(self):
+        self.data_dir = tempfile.mkdtemp(prefix='swe_bench_pg_')
+        # Sceglie una porta libera
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        subprocess.run([self._exe('initdb'), '-D', self.data_dir, '-U', 'bench', '--auth=trust'],
+                       check=True, capture_output=True)
+        options = f"-p {self.port} -k {self.data_dir} -c listen_addresses=127.0.0.1 -c fsync=off"
+        subprocess.run([self._exe('pg_ctl'), '-D', self.data_dir, '-o', options, '-w', '-l',
+                        os.path.join(self.data_dir, 'server.log'), 'start'], check=True, capture_output=True)
+        return f"postgresql+psycopg2://bench@127.0.0.1:{self.port}/postgres"
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        subprocess.run([self._exe('pg_ctl'), '-D', self.data_dir, '-m', 'immediate', 'stop'], capture_output=True)
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+# Funzione per creare le tabelle di prova
+def create_tables(db_url: str, epsg: int) -> None:
+    '''Crea l'estensione PostGIS e le tabelle di prova, eliminando quelle di esecuzioni precedenti.'''
+    from sqlalchemy import create_engine, text
+    engine = create_engine(db_url)
+    try:
+        with engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS postgis;'))
+            connection.execute(text(f'DROP TABLE IF EXISTS {SWE_TABLE}, {GEOMETRY_TABLE};'))
+            connection.execute(text(f'''
+                CREATE TABLE {GEOMETRY_TABLE} (cell_id text PRIMARY KEY, cell_geom geometry(Polygon, {epsg}));
+                CREATE TABLE {SWE_TABLE} (
+                    cell_id text NOT NULL, snow_year integer NOT NULL, date date NOT NULL, swe_mm real,
+                    PRIMARY KEY (cell_id, snow_year, date)
+                );
+            '''))
+    finally:
+        engine.dispose()
+
+
+# Funzione per eliminare le tabelle di prova
+def drop_tables(db_url: str) -> None:
+    '''Elimina le tabelle di prova.'''
+    from sqlalchemy import create_engine, text
+    engine = create_engine(db_url)
+    try:
+        with engine.begin() as connection:
+            connection.execute(text(f'DROP TABLE IF EXISTS {SWE_TABLE}, {GEOMETRY_TABLE};'))
+    finally:
+        engine.dispose()
+
+
+# Funzione per leggere il picco di memoria residente del processo in MB
+def peak_rss_mb():
+    '''Restituisce il picco di memoria residente del processo corrente, in MB, oppure None se non disponibile.'''
+    try:
+        import resource
+    except ImportError:
+        # Il modulo resource non è disponibile su Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+# Funzione per eseguire un caso di benchmark in un processo separato
+def run_case(case: dict, db_url: str, work_dir: str) -> dict:
+    '''
+    Genera il raster del caso ed esegue e misura le fasi della pipeline. \n
+    Args:
+        case: Il dizionario del caso con 'width', 'height', 'nodata_fraction' e 'dtype'.
+        db_url: L'URL di connessione al database dei benchmark.
+        work_dir: La cartella in cui generare il raster e l'indice dei cell_id. \n
+    Returns:
+        dict: Il caso con l'elenco delle fasi misurate. \n
+    '''
+    # L'indice dei cell_id viene salvato nella cartella di lavoro e non nella cache dell'utente
+    os.environ['SWE_CACHE_DIR'] = os.path.join(work_dir, 'cell_index')
+    import numpy as np
+    import rasterio
+    from synthetic import generate_swe_raster
+    from db_session import UploadSession
+    from functions import nivological_year
+    from geoTIFF_converter import geoTIFF_to_dataframe, geometry_check, add_missing_geometries, dataframe_to_postgresql
+
+    date = '2024-02-01'
+    case_dir = os.path.join(work_dir, f"{case['width']}x{case['height']}_{case['dtype']}_{case['nodata_fraction']}")
+    path = generate_swe_raster(case_dir, date, case['width'], case['height'], case['nodata_fraction'], dtype=case['dtype'])
+    raster_mb = case['width'] * case['height'] * np.dtype(case['dtype']).itemsize / 2 ** 20
+    stages = []
+
+    # Funzione che esegue e misura una fase
+    def measure(name, function, rows=None):
+        rss_before = peak_rss_mb()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        n_rows = rows(result) if callable(rows) else rows
+        stages.append({
+            'stage': name, 'seconds': round(elapsed, 4), 'rows': n_rows,
+            'rows_per_s': round(n_rows / elapsed, 1) if n_rows and elapsed else None,
+            'mb_per_s': round(raster_mb / elapsed, 2) if elapsed else None,
+            'peak_rss_mb': peak_rss_mb(),
+        })
+        # Crescita del picco di memoria durante la fase (il picco precedente non viene contato)
+        if rss_before is not None:
+            stages[-1]['peak_growth_mb'] = round(stages[-1]['peak_rss_mb'] - rss_before, 1)
+        return result
+
+    # Lettura del solo raster
+    def read():
+        with rasterio.open(path) as raster:
+            return raster.read(1).ravel()
+    measure('read', read, rows=lambda values: values.size)
+    # Conversione completa in dataframe (lettura, coordinate e costruzione degli ID)
+    df, crs, transform = measure('convert', lambda: geoTIFF_to_dataframe(path, date, nivological_year(date)),
+                                 rows=lambda result: len(result[0]))
+    rows = len(df)
+    # Picco di memoria della conversione per megapixel del raster, da confrontare con PEAK_MB_PER_MEGAPIXEL
+    convert_stage = stages[-1]
+    if convert_stage.get('peak_growth_mb') is not None:
+        convert_stage['mb_per_megapixel'] = round(convert_stage['peak_growth_mb'] / (case['width'] * case['height'] / 1e6), 1)
+    create_tables(db_url, crs.to_epsg())
+    try:
+        with UploadSession(db_url) as session:
+            missing = measure('geometry_check_cold', lambda: geometry_check(df['cell_id'], crs, transform, GEOMETRY_TABLE, session), rows)
+            measure('geometry_insert', lambda: add_missing_geometries(missing, crs, GEOMETRY_TABLE, session), len(missing))
+            measure('geometry_check_warm', lambda: geometry_check(df['cell_id'], crs, transform, GEOMETRY_TABLE, session), rows)
+            measure('upload', lambda: dataframe_to_postgresql(df, SWE_TABLE, session), rows)
+    finally:
+        drop_tables(db_url)
+    return {**case, 'raster_mb': round(raster_mb, 2), 'valid_rows': rows, 'stages': stages}
+
+
+# Funzione per confrontare due file di risultati
+def compare(current: dict, previous: dict) -> None:
+    '''Stampa il rapporto tra le durate delle fasi di due esecuzioni (valori < 1 indicano un miglioramento).'''
+    def key(case):
+        return (case['width'], case['height'], case['nodata_fraction'], case['dtype'])
+    previous_cases = {key(case): case for case in previous['cases']}
+    print(f"Confronto con il commit {previous.get('commit', '?')[:10]}:")
+    for case in current['cases']:
+        old = previous_cases.get(key(case))
+        if old is None:
+            continue
+        old_stages = {stage['stage']: stage for stage in old['stages']}
+        for stage in case['stages']:
+            old_stage = old_stages.get(stage['stage'])
+            if old_stage and old_stage['seconds']:
+                ratio = stage['seconds'] / old_stage['seconds']
+                print(f"  {key(case)} {stage['stage']:>20}: {old_stage['seconds']:.3f}s -> {stage['seconds']:.3f}s (x{ratio:.2f})")
+
+
+# Funzione per ottenere il commit corrente del repository
+def git_commit() -> str:
+    '''Restituisce l'hash del commit corrente, oppure 'unknown'.'''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# Funzione principale dei benchmark
+def main(argv: list = None) -> int:
+    '''Esegue i benchmark e salva i risultati in JSON.'''
+    parser = argparse.ArgumentParser(description="Benchmark della conversione e del caricamento dei GeoTIFF SWE.")
+    parser.add_argument('--sizes', nargs='+', default=['1000x1000'], help="Dimensioni dei raster nel formato LARGHEZZAxALTEZZA.")
+    parser.add_argument('--nodata', nargs='+', type=float, default=[0.3], help="Frazioni di celle noData.")
+    parser.add_argument('--dtypes', nargs='+', default=['float32'], help="Tipi di dato dei raster.")
+    parser.add_argument('--db-url', help="Database esistente da usare al posto dell'istanza temporanea.")
+    parser.add_argument('--pg-bin', help="Cartella degli eseguibili di PostgreSQL (initdb, pg_ctl).")
+    parser.add_argument('--output', help="File JSON dei risultati (predefinito: benchmarks/results/<commit>.json).")
+    parser.add_argument('--compare', help="File JSON di una esecuzione precedente da confrontare.")
+    args = parser.parse_args(argv)
+
+    cases = []
+    for size in args.sizes:
+        width, height = (int(value) for value in size.lower().split('x'))
+        for nodata_fraction in args.nodata:
+            for dtype in args.dtypes:
+                cases.append({'width': width, 'height': height, 'nodata_fraction': nodata_fraction, 'dtype': dtype})
+
+    commit = git_commit()
+    results = {'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'cases': []}
+    work_dir = tempfile.mkdtemp(prefix='swe_bench_')
+    context = multiprocessing.get_context('spawn')
+    try:
+        database = LocalPostgres(args.pg_bin) if not args.db_url else None
+        db_url = database.__enter__() if database else args.db_url
+        try:
+            for case in cases:
+                # Un processo nuovo per ogni caso, per misurare il picco di memoria del solo caso
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_case, case, db_url, work_dir).result()
+                results['cases'].append(result)
+                for stage in result['stages']:
+                    print(f"{case['width']}x{case['height']} {case['dtype']} nodata={case['nodata_fraction']} "
+                          f"{stage['stage']:>20}: {stage['seconds']:8.3f}s {stage['rows_per_s'] or 0:12.0f} righe/s "
+                          f"{stage['mb_per_s'] or 0:8.1f} MB/s RSS {stage['peak_rss_mb'] or 0:.0f} MB"
+                          + (f" ({stage['mb_per_megapixel']:.0f} MB/Mpx)" if stage.get('mb_per_megapixel') is not None else ""))
+        finally:
+            if database:
+                database.__exit__(None, None, None)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"{commit[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Risultati salvati in {output}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+'''
+Questo modulo genera GeoTIFF SWE sintetici per i benchmark. \n
+I raster hanno il nome 'SWE_YYYY-MM-DD.tif', pixel di 500 m, CRS configurabile (predefinito EPSG:32632)
+e un campo di SWE liscio, con una frazione configurabile di celle noData e di celle a 0. \n
+Esempio:
+    python benchmarks/synthetic.py /tmp/swe --width 2000 --height 2000 --nodata-fraction 0.4 --dtype float32
+'''
+import os
+import argparse
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+# Origine predefinita della griglia (angolo superiore sinistro, UTM 32N sull'arco alpino)
+DEFAULT_ORIGIN = (300000, 5250000)
+
+
+# Funzione per generare un GeoTIFF SWE sintetico
+def generate_swe_raster(output_dir: str, date: str = '2024-02-01', width: int = 1000, height: int = 1000,
+                        nodata_fraction: float = 0.3, zero_fraction: float = 0.3, dtype: str = 'float32',
+                        epsg: int = 32632, origin: tuple = DEFAULT_ORIGIN, block_size: int = 256, seed: int = 0) -> str:
+    '''
+    Genera un GeoTIFF SWE sintetico con celle noData e celle senza neve. \n
+    Args:
+        output_dir: La cartella in cui salvare il file.
+        date: La data del raster nel formato 'YYYY-MM-DD', usata nel nome del file.
+        width: Il numero di colonne del raster.
+        height: Il numero di righe del raster.
+        nodata_fraction: La frazione di celle noData (raggruppate ai bordi del dominio).
+        zero_fraction: La frazione di celle valide con SWE pari a 0.
+        dtype: Il tipo dei dati del raster (ad esempio 'float32', 'float64', 'int16', 'uint16').
+        epsg: Il codice EPSG del CRS del raster.
+        origin: Le coordinate (x, y) dell'angolo superiore sinistro.
+        block_size: Il lato dei blocchi interni del file (tiled).
+        seed: Il seme del generatore di numeri casuali. \n
+    Returns:
+        str: Il percorso del file generato. \n
+    '''
+    rng = np.random.default_rng(seed)
+    is_integer = np.issubdtype(np.dtype(dtype), np.integer)
+    nodata = np.iinfo(dtype).max if is_integer else -9999.0
+
+    # Campo liscio: somma di onde con ampiezza e fase casuali, scalato in mm
+    rows = np.linspace(0, 4 * np.pi, height, dtype=np.float32)[:, None]
+    cols = np.linspace(0, 4 * np.pi, width, dtype=np.float32)[None, :]
+    field = np.zeros((height, width), dtype=np.float32)
+    for _ in range(4):
+        amplitude, phase_r, phase_c = rng.uniform(0.5, 1.5), rng.uniform(0, np.pi), rng.uniform(0, np.pi)
+        field += amplitude * np.sin(rows + phase_r) * np.cos(cols + phase_c)
+    # Le celle sotto il quantile zero_fraction diventano 0, le altre valori positivi in mm
+    threshold = np.quantile(field, zero_fraction) if zero_fraction > 0 else field.min()
+    data = np.clip(field - threshold, 0, None) * 400
+    # Le celle noData sono quelle più lontane dal centro, per simulare un dominio irregolare
+    distance = np.hypot(rows - rows.mean(), cols - cols.mean())
+    if nodata_fraction > 0:
+        data[distance >= np.quantile(distance, 1 - nodata_fraction)] = nodata
+    data = data.astype(dtype)
+
+    # Scrive il GeoTIFF tiled e compresso
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"SWE_{date}.tif")
+    profile = {
+        'driver': 'GTiff', 'width': width, 'height': height, 'count': 1, 'dtype': dtype,
+        'crs': f"EPSG:{epsg}", 'transform': from_origin(origin[0], origin[1], 500, 500), 'nodata': nodata,
+        'tiled': True, 'blockxsize': block_size, 'blockysize': block_size, 'compress': 'deflate',
+    }
+    with rasterio.open(path, 'w', **profile) as raster:
+        raster.write(data, 1)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un GeoTIFF SWE sintetico.")
+    parser.add_argument('output_dir', help="Cartella di destinazione.")
+    parser.add_argument('--date', default='2024-02-01')
+    parser.add_argument('--width', type=int, default=1000)
+    parser.add_argument('--height', type=int, default=1000)
+    parser.add_argument('--nodata-fraction', type=float, default=0.3)
+    parser.add_argument('--zero-fraction', type=float, default=0.3)
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--epsg', type=int, default=32632)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(generate_swe_raster(args.output_dir, args.date, args.width, args.height, args.nodata_fraction,
+                              args.zero_fraction, args.dtype, args.epsg, seed=args.seed))
@@ -0,0 +1,220 @@
+'''
+Questo modulo mantiene un indice locale dei cell_id già presenti nella tabella delle geometrie del database. \n
+Gli ID vengono codificati come interi a 64 bit (coordinata x e coordinata y dell'angolo della cella)
+e conservati in un array numpy ordinato, in memoria per tutta la durata del processo e su disco
+in una cartella di cache, con un file per ogni coppia database/tabella. \n
+In questo modo il controllo degli ID mancanti diventa una ricerca in memoria, senza scaricare
+l'intera tabella delle geometrie a ogni file. \n
+L'indice su disco, e una volta per sessione di caricamento quello in memoria, viene confrontato con l'impronta
+della tabella (numero di righe e somma delle chiavi, calcolati dal database): una tabella svuotata e ripopolata,
+un database ripristinato o le geometrie aggiunte da un altro processo fanno ricostruire l'indice. \n
+'''
+import os
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+# Cartella in cui vengono salvati gli indici su disco (modificabile con la variabile d'ambiente SWE_CACHE_DIR)
+CACHE_DIR = os.environ.get('SWE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.swe_converter', 'cell_index'))
+# Fattore di codifica delle coordinate: chiave = x * KEY_FACTOR + y
+KEY_FACTOR = 10 ** 8
+# Numero di cifre di ciascuna coordinata nei cell_id
+_ID_DIGITS = 7
+# Modulo della somma delle chiavi nell'impronta della tabella (la somma in uint64 di numpy)
+_CHECKSUM_MODULUS = 2 ** 64
+
+# Indici già caricati nel processo corrente
+_indexes = {}
+
+
+# Funzione per decodificare le coordinate dei cell_id
+def cell_ids_to_coords(ids) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Decodifica i cell_id nel formato 'XXXXXXX_YYYYYYY' negli array delle coordinate x e y dell'angolo della cella. \n
+    Args:
+        ids: Una sequenza (lista, array o serie pandas) di cell_id. \n
+    Returns:
+        tuple: Gli array interi delle coordinate x e y, nello stesso ordine degli ID. \n
+    '''
+    coords = pd.Series(ids, dtype=object).str.split('_', n=1, expand=True)
+    return coords[0].astype(np.int64).to_numpy(), coords[1].astype(np.int64).to_numpy()
+
+
+# Funzione per codificare le coordinate come cell_id
+def coords_to_cell_ids(lons, lats) -> np.ndarray:
+    '''
+    Codifica le coordinate intere dell'angolo delle celle come cell_id nel formato 'XXXXXXX_YYYYYYY' (7 cifre con zeri iniziali). \n
+    Le cifre vengono scritte in un unico buffer di 15 byte per ID con operazioni vettoriali, senza gli array di stringhe
+    intermedi di np.char; le coordinate negative o con più di 7 cifre usano la formattazione generica. \n
+    Args:
+        lons: L'array delle coordinate x.
+        lats: L'array delle coordinate y. \n
+    Returns:
+        np.ndarray: L'array (di oggetti str) dei cell_id, nello stesso ordine delle coordinate. \n
+    '''
+    lons = np.asarray(lons, dtype=np.int64).ravel()
+    lats = np.asarray(lats, dtype=np.int64).ravel()
+    if len(lons) and (min(lons.min(), lats.min()) < 0 or max(lons.max(), lats.max()) >= 10 ** _ID_DIGITS):
+        ids = np.char.add(np.char.add(np.char.zfill(lons.astype(str), _ID_DIGITS), '_'), np.char.zfill(lats.astype(str), _ID_DIGITS))
+        return ids.astype(object)
+    buffer = np.empty((len(lons), 2 * _ID_DIGITS + 1), dtype=np.uint8)
+    buffer[:, _ID_DIGITS] = ord('_')
+    digit = np.empty(len(lons), dtype=np.int64)
+    # Scrive le cifre dalla meno significativa, riusando lo stesso array temporaneo
+    for offset, coords in ((0, lons), (_ID_DIGITS + 1, lats)):
+        for position in range(_ID_DIGITS - 1, -1, -1):
+            np.floor_divide(coords, 10 ** (_ID_DIGITS - 1 - position), out=digit)
+            np.remainder(digit, 10, out=digit)
+            digit += ord('0')
+            buffer[:, offset + position] = digit
+    return buffer.view(f'S{2 * _ID_DIGITS + 1}').ravel().astype(f'U{2 * _ID_DIGITS + 1}').astype(object)
+
+
+# Funzione per codificare i cell_id come chiavi intere
+def cell_ids_to_keys(ids) -> np.ndarray:
+    '''
+    Codifica i cell_id nel formato 'XXXXXXX_YYYYYYY' come chiavi intere a 64 bit. \n
+    Args:
+        ids: Una sequenza (lista, array o serie pandas) di cell_id. \n
+    Returns:
+        np.ndarray: L'array delle chiavi intere, nello stesso ordine degli ID. \n
+    '''
+    lons, lats = cell_ids_to_coords(ids)
+    return lons * KEY_FACTOR + lats
+
+
+# Funzione per calcolare l'impronta di un insieme di chiavi
+def key_fingerprint(keys: np.ndarray) -> tuple[int, int]:
+    '''
+    Calcola l'impronta di un indice, confrontabile con CellIdIndex.table_fingerprint. \n
+    Args:
+        keys: L'array delle chiavi intere dei cell_id. \n
+    Returns:
+        tuple: Il numero di chiavi e la loro somma modulo 2^64. \n
+    '''
+    return len(keys), int(np.asarray(keys).astype(np.uint64).sum(dtype=np.uint64))
+
+
+# Classe per l'indice dei cell_id presenti nella tabella delle geometrie
+class CellIdIndex:
+    '''Indice ordinato dei cell_id presenti in una tabella delle geometrie, persistito su disco.'''
+    # Metodo di inizializzazione della classe CellIdIndex
+    def __init__(self, db_url: str, geometry_table: str, cache_dir: str = CACHE_DIR):
+        '''Inizializza l'indice per la coppia database/tabella indicata.'''
+        self.geometry_table = geometry_table
+        self.keys = None
+        # Il file di cache è identificato dall'URL (senza password) e dal nome della tabella
+        safe_url = make_url(db_url).render_as_string(hide_password=True)
+        digest = hashlib.sha1(f"{safe_url}|{geometry_table}".encode('utf-8')).hexdigest()[:16]
+        self.cache_path = os.path.join(cache_dir, f"{geometry_table}_{digest}.npy")
+
+    # Metodo per leggere l'impronta della tabella delle geometrie
+    def table_fingerprint(self, engine) -> tuple[int, int]:
+        '''
+        Calcola con il database il numero di righe e la somma delle chiavi dei cell_id (modulo 2^64) della tabella. \n
+        Args:
+            engine: L'engine SQLAlchemy per la connessione al database. \n
+        Returns:
+            tuple: Il numero di righe e la somma delle chiavi. \n
+        '''
+        with engine.connect() as connection:
+            count, checksum = connection.execute(text(f'''
+                SELECT count, (checksum % :modulus + :modulus) % :modulus
+                FROM (SELECT count(*) AS count, coalesce(sum(split_part(cell_id, '_', 1)::numeric * :factor
+                                                             + split_part(cell_id, '_', 2)::numeric), 0) AS checksum
+                      FROM {self.geometry_table}) totals;
+            '''), {"factor": KEY_FACTOR, "modulus": _CHECKSUM_MODULUS}).fetchone()
+        return int(count), int(checksum)
+
+    # Metodo per caricare l'indice dal disco o dal database
+    def load(self, engine, revalidate: bool = False) -> None:
+        '''
+        Carica l'indice, se non è già in memoria o se, con revalidate, non corrisponde più alla tabella. \n
+        Un indice (in memoria o nel file di cache) viene usato solo quando numero di ID e somma delle chiavi coincidono
+        con l'impronta della tabella, altrimenti viene ricostruito scaricando i cell_id dal database. \n
+        Args:
+            engine: L'engine SQLAlchemy per la connessione al database.
+            revalidate: Se True anche l'indice già in memoria viene confrontato con la tabella. \n
+        '''
+        if self.keys is not None and not revalidate:
+            return
+        fingerprint = self.table_fingerprint(engine)
+        if self.keys is not None:
+            if key_fingerprint(self.keys) == fingerprint:
+                return
+            logging.info("Indice dei cell_id in memoria non aggiornato (tabella modificata), verrà ricostruito.")
+            self.keys = None
+        # Prova a usare l'indice salvato su disco
+        if os.path.exists(self.cache_path):
+            try:
+                keys = np.load(self.cache_path)
+                if key_fingerprint(keys) == fingerprint:
+                    self.keys = keys
+                    logging.info(f"Indice dei cell_id caricato dalla cache locale: {len(keys)} ID.")
+                    return
+                logging.info("Indice dei cell_id locale non aggiornato, verrà ricostruito.")
+            except (OSError, ValueError) as e:
+                logging.warning(f"Impossibile leggere l'indice dei cell_id locale: {e}")
+        # Ricostruisce l'indice dal database
+        logging.info(f"Download dei cell_id dalla tabella '{self.geometry_table}'.")
+        query = f'SELECT "cell_id" FROM {self.geometry_table}'
+        chunks = [cell_ids_to_keys(chunk["cell_id"]) for chunk in pd.read_sql(query, engine, chunksize=500_000)]
+        self.keys = np.unique(np.concatenate(chunks)) if chunks else np.empty(0, dtype=np.int64)
+        self._save()
+
+    # Metodo per trovare gli ID non presenti nell'indice
+    def missing(self, ids: pd.Series) -> list:
+        '''
+        Restituisce gli ID non presenti nell'indice. \n
+        Args:
+            ids: La serie dei cell_id da controllare. \n
+        Returns:
+            list: La lista dei cell_id mancanti. \n
+        '''
+        keys = cell_ids_to_keys(ids)
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return pd.Series(ids)[~found].tolist()
+
+    # Metodo per aggiungere nuovi ID all'indice
+    def add(self, ids: list) -> None:
+        '''
+        Aggiunge all'indice gli ID appena inseriti nella tabella delle geometrie e aggiorna la cache su disco. \n
+        Args:
+            ids: La lista dei cell_id da aggiungere. \n
+        '''
+        if self.keys is None or not len(ids):
+            return
+        self.keys = np.union1d(self.keys, cell_ids_to_keys(ids))
+        self._save()
+
+    # Metodo per salvare l'indice su disco
+    def _save(self) -> None:
+        '''Salva l'indice su disco in modo atomico.'''
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = self.cache_path + '.tmp.npy'
+            np.save(temp_path, self.keys)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            logging.warning(f"Impossibile salvare l'indice dei cell_id su disco: {e}")
+
+
+# Funzione per ottenere l'indice dei cell_id di una tabella
+def get_cell_index(db_url: str, geometry_table: str) -> CellIdIndex:
+    '''
+    Restituisce l'indice dei cell_id della tabella delle geometrie, condiviso nel processo corrente. \n
+    Args:
+        db_url: L'URL di connessione al database PostgreSQL.
+        geometry_table: Il nome della tabella delle geometrie nel database. \n
+    Returns:
+        CellIdIndex: L'indice dei cell_id della tabella. \n
+    '''
+    key = (db_url, geometry_table)
+    if key not in _indexes:
+        _indexes[key] = CellIdIndex(db_url, geometry_table)
+    return _indexes[key]
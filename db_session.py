@@ -0,0 +1,147 @@
+'''
+Questo modulo definisce la sessione di caricamento, che possiede un unico engine SQLAlchemy con pool di connessioni
+per tutta la durata di un'elaborazione. \n
+La sessione viene passata alle funzioni di controllo e caricamento al posto dell'URL del database,
+così le connessioni vengono riutilizzate tra un file e l'altro e le informazioni che non cambiano
+durante l'elaborazione (come il SRID della tabella delle geometrie) vengono lette una sola volta. \n
+La sessione tiene traccia delle connessioni in uso, così un'interruzione può annullare le query in corso
+(vedi cancel): la transazione interrotta viene annullata con un rollback. \n
+'''
+import logging
+import threading
+from sqlalchemy import create_engine, event
+from cell_index import CellIdIndex, get_cell_index
+from functions import get_srid
+from manifest import IngestManifest
+from partitions import ensure_partition, is_partitioned
+
+
+# Classe per la sessione di caricamento sul database
+class UploadSession:
+    '''Sessione di caricamento che possiede l'engine del database e le informazioni in cache per un'elaborazione.'''
+    # Metodo di inizializzazione della classe UploadSession
+    def __init__(self, db_url: str, pool_size: int = 2):
+        '''
+        Crea l'engine con pool di connessioni per l'URL indicato. \n
+        Args:
+            db_url: L'URL di connessione al database PostgreSQL.
+            pool_size: Il numero di connessioni mantenute aperte nel pool. \n
+        '''
+        self.db_url = db_url
+        self.engine = create_engine(db_url, pool_size=pool_size, pool_pre_ping=True)
+        self._srids = {}
+        self._manifests = {}
+        self._partitioned = {}
+        self._partitions = set()
+        self._validated_indexes = set()
+        # Connessioni DBAPI in uso, le cui query possono essere annullate da un altro thread
+        self._active = set()
+        self._active_lock = threading.Lock()
+        event.listen(self.engine, 'checkout', self._on_checkout)
+        event.listen(self.engine, 'checkin', self._on_checkin)
+        logging.debug("Sessione di caricamento aperta.")
+
+    # Metodo chiamato quando una connessione viene presa dal pool
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        '''Registra la connessione tra quelle in uso.'''
+        with self._active_lock:
+            self._active.add(dbapi_connection)
+
+    # Metodo chiamato quando una connessione viene restituita al pool
+    def _on_checkin(self, dbapi_connection, connection_record) -> None:
+        '''Rimuove la connessione da quelle in uso.'''
+        with self._active_lock:
+            self._active.discard(dbapi_connection)
+
+    # Metodo per annullare le query in corso
+    def cancel(self) -> int:
+        '''
+        Annulla le query in esecuzione sulle connessioni in uso (con la cancellazione di psycopg2, sicura da un altro thread).
+        Le query annullate sollevano un errore e le loro transazioni vengono annullate con un rollback. \n
+        Returns:
+            int: Il numero di connessioni in uso a cui è stato inviato l'annullamento. \n
+        '''
+        with self._active_lock:
+            connections = list(self._active)
+        for dbapi_connection in connections:
+            try:
+                dbapi_connection.cancel()
+            except Exception as e:
+                logging.debug(f"Annullamento della query non riuscito: {e}")
+        return len(connections)
+
+    # Metodo per ottenere il CRS di una tabella geometrica, letto una sola volta per sessione
+    def get_crs(self, table: str, geometry_column: str = 'cell_geom', schema: str = 'public'):
+        '''
+        Restituisce il CRS della colonna geometrica indicata, interrogando il database solo alla prima richiesta. \n
+        Args:
+            table: Il nome della tabella geometrica.
+            geometry_column: Il nome della colonna geometrica nella tabella.
+            schema: Lo schema della tabella nel database. \n
+        Returns:
+            CRS: Il CRS della colonna geometrica. \n
+        '''
+        key = (schema, table, geometry_column)
+        if key not in self._srids:
+            self._srids[key] = get_srid(self.engine, schema=schema, table=table, geometry_column=geometry_column)
+        return self._srids[key]
+
+    # Metodo per ottenere l'indice dei cell_id di una tabella delle geometrie
+    def cell_index(self, geometry_table: str) -> CellIdIndex:
+        '''
+        Restituisce l'indice dei cell_id della tabella delle geometrie, caricandolo alla prima richiesta.
+        L'indice è condiviso nel processo: alla prima richiesta della sessione viene confrontato con la tabella,
+        così le geometrie aggiunte da un altro processo tra due elaborazioni (ad esempio con --watch) vengono viste. \n
+        Args:
+            geometry_table: Il nome della tabella delle geometrie nel database. \n
+        Returns:
+            CellIdIndex: L'indice dei cell_id della tabella. \n
+        '''
+        index = get_cell_index(self.db_url, geometry_table)
+        index.load(self.engine, revalidate=geometry_table not in self._validated_indexes)
+        self._validated_indexes.add(geometry_table)
+        return index
+
+    # Metodo per ottenere il manifest delle ingestioni di una tabella SWE
+    def manifest(self, swe_table: str) -> IngestManifest:
+        '''
+        Restituisce il manifest dei file già caricati nella tabella SWE, letto una sola volta per sessione. \n
+        Args:
+            swe_table: Il nome della tabella dei dati SWE nel database. \n
+        Returns:
+            IngestManifest: Il manifest della tabella. \n
+        '''
+        if swe_table not in self._manifests:
+            self._manifests[swe_table] = IngestManifest(self.engine, swe_table)
+        return self._manifests[swe_table]
+
+    # Metodo per creare, se serve, la partizione di un anno nivologico
+    def ensure_partition(self, swe_table: str, snow_year: int) -> None:
+        '''
+        Crea la partizione dell'anno nivologico se la tabella SWE è partizionata (vedi partitions).
+        Il controllo sulla tabella e la creazione vengono eseguiti una sola volta per sessione. \n
+        Args:
+            swe_table: Il nome della tabella dei dati SWE nel database.
+            snow_year: L'anno nivologico dei dati da caricare. \n
+        '''
+        if (swe_table, snow_year) in self._partitions:
+            return
+        with self.engine.begin() as connection:
+            if swe_table not in self._partitioned:
+                self._partitioned[swe_table] = is_partitioned(connection, swe_table)
+            if self._partitioned[swe_table]:
+                name = ensure_partition(connection, swe_table, snow_year)
+                logging.debug(f"Partizione '{name}' pronta.")
+        self._partitions.add((swe_table, snow_year))
+
+    # Metodo per chiudere la sessione
+    def close(self) -> None:
+        '''Chiude tutte le connessioni del pool.'''
+        self.engine.dispose()
+        logging.debug("Sessione di caricamento chiusa.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
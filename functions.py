@@ -1,10 +1,16 @@
 '''
 Questo modulo fornisce le query SQL per la gestione dei dati nel database PostgreSQL. \n
+Il modulo viene importato all'avvio dell'interfaccia grafica e della riga di comando: le librerie pesanti
+(rasterio, sqlalchemy, pandas) vengono importate solo all'interno delle funzioni che le usano. \n
 '''
-from rasterio.crs import CRS
-import pandas as pd
-import geopandas as gpd
-from sqlalchemy import text
+from __future__ import annotations
+import io
+from datetime import datetime
+from typing import TYPE_CHECKING
+from metrics import stage
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 # Funzione per ottenere il SRID (Spatial Reference Identifier) di una tabella geometrica in PostgreSQL
@@ -19,6 +25,8 @@ def get_srid(engine, schema: str, table: str, geometry_column: str) -> str:
     Returns:
         str: Il SRID della colonna geometrica in formato EPSG. \n
     '''
+    from rasterio.crs import CRS
+    from sqlalchemy import text
     # Query per ottenere il SRID dalla tabella geometry_columns
     crs_query = text("""
         SELECT Find_SRID(:schema, :table, :geometry_column);
@@ -34,40 +42,83 @@ def get_srid(engine, schema: str, table: str, geometry_column: str) -> str:
     return CRS.from_epsg(int(result[0])) if result else None
 
 
+# Funzione per copiare un dataframe pandas in una tabella tramite COPY
+def copy_dataframe(connection, df: pd.DataFrame, table: str, columns: list) -> int:
+    '''
+    Copia le colonne indicate di un dataframe pandas in una tabella con il comando COPY di PostgreSQL. \n
+    Il dataframe viene serializzato in CSV in un buffer in memoria e trasmesso in un'unica operazione,
+    evitando gli INSERT riga per riga. La copia avviene nella transazione della connessione passata. \n
+    Args:
+        connection: La connessione SQLAlchemy (con transazione aperta) su cui eseguire il COPY.
+        df: Il dataframe pandas da copiare.
+        table: Il nome della tabella di destinazione.
+        columns: La lista delle colonne da copiare, nell'ordine della tabella. \n
+    Returns:
+        int: Il numero di righe copiate. \n
+    '''
+    # Serializza il dataframe in CSV in un buffer in memoria
+    buffer = io.StringIO()
+    df.to_csv(buffer, columns=columns, header=False, index=False)
+    size = buffer.tell()
+    buffer.seek(0)
+    # Esegue il COPY tramite il cursore della connessione DBAPI sottostante, misurando i byte trasmessi
+    copy_sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+    cursor = connection.connection.cursor()
+    try:
+        with stage('copy', rows=len(df), nbytes=size):
+            cursor.copy_expert(copy_sql, buffer)
+    finally:
+        cursor.close()
+    return len(df)
+
+
 # Funzione per controllare se un file GeoTIFF è valido
 def is_valid_file(file_name: str) -> str:
     '''
-    Controlla se il file è un GeoTIFF valido, ovvero se è nel formato 'SWE_YYYY-MM-DD.tif'. \n
-    Ritorna la data se il file è un GeoTIFF valido, altrimenti solleva un'eccezione. \n
+    Controlla se il file è un GeoTIFF valido, ovvero se è nel formato 'SWE_YYYY-MM-DD.tif'
+    oppure, per i GeoTIFF con una banda per data, 'SWE_YYYY-MM-DD_YYYY-MM-DD.tif' (vedi file_date_range). \n
+    Ritorna la data (la prima data per i file con più date) se il file è un GeoTIFF valido, altrimenti solleva un'eccezione. \n
     Args:
         file_name: Il nome del file da controllare. \n
     Returns:
         str: La data estratta dal nome del file nel formato 'YYYY-MM-DD'. \
     '''
+    return file_date_range(file_name)[0]
+
+
+# Funzione per estrarre l'intervallo di date dal nome di un file GeoTIFF
+def file_date_range(file_name: str) -> tuple[str, str]:
+    '''
+    Estrae la prima e l'ultima data dal nome del file, nel formato 'SWE_YYYY-MM-DD.tif' (una data)
+    o 'SWE_YYYY-MM-DD_YYYY-MM-DD.tif' (GeoTIFF con una banda per data, dalla prima all'ultima data). \n
+    Args:
+        file_name: Il nome del file da controllare. \n
+    Returns:
+        tuple: La prima e l'ultima data nel formato 'YYYY-MM-DD' (uguali per i file con una sola data). \n
+    Raises:
+        ValueError: Se il nome non è in uno dei formati previsti o se l'intervallo di date non è valido. \n
+    '''
     # Controlla che il nome del file sia una stringa
     if not isinstance(file_name, str):
         raise ValueError("Il nome del file deve essere una stringa.")
-    
-    # Divide il nome del file 'SWE_YYYY-MM-DD.tif' in parti
-    # Estrae il prefisso 'SWE' e la data dal nome del file
-    parts = file_name.split('_')
-    prefix = parts[0]
-    # Estrae la data dal nome del file
-    parts = parts[1].split('.') 
-    date = parts[0]  # Estrae la data dal nome del file
-    # Estrae l'estensione del file
-    extension = parts[1]
 
-    # Controlla che il prefisso sia 'SWE' e l'estensione sia 'tif'
-    if prefix != 'SWE' or extension != 'tif':
-        raise ValueError("Il nome del file deve essere nel formato 'SWE_YYYY-MM-DD.tif'.")
-    # Controlla che la data sia nel formato 'YYYY-MM-DD'
+    # Divide il nome del file 'SWE_YYYY-MM-DD[_YYYY-MM-DD].tif' in prefisso, date ed estensione
+    stem, _, extension = file_name.rpartition('.')
+    parts = stem.split('_')
+    prefix, dates = parts[0], parts[1:]
+
+    # Controlla che il prefisso sia 'SWE', l'estensione sia 'tif' e che ci siano una o due date
+    if prefix != 'SWE' or extension != 'tif' or len(dates) not in (1, 2):
+        raise ValueError("Il nome del file deve essere nel formato 'SWE_YYYY-MM-DD.tif' o 'SWE_YYYY-MM-DD_YYYY-MM-DD.tif'.")
+    # Controlla che le date siano nel formato 'YYYY-MM-DD'
     try:
-        pd.to_datetime(date, format='%Y-%m-%d')
+        parsed = [datetime.strptime(date, '%Y-%m-%d') for date in dates]
     except ValueError:
         raise ValueError("La data nel nome del file deve essere nel formato 'YYYY-MM-DD'.")
-    
-    return date
+    if parsed[-1] < parsed[0]:
+        raise ValueError("L'ultima data nel nome del file precede la prima.")
+
+    return dates[0], dates[-1]
 
 
 # Funzione per estrarre l'anno nivologico da una data
@@ -80,7 +131,7 @@ def nivological_year(date: str) -> int:
         int: L'anno nivologico. \n
     '''
     # Converte la stringa della data in un oggetto datetime
-    date_obj = pd.to_datetime(date, format='%Y-%m-%d')
+    date_obj = datetime.strptime(date, '%Y-%m-%d')
     # Estrae l'anno dalla data
     year = date_obj.year
     # Se il mese è dopo settembre, incrementa l'anno di 1
@@ -6,32 +6,50 @@ I dati vengono salvati in un dataframe pandas, con quattro colonne: 'ids', 'geom
 latitudine e longitudine sono calcolate a partire dalla matrice di trasformazione assieme alla posizione del pixel,
 la data è estratta dal nome del file e SWE_mm è il valore della matrice dei dati. \n
 Infine il dataframe pandas viene caricato su un server postgreSQL utilizzando sqlalchemy. \n
+I file 'SWE_YYYY-MM-DD_YYYY-MM-DD.tif' contengono una banda per data, con le date nelle descrizioni delle bande
+o in un file di accompagnamento '.dates': vengono letti in un solo passaggio e caricati insieme (vedi iter_band_stack). \n
+Il modulo importa rasterio, pandas e sqlalchemy e configura GDAL e PROJ: per non rallentare l'avvio
+l'interfaccia grafica e la riga di comando lo importano solo alla prima conversione (vedi batch_runner). \n
 '''
 import os
 import sys
-import pyproj
 import rasterio
 from rasterio.crs import CRS
+from rasterio.windows import Window
 import affine
 import pandas as pd
-import geopandas as gpd
 import numpy as np
-from shapely.geometry import box
-from sqlalchemy import create_engine, text
-from functions import get_srid, is_valid_file, nivological_year
+from sqlalchemy import text
+from cell_index import cell_ids_to_coords, coords_to_cell_ids
+from db_session import UploadSession
+from datetime import datetime
+from functions import copy_dataframe, file_date_range, is_valid_file, nivological_year
+from metrics import capture, for_file, stage
+from parquet_sink import ParquetSink
+from raster_storage import raster_to_postgresql
+from reprojection import open_raster, warp_target
+from sparse_storage import check_sparse_mode, delete_unchanged_rows, write_coverage
+from swe_summary import SummaryAccumulator, write_summary
+from zonal_stats import ZonalStats
+from gui_log import GuiLogHandler  # noqa: F401 (mantenuto per compatibilità con gli import esistenti)
 
 import logging
 import time
+from typing import Iterator
 
-# Configura il logger con un handler
-class GuiLogHandler(logging.Handler):
-    def __init__(self, queue):
-        super().__init__()
-        self.queue = queue
-
-    def emit(self, record):
-        msg = self.format(record)
-        self.queue.put(("log", msg))
+# Lato in metri delle celle della griglia
+CELL_SIZE = 500
+# Memoria massima predefinita (in MB) per la conversione a blocchi
+DEFAULT_CHUNK_MB = 256
+# Stima dei byte di picco per pixel valido durante la conversione (posizioni, coordinate, ID e dataframe), vedi geoTIFF_to_dataframe
+_BYTES_PER_PIXEL = 200
+# Obiettivo di picco di memoria della conversione, in MB per megapixel del raster con tutte le celle valide (vedi geoTIFF_to_dataframe)
+PEAK_MB_PER_MEGAPIXEL = 200
+# Conteggi restituiti dal caricamento: righe inserite, aggiornate (solo in rielaborazione), già presenti e invariate
+# e non salvate perché senza informazione
+UPLOAD_COUNTS = ('inserted', 'updated', 'skipped', 'omitted')
+# Modalità di controllo delle geometrie: indice locale dei cell_id o anti-join sul server (vedi geometry_check_server)
+CHECK_MODES = ('local', 'server')
 
 # Imposta la variabile d'ambiente GDAL_DATA per rasterio
 if getattr(sys, 'frozen', False):
@@ -44,61 +62,302 @@ else:
 if getattr(sys, 'frozen', False):
     os.environ['PROJ_DATA'] = os.path.join(sys._MEIPASS, 'pyproj', 'proj_dir', 'share', 'proj')
 else:
+    import pyproj
     proj_data_dir = pyproj.datadir.get_data_dir()
     os.environ['PROJ_DATA'] = proj_data_dir
 
 
+# Funzione per calcolare la maschera dei pixel validi
+def valid_pixels(data: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    '''
+    Calcola la maschera booleana dei pixel validi a partire dalla maschera del dataset (noData e riproiezione)
+    e, per i dati in virgola mobile, dai valori NaN. \n
+    Args:
+        data: La matrice (o le matrici delle bande) dei valori, nel tipo del file.
+        mask: La maschera del dataset letta con read_masks, con la stessa forma. \n
+    Returns:
+        np.ndarray: La maschera booleana dei pixel validi. \n
+    '''
+    valid = mask > 0
+    if np.issubdtype(data.dtype, np.floating):
+        valid &= ~np.isnan(data)
+    return valid
+
+
+# Funzione per calcolare gli ID delle celle di alcuni pixel
+def pixel_cell_ids(transform: affine.Affine, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    '''
+    Calcola gli ID delle celle (angolo superiore sinistro) dei pixel indicati, senza costruire le coordinate dell'intera griglia. \n
+    Args:
+        transform: La matrice di trasformazione del raster.
+        rows: Gli indici di riga dei pixel.
+        cols: Gli indici di colonna dei pixel. \n
+    Returns:
+        np.ndarray: L'array dei cell_id nel formato 'XXXXXXX_YYYYYYY' (vedi cell_index.coords_to_cell_ids). \n
+    '''
+    lons = (transform.a * cols + transform.b * rows + transform.c).astype(np.int64)
+    lats = (transform.d * cols + transform.e * rows + transform.f).astype(np.int64)
+    return coords_to_cell_ids(lons, lats)
+
+
+# Funzione per costruire il dataframe di una data a partire dai pixel validi
+def pixels_to_dataframe(transform: affine.Affine, rows: np.ndarray, cols: np.ndarray, values: np.ndarray,
+                        snow_year: int, date: str) -> pd.DataFrame:
+    '''
+    Costruisce il dataframe con le colonne 'cell_id', 'snow_year', 'date' e 'swe_mm' dei pixel validi di una data. \n
+    Gli array vengono passati al dataframe senza copiarli. Per pixel valido restano circa 100 byte:
+    l'ID (un riferimento da 8 byte e una stringa Python da circa 64 byte), anno nivologico e data (8 byte ciascuno)
+    e il valore nel tipo del file; durante la costruzione degli ID si aggiungono temporaneamente circa 80 byte. \n
+    Args:
+        transform: La matrice di trasformazione del raster.
+        rows: Gli indici di riga dei pixel validi.
+        cols: Gli indici di colonna dei pixel validi.
+        values: I valori dei pixel validi, nel tipo del file.
+        snow_year: L'anno nivologico.
+        date: La data nel formato 'YYYY-MM-DD'. \n
+    Returns:
+        pd.DataFrame: Il dataframe dei pixel validi. \n
+    '''
+    return pd.DataFrame(
+        {'cell_id': pixel_cell_ids(transform, rows, cols),
+         'snow_year': np.full(len(values), snow_year, dtype=np.int64),
+         'date': np.full(len(values), np.datetime64(date, 'ns')),
+         'swe_mm': values},
+        copy=False
+    )
+
+
 # Funzione per convertire un file GeoTIFF in un dataframe pandas
-def geoTIFF_to_dataframe(geoTIFF_path: str, date: str, snow_year: int) -> tuple[pd.DataFrame, CRS, affine.Affine]:
+def geoTIFF_to_dataframe(geoTIFF_path: str, date: str, snow_year: int, warp: dict = None) -> tuple[pd.DataFrame, CRS, affine.Affine]:
     '''
-    Converte un file GeoTIFF in un dataframe pandas con le colonne 'cell_id', 'snow_year', 'date' e 'swe_mm'. \n
+    Converte un file GeoTIFF in un dataframe pandas con le colonne 'cell_id', 'snow_year', 'date' e 'swe_mm',
+    con le sole celle valide. La colonna 'swe_mm' mantiene il tipo di dato del file. \n
+    Memoria: la matrice viene letta nel tipo del file insieme alla maschera (1 byte per pixel), e coordinate e ID
+    vengono calcolati solo per i pixel validi (vedi pixels_to_dataframe). Per un raster float32 il picco è di circa
+    6 byte per pixel del raster più circa 180 byte per pixel valido, di cui circa 100 restano nel dataframe:
+    l'obiettivo è di non superare PEAK_MB_PER_MEGAPIXEL (200 MB) per megapixel con tutte le celle valide. \n
     Args:
         geoTIFF_path: Il percorso del file GeoTIFF da convertire.
         date: La data estratta dal nome del file nel formato 'YYYY-MM-DD'.
-        snow_year: L'anno nivologico calcolato a partire dalla data. \n
+        snow_year: L'anno nivologico calcolato a partire dalla data.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None per leggere il file così com'è. \n
     Returns:
         tuple: Un tuple contenente il dataframe pandas, il CRS del GeoTIFF e la matrice di trasformazione. \n
-    Raises:
-
     '''
-    with rasterio.open(geoTIFF_path) as raster:
-        # Estrae la matrice dei dati e le informazioni di georeferenziazione
+    with stage('read', geoTIFF_path) as read_stage, open_raster(geoTIFF_path, warp) as raster:
+        # Estrae la matrice dei dati nel tipo del file e le informazioni di georeferenziazione
         raster_data = raster.read(1)
         raster_transform = raster.transform
         raster_crs = raster.crs
-        raster_noData = raster.nodata
+        # La maschera del dataset indica noData e, con la riproiezione, le celle fuori dal dataset di origine
+        raster_mask = raster.read_masks(1)
+        read_stage.update(rows=raster_data.size, bytes=raster_data.nbytes + raster_mask.nbytes)
     logging.debug(f"Apertura GeoTIFF: {geoTIFF_path} completata con successo.")
     logging.debug(f"Dimensioni matrice raster: {raster_data.shape}")
 
-    # Modifica i valori noData a NaN
-    raster_data = np.where(raster_data == raster_noData, np.nan, raster_data)
-
-    #  Crea un array di indici per le righe e le colonne della matrice
-    rows, cols = np.indices(raster_data.shape)
-    # Calcola le coordinate x e y a partire dalla matrice di trasformazione
-    lons, lats = raster_transform * (cols, rows)
-    # Converte le coordinate in interi
-    lons = lons.astype(int)
-    lats = lats.astype(int)
-    # Crea gli indici delle celle come stringhe con zfill
-    ids = np.char.add(np.char.zfill(lons.astype(str), 7), "_")
-    ids = np.char.add(ids, np.char.zfill(lats.astype(str), 7))
-    # Crea un geodataframe geopandas con le coordinate e i valori della matrice
-    dataframe = pd.DataFrame(
-        {'cell_id': ids.flatten(), 
-         'snow_year' : snow_year,
-         'date': pd.to_datetime(date, format='%Y-%m-%d'), 
-         'swe_mm': raster_data.flatten()}
-    )
-
-    # Rimuove le righe con valori NaN
-    dataframe = dataframe.dropna(subset=['swe_mm'])
+    with stage('convert', geoTIFF_path) as convert_stage:
+        # Posizioni e valori dei soli pixel validi, senza convertire la matrice in float64
+        rows, cols = np.nonzero(valid_pixels(raster_data, raster_mask))
+        del raster_mask
+        values = raster_data[rows, cols]
+        del raster_data
+        # Crea il dataframe con gli ID delle celle valide
+        dataframe = pixels_to_dataframe(raster_transform, rows, cols, values, snow_year, date)
+        convert_stage.update(rows=len(dataframe), bytes=int(dataframe.memory_usage(index=False).sum()))
     # Ritorna il dataframe pandas
     return dataframe, raster_crs, raster_transform
 
 
+# Funzione per convertire un file GeoTIFF a blocchi, con memoria limitata
+def iter_geoTIFF_chunks(geoTIFF_path: str, date: str, snow_year: int, max_chunk_mb: int = DEFAULT_CHUNK_MB,
+                        warp: dict = None) -> Iterator[tuple[pd.DataFrame, CRS, affine.Affine]]:
+    '''
+    Converte un file GeoTIFF a blocchi di righe, restituendo un dataframe pandas per ogni blocco con celle valide. \n
+    I blocchi sono finestre a tutta larghezza allineate ai blocchi interni del file, dimensionate in modo che la
+    conversione di un blocco non superi max_chunk_mb. La maschera del dataset viene letta prima dei dati,
+    così i blocchi composti solo da noData vengono saltati senza costruire indici, coordinate o ID. \n
+    Args:
+        geoTIFF_path: Il percorso del file GeoTIFF da convertire.
+        date: La data estratta dal nome del file nel formato 'YYYY-MM-DD'.
+        snow_year: L'anno nivologico calcolato a partire dalla data.
+        max_chunk_mb: La memoria massima indicativa, in MB, per la conversione di un blocco.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None. Le finestre vengono
+            riproiettate una alla volta durante la lettura. \n
+    Returns:
+        Iterator: Un iteratore di tuple con il dataframe del blocco, il CRS del GeoTIFF e la sua matrice di trasformazione. \n
+    '''
+    with open_raster(geoTIFF_path, warp) as raster:
+        raster_transform = raster.transform
+        raster_crs = raster.crs
+        # Calcola il numero di righe per blocco, multiplo dell'altezza dei blocchi interni del file
+        block_height = raster.block_shapes[0][0]
+        rows_per_chunk = int(max_chunk_mb * 2 ** 20 // (raster.width * _BYTES_PER_PIXEL))
+        rows_per_chunk = max(block_height, rows_per_chunk // block_height * block_height)
+        logging.debug(f"Conversione a blocchi di {rows_per_chunk} righe per {geoTIFF_path}.")
+        skipped = 0
+        for row_off in range(0, raster.height, rows_per_chunk):
+            window = Window(0, row_off, raster.width, min(rows_per_chunk, raster.height - row_off))
+            with stage('read', geoTIFF_path) as read_stage:
+                # Legge la maschera (1 byte per pixel) e salta i blocchi senza celle valide
+                mask = raster.read_masks(1, window=window)
+                read_stage.update(rows=mask.size, bytes=mask.nbytes)
+                if not mask.any():
+                    skipped += 1
+                    continue
+                # Estrae i valori delle sole celle valide, nel tipo del file
+                data = raster.read(1, window=window)
+                rows, cols = np.nonzero(valid_pixels(data, mask))
+                values = data[rows, cols]
+                read_stage['bytes'] += data.nbytes
+                del mask, data
+            with stage('convert', geoTIFF_path) as convert_stage:
+                # Calcola gli ID dei pixel validi a partire dalla matrice di trasformazione
+                rows += row_off
+                dataframe = pixels_to_dataframe(raster_transform, rows, cols, values, snow_year, date)
+                convert_stage.update(rows=len(dataframe), bytes=int(dataframe.memory_usage(index=False).sum()))
+            if not dataframe.empty:
+                yield dataframe, raster_crs, raster_transform
+        logging.debug(f"Blocchi senza celle valide saltati: {skipped}.")
+
+
+# Funzione per leggere le date delle bande di un GeoTIFF con più date
+def read_band_dates(raster, geoTIFF_path: str) -> list[str]:
+    '''
+    Legge la data di ogni banda di un GeoTIFF con più date ('SWE_YYYY-MM-DD_YYYY-MM-DD.tif'). \n
+    Le date vengono lette, nell'ordine delle bande, dal file di accompagnamento con lo stesso nome ed estensione '.dates'
+    (una data 'YYYY-MM-DD' per riga), se presente, altrimenti dalle descrizioni delle bande. \n
+    Args:
+        raster: Il dataset rasterio aperto.
+        geoTIFF_path: Il percorso del file GeoTIFF. \n
+    Returns:
+        list: Le date delle bande nel formato 'YYYY-MM-DD'. \n
+    Raises:
+        ValueError: Se le date mancano, non sono valide, sono ripetute, non corrispondono al numero di bande
+            o cadono fuori dall'intervallo indicato nel nome del file. \n
+    '''
+    sidecar = os.path.splitext(geoTIFF_path)[0] + '.dates'
+    if os.path.exists(sidecar):
+        with open(sidecar) as file:
+            dates = [line.strip() for line in file if line.strip()]
+        source = f"file '{os.path.basename(sidecar)}'"
+    else:
+        dates = [description or '' for description in raster.descriptions]
+        source = "descrizioni delle bande"
+    if len(dates) != raster.count:
+        raise ValueError(f"Le date nelle {source} sono {len(dates)}, le bande del file {raster.count}.")
+    try:
+        parsed = [datetime.strptime(date, '%Y-%m-%d') for date in dates]
+    except ValueError:
+        raise ValueError(f"Le date nelle {source} devono essere nel formato 'YYYY-MM-DD'.")
+    if len(set(parsed)) != len(parsed):
+        raise ValueError(f"Le date nelle {source} contengono date ripetute.")
+    first, last = (datetime.strptime(date, '%Y-%m-%d') for date in file_date_range(os.path.basename(geoTIFF_path)))
+    if min(parsed) < first or max(parsed) > last:
+        raise ValueError(f"Le date nelle {source} cadono fuori dall'intervallo indicato nel nome del file.")
+    return dates
+
+
+# Funzione per leggere le date delle bande a partire dal solo percorso
+def read_file_band_dates(geoTIFF_path: str) -> list[str]:
+    '''Apre il GeoTIFF e restituisce le date delle bande (vedi read_band_dates).'''
+    with rasterio.open(geoTIFF_path) as raster:
+        return read_band_dates(raster, geoTIFF_path)
+
+
+# Funzione per convertire un GeoTIFF con una banda per data, leggendo tutte le bande in un solo passaggio
+def iter_band_stack(geoTIFF_path: str, max_chunk_mb: int = None, warp: dict = None) -> Iterator[tuple[pd.DataFrame, CRS, affine.Affine]]:
+    '''
+    Converte un GeoTIFF con una banda per data in dataframe pandas con le colonne 'cell_id', 'snow_year', 'date' e 'swe_mm',
+    con le righe di tutte le date. Gli ID delle celle vengono calcolati una sola volta per tutte le bande. \n
+    Le date delle bande vengono lette con read_band_dates. Con max_chunk_mb il file viene letto a finestre
+    a tutta larghezza, come in iter_geoTIFF_chunks; altrimenti viene letto in un'unica finestra. \n
+    Args:
+        geoTIFF_path: Il percorso del file GeoTIFF da convertire.
+        max_chunk_mb: La memoria massima indicativa, in MB, per la conversione di un blocco, oppure None.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None. \n
+    Returns:
+        Iterator: Un iteratore di tuple con il dataframe del blocco, il CRS del GeoTIFF e la sua matrice di trasformazione. \n
+    '''
+    dates = read_file_band_dates(geoTIFF_path)
+    # Le bande vengono indicate esplicitamente: il WarpedVRT può aggiungere un canale alpha
+    indexes = list(range(1, len(dates) + 1))
+    with open_raster(geoTIFF_path, warp) as raster:
+        snow_years = np.array([nivological_year(date) for date in dates])
+        band_dates = pd.to_datetime(dates, format='%Y-%m-%d')
+        raster_transform = raster.transform
+        raster_crs = raster.crs
+        logging.debug(f"GeoTIFF con {len(dates)} date: dal {min(dates)} al {max(dates)}.")
+        rows_per_chunk = raster.height
+        if max_chunk_mb:
+            block_height = raster.block_shapes[0][0]
+            rows_per_chunk = int(max_chunk_mb * 2 ** 20 // (raster.width * len(indexes) * _BYTES_PER_PIXEL))
+            rows_per_chunk = max(block_height, rows_per_chunk // block_height * block_height)
+        for row_off in range(0, raster.height, rows_per_chunk):
+            window = Window(0, row_off, raster.width, min(rows_per_chunk, raster.height - row_off))
+            with stage('read', geoTIFF_path) as read_stage:
+                # Legge le maschere di tutte le bande e salta i blocchi senza celle valide in nessuna data
+                masks = raster.read_masks(indexes, window=window)
+                read_stage.update(rows=masks.size, bytes=masks.nbytes)
+                any_valid = masks.any(axis=0)
+                if not any_valid.any():
+                    continue
+                # Estrae i valori di tutte le bande, nel tipo del file, sui pixel validi in almeno una data
+                rows, cols = np.nonzero(any_valid)
+                data = raster.read(indexes, window=window)
+                values = data[:, rows, cols]
+                valid = valid_pixels(values, masks[:, rows, cols])
+                read_stage['bytes'] += data.nbytes
+                del masks, any_valid, data
+            with stage('convert', geoTIFF_path) as convert_stage:
+                # Calcola gli ID una sola volta per i pixel del blocco
+                rows += row_off
+                ids = pixel_cell_ids(raster_transform, rows, cols)
+                del rows, cols
+                # Una riga per ogni coppia (banda, pixel) valida, ordinate per data
+                bands, pixels = np.nonzero(valid)
+                dataframe = pd.DataFrame(
+                    {'cell_id': ids[pixels],
+                     'snow_year': snow_years[bands],
+                     'date': band_dates[bands],
+                     'swe_mm': values[bands, pixels]},
+                    copy=False
+                )
+                convert_stage.update(rows=len(dataframe), bytes=int(dataframe.memory_usage(index=False).sum()))
+            if not dataframe.empty:
+                yield dataframe, raster_crs, raster_transform
+
+
+# Funzione per sapere se un file GeoTIFF contiene più date
+def is_multi_date_file(file_path: str) -> bool:
+    '''Restituisce True se il nome del file indica un intervallo di date ('SWE_YYYY-MM-DD_YYYY-MM-DD.tif').'''
+    first, last = file_date_range(os.path.basename(file_path))
+    return first != last
+
+
+# Funzione per controllare pixel e CRS del GeoTIFF rispetto alla tabella delle geometrie
+def check_grid(crs, transform, geometry_table: str, session: UploadSession) -> None:
+    '''
+    Controlla che i pixel del GeoTIFF siano di 500 m e che il CRS corrisponda a quello della tabella delle geometrie. \n
+    Args:
+        crs: Il CRS del GeoTIFF.
+        transform: La matrice di trasformazione del GeoTIFF.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        session: La sessione di caricamento sul database PostgreSQL. \n
+    Raises:
+        ValueError: Se la larghezza e l'altezza dei pixel non sono pari a 500 o se il CRS non corrisponde a quello della tabella. \n
+    '''
+    # Estrae il CRS della tabella delle geometrie (letto una sola volta per sessione)
+    db_crs = session.get_crs(geometry_table)
+    # Controlla che la larghezza e l'altezza dei pixel siano pari a 500
+    if transform.a != CELL_SIZE or transform.e != -CELL_SIZE:
+        raise ValueError(f"La larghezza e l'altezza dei pixel devono essere pari a {CELL_SIZE}.")
+    # Controlla se il CRS del GeoDataFrame corrisponde a quello della tabella
+    if db_crs.to_epsg() != crs.to_epsg():
+        raise ValueError(f"Il CRS del geoTIFF {crs} non corrisponde al CRS della tabella {db_crs}.")
+
+
 # Funzione per controllare il CRS e gli ID del GeoDataFrame rispetto alla tabella del database
-def geometry_check(df_ids: pd.Series, crs, transform, geometry_table: str, db_url: str) -> list:
+def geometry_check(df_ids: pd.Series, crs, transform, geometry_table: str, session: UploadSession) -> list:
     '''
     Controlla il CRS e gli ID del GeoDataFrame rispetto alla tabella delle geometrie nel database. \n
     Args:
@@ -106,119 +365,594 @@ def geometry_check(df_ids: pd.Series, crs, transform, geometry_table: str, db_ur
         crs: Il CRS del GeoDataFrame.
         transform: La matrice di trasformazione del GeoDataFrame.
         geometry_table: Il nome della tabella delle geometrie nel database.
-        db_url: L'URL di connessione al database PostgreSQL. \n
+        session: La sessione di caricamento sul database PostgreSQL. \n
     Returns:
         list: Una lista degli ID mancanti nella tabella delle geometrie del database. \n
     Raises:
-        ValueError: Se la larghezza e l'altezza dei pixel non sono pari a 500 o se il CRS del GeoDataFrame non corrisponde a quello della tabella. \n
+        ValueError: Se la larghezza e l'altezza dei pixel non sono pari a 500 o se il CRS del GeoDataFrame non corrisponde a quello della tabella
+            (i file letti con la riproiezione, vedi reprojection, sono già sulla griglia della tabella). \n
         Exception: Se si verifica un errore durante l'esecuzione della query per ottenere il SRID o gli ID della tabella delle geometrie. \n
     '''
-    # Estrae il CRS e gli ID della tabella delle geometrie dal database
-    engine = create_engine(db_url)
-    logging.info("Estrazione di CRS e ID dal database.")
-    try:
-        # Estrae il CRS della tabella delle geometrie e i cell_id già presenti
-        db_crs = get_srid(engine, schema='public', table=geometry_table, geometry_column='cell_geom')
-        query = f'SELECT "cell_id" FROM {geometry_table}'
-        db_ids = pd.read_sql(query, engine)["cell_id"]
-    finally:
-        engine.dispose()
+    # Controlla pixel e CRS, poi estrae l'indice degli ID della tabella delle geometrie (letti una sola volta per sessione)
+    check_grid(crs, transform, geometry_table, session)
+    logging.info("Estrazione degli ID dal database.")
+    cell_index = session.cell_index(geometry_table)
     logging.info("Estrazione completata con successo.")
-    
-    # Controlla che la larghezza e l'altezza dei pixel siano pari a 500
-    if transform.a != 500 or transform.e != -500:
-        raise ValueError("La larghezza e l'altezza dei pixel devono essere pari a 500.")
-    # Controlla se il CRS del GeoDataFrame corrisponde a quello della tabella
-    if db_crs.to_epsg() != crs.to_epsg():
-        raise ValueError(f"Il CRS del geoTIFF {crs} non corrisponde al CRS della tabella {db_crs}.")
 
-    # Trova i cell_id mancanti
-    missing = df_ids[~df_ids.isin(db_ids)].tolist()
+    # Trova i cell_id mancanti con una ricerca nell'indice locale
+    with stage('check', rows=len(df_ids)):
+        missing = cell_index.missing(df_ids)
     return missing
 
 
 # Funzione per aggiungere le geometrie mancanti al database
-def add_missing_geometries(missing_ids: list, crs, geometry_table: str, db_url: str):
+def add_missing_geometries(missing_ids: list, crs, geometry_table: str, session: UploadSession):
     '''
-    Calcola le geometrie solo per gli ID mancanti e le carica nella geometry_table.
+    Calcola le geometrie solo per gli ID mancanti e le carica nella geometry_table. \n
+    Le coordinate dell'angolo superiore sinistro delle celle vengono decodificate dagli ID come array e copiate con COPY
+    in una tabella temporanea; i poligoni vengono poi generati dal database con ST_MakeEnvelope, in un'unica istruzione
+    che salta gli ID già presenti. \n
     Args:
         missing_ids: Una lista degli ID mancanti nella tabella delle geometrie del database.
         crs: Il CRS del GeoDataFrame.
         geometry_table: Il nome della tabella delle geometrie nel database.
-        db_url: L'URL di connessione al database PostgreSQL. \n
+        session: La sessione di caricamento sul database PostgreSQL. \n
     Returns:
         None \n
     Raises:
-        Exception: Se si verifica un errore durante la creazione del GeoDataFrame o il caricamento nel database. \n
+        Exception: Se si verifica un errore durante il caricamento nel database. \n
     '''
     if not missing_ids:
         return
     logging.info(f"Generazione di {len(missing_ids)} nuove geometrie per ID mancanti.")
-    # Ricostruisce le geometrie per gli ID mancanti
-    lons = [int(missing_id.split('_')[0]) for missing_id in missing_ids]
-    lats = [int(missing_id.split('_')[1]) for missing_id in missing_ids]
-    # Crea i poligoni per i pixel mancanti
-    pixels = [box(lon, lat, lon + 500, lat - 500) for lon, lat in zip(lons, lats)]
-    # Crea un GeoDataFrame con gli ID mancanti e le geometrie
-    gdf = gpd.GeoDataFrame({'cell_id': missing_ids, 'cell_geom': pixels}, geometry='cell_geom', crs=crs)
-
-    # Aggiunge le geometrie al database
-    engine = create_engine(db_url)
-    try:
-        gdf.to_postgis(geometry_table, con=engine, if_exists='append', index=False)
-    finally:
-        engine.dispose()
+    # Decodifica le coordinate degli angoli delle celle mancanti
+    lons, lats = cell_ids_to_coords(missing_ids)
+    corners = pd.DataFrame({'cell_id': missing_ids, 'x': lons, 'y': lats})
+
+    # Aggiunge le geometrie al database generando i poligoni lato server
+    with stage('geometry_insert', rows=len(missing_ids)), session.engine.begin() as connection:
+        temp_table = "temp_geom_upload"
+        connection.execute(text(f'''
+            CREATE TEMP TABLE {temp_table} (cell_id text, x double precision, y double precision) ON COMMIT DROP;
+        '''))
+        copy_dataframe(connection, corners, temp_table, ['cell_id', 'x', 'y'])
+        insert_sql = f'''
+            INSERT INTO {geometry_table} (cell_id, cell_geom)
+            SELECT t.cell_id, ST_MakeEnvelope(t.x, t.y - :size, t.x + :size, t.y, :srid)
+            FROM {temp_table} t
+            WHERE NOT EXISTS (SELECT 1 FROM {geometry_table} g WHERE g.cell_id = t.cell_id);
+        '''
+        inserted = connection.execute(text(insert_sql), {"size": CELL_SIZE, "srid": crs.to_epsg()}).rowcount
+    logging.info(f"Geometrie inserite nella tabella '{geometry_table}': {inserted}.")
+    # Aggiorna l'indice locale dei cell_id con le nuove geometrie
+    session.cell_index(geometry_table).add(missing_ids)
+
+
+# Funzione per controllare gli ID e inserire le geometrie mancanti con un anti-join sul server
+def geometry_check_server(df_ids, crs, transform, geometry_table: str, session: UploadSession) -> int:
+    '''
+    Controlla CRS e ID del GeoTIFF rispetto alla tabella delle geometrie senza scaricarne gli ID: gli ID validi del file
+    vengono copiati con COPY in una tabella temporanea e il database inserisce le geometrie mancanti in un'unica istruzione,
+    trovandole con un anti-join (NOT EXISTS) sull'indice dei cell_id. \n
+    Il traffico di rete è proporzionale alle celle del file e non alla tabella delle geometrie, utile con un database remoto
+    su un collegamento lento; l'indice locale dei cell_id non viene caricato né aggiornato. \n
+    Args:
+        df_ids: La serie (o l'array) degli ID del GeoTIFF.
+        crs: Il CRS del GeoTIFF.
+        transform: La matrice di trasformazione del GeoTIFF.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        session: La sessione di caricamento sul database PostgreSQL. \n
+    Returns:
+        int: Il numero di geometrie inserite. \n
+    Raises:
+        ValueError: Se la larghezza e l'altezza dei pixel non sono pari a 500 o se il CRS non corrisponde a quello della tabella. \n
+    '''
+    check_grid(crs, transform, geometry_table, session)
+    ids = pd.DataFrame({'cell_id': np.asarray(df_ids, dtype=object)}, copy=False)
+    with stage('check', rows=len(ids)), session.engine.begin() as connection:
+        temp_table = "temp_cell_check"
+        connection.execute(text(f'''
+            CREATE TEMP TABLE {temp_table} (cell_id text) ON COMMIT DROP;
+        '''))
+        copy_dataframe(connection, ids, temp_table, ['cell_id'])
+        # Le statistiche della tabella temporanea permettono al planner di scegliere tra anti-join con indice e hash
+        connection.execute(text(f'ANALYZE {temp_table};'))
+        insert_sql = f'''
+            INSERT INTO {geometry_table} (cell_id, cell_geom)
+            SELECT t.cell_id, ST_MakeEnvelope(t.x, t.y - :size, t.x + :size, t.y, :srid)
+            FROM (
+                SELECT DISTINCT cell_id,
+                       split_part(cell_id, '_', 1)::double precision AS x,
+                       split_part(cell_id, '_', 2)::double precision AS y
+                FROM {temp_table}
+            ) t
+            WHERE NOT EXISTS (SELECT 1 FROM {geometry_table} g WHERE g.cell_id = t.cell_id);
+        '''
+        inserted = connection.execute(text(insert_sql), {"size": CELL_SIZE, "srid": crs.to_epsg()}).rowcount
+    return inserted
 
 
 # Funzione per caricare un dataframe pandas su un server postgreSQL
-def dataframe_to_postgresql(df: pd.DataFrame, SWE_table: str, db_url: str) -> None:
+def dataframe_to_postgresql(df: pd.DataFrame, SWE_table: str, session: UploadSession, sparse_mode: str = None, tolerance: float = 0.0,
+                            reprocess: bool = False) -> dict:
     '''
     Carica un dataframe pandas nella tabella SWE_table del database PostgreSQL. \n
+    I dati vengono copiati con COPY in una tabella di appoggio temporanea (TEMP, eliminata al commit)
+    e poi inseriti nella tabella SWE ignorando le righe già presenti. \n
+    Con reprocess (raster corretti e ripubblicati) le righe già presenti vengono confrontate con quelle della tabella
+    di appoggio e aggiornate solo se swe_mm è cambiato: una correzione che tocca il 2% delle celle scrive
+    (e produce WAL e voci di indice per) circa il 2% delle righe, invece di eliminare e ricaricare l'intera data.
+    La rielaborazione non è compatibile con l'archiviazione ridotta, in cui l'assenza di una riga ha un significato
+    (valore 0 o invariato rispetto alla data precedente) che un aggiornamento riga per riga non può correggere. \n
+    Con sparse_mode='zero' le righe con SWE pari a 0 (entro la tolleranza) non vengono trasmesse;
+    con sparse_mode='delta' vengono eliminate dalla tabella di appoggio le righe invariate rispetto all'ultimo valore salvato
+    (vedi sparse_storage). \n
     Args:
         df: Il dataframe pandas da caricare.
         SWE_table: Il nome della tabella SWE nel database.
-        db_url: L'URL di connessione al database PostgreSQL. \n
+        session: La sessione di caricamento sul database PostgreSQL.
+        sparse_mode: La modalità di archiviazione ridotta ('zero' o 'delta'), oppure None per salvare tutte le righe.
+        tolerance: La tolleranza in mm usata dalla modalità di archiviazione ridotta.
+        reprocess: Se True aggiorna le righe già presenti il cui valore è cambiato. \n
     Returns:
-        None \n
+        dict: I conteggi delle righe inserite ('inserted'), aggiornate ('updated'), già presenti e invariate ('skipped')
+        e non salvate perché senza informazione ('omitted'). \n
     Raises:
-        ValueError: Se il dataframe non è un pandas DataFrame o se è vuoto.
+        ValueError: Se il dataframe non è un pandas DataFrame o se è vuoto, se la modalità di archiviazione non è valida
+            o se è richiesta la rielaborazione con l'archiviazione ridotta.
     '''
     # gestione degli errori
     if not isinstance(df, pd.DataFrame):
         raise ValueError("Il parametro df deve essere un DataFrame.")
     if df.empty:
         raise ValueError("Il DataFrame è vuoto. Non ci sono dati da caricare.")
+    check_sparse_mode(sparse_mode)
+    if reprocess and sparse_mode:
+        raise ValueError("La rielaborazione non è compatibile con l'archiviazione ridotta.")
+    counts = dict.fromkeys(UPLOAD_COUNTS, 0)
+
+    # Modalità 'zero': scarta le celle senza neve prima della trasmissione
+    if sparse_mode == 'zero':
+        informative = df['swe_mm'].abs() > tolerance
+        counts['omitted'] = int((~informative).sum())
+        df = df[informative]
+        if df.empty:
+            logging.info(f"Nessuna cella con SWE diverso da 0: {counts['omitted']} righe non salvate.")
+            return counts
 
     # Carica il dataframe nella tabella specificata
-    engine = create_engine(db_url)
     logging.info(f"Caricamento dati SWE in tabella '{SWE_table}'")
-    try:
-        with engine.begin() as connection:
-            # Scrivi su una tabella temporanea
-            temp_table = "temp_swe_upload"
-            df.to_sql(temp_table, con=connection, if_exists='replace', index=False)
-            # Inserisci ignorando i duplicati
-            insert_sql = f'''
-                INSERT INTO {SWE_table} (cell_id, snow_year, date, swe_mm)
-                SELECT cell_id, snow_year, date, swe_mm FROM {temp_table}
-                ON CONFLICT (cell_id, snow_year, date) DO NOTHING;
-                DROP TABLE {temp_table};
+    columns = ['cell_id', 'snow_year', 'date', 'swe_mm']
+    with stage('upload', rows=len(df)), session.engine.begin() as connection:
+        # Crea una tabella temporanea di sessione con la stessa struttura della tabella SWE
+        temp_table = "temp_swe_upload"
+        connection.execute(text(f'''
+            CREATE TEMP TABLE {temp_table} ON COMMIT DROP AS
+            SELECT {", ".join(columns)} FROM {SWE_table} WITH NO DATA;
+        '''))
+        # Copia i dati nella tabella temporanea
+        staged = copy_dataframe(connection, df, temp_table, columns)
+        # Modalità 'delta': elimina le righe invariate rispetto all'ultimo valore salvato
+        if sparse_mode == 'delta':
+            counts['omitted'] = delete_unchanged_rows(connection, temp_table, SWE_table, tolerance)
+            staged -= counts['omitted']
+        # Rielaborazione: aggiorna solo le righe già presenti con un valore diverso
+        if reprocess:
+            connection.execute(text(f'ANALYZE {temp_table};'))
+            update_sql = f'''
+                UPDATE {SWE_table} t SET swe_mm = s.swe_mm
+                FROM {temp_table} s
+                WHERE t.cell_id = s.cell_id AND t.snow_year = s.snow_year AND t.date = s.date
+                  AND t.swe_mm IS DISTINCT FROM s.swe_mm;
             '''
-            connection.execute(text(insert_sql))
-    finally:
-        engine.dispose()
-    logging.info(f"Dati SWE caricati con successo nella tabella '{SWE_table}'.")
+            counts['updated'] = connection.execute(text(update_sql)).rowcount
+        # Inserisci ignorando i duplicati
+        insert_sql = f'''
+            INSERT INTO {SWE_table} (cell_id, snow_year, date, swe_mm)
+            SELECT cell_id, snow_year, date, swe_mm FROM {temp_table}
+            ON CONFLICT (cell_id, snow_year, date) DO NOTHING;
+        '''
+        counts['inserted'] = connection.execute(text(insert_sql)).rowcount
+    counts['skipped'] = staged - counts['inserted'] - counts['updated']
+    if reprocess:
+        logging.info(f"Dati SWE rielaborati nella tabella '{SWE_table}': {counts['inserted']} righe inserite, "
+                     f"{counts['updated']} aggiornate, {counts['skipped']} invariate.")
+    else:
+        logging.info(f"Dati SWE caricati con successo nella tabella '{SWE_table}': {counts['inserted']} righe inserite, "
+                     f"{counts['skipped']} già presenti, {counts['omitted']} non salvate.")
+    return counts
+
+
+# Funzione per convertire un file GeoTIFF a partire dal solo percorso
+def convert_file(file_path: str, warp: dict = None) -> tuple[str, int, pd.DataFrame, CRS, affine.Affine]:
+    '''
+    Valida il nome del file, calcola data e anno nivologico e converte il GeoTIFF in un dataframe pandas. \n
+    La funzione non accede al database e può essere eseguita in un processo separato. \n
+    Per i GeoTIFF con più date tutte le bande vengono convertite in un unico dataframe (vedi iter_band_stack)
+    e la data restituita è la prima dell'intervallo nel nome del file. \n
+    Args:
+        file_path: Il percorso del file GeoTIFF da convertire.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None. \n
+    Returns:
+        tuple: La data, l'anno nivologico, il dataframe pandas, il CRS e la matrice di trasformazione. \n
+    Raises:
+        ValueError: Se il nome del file non è nel formato 'SWE_YYYY-MM-DD.tif' o 'SWE_YYYY-MM-DD_YYYY-MM-DD.tif',
+            o se un GeoTIFF con più date non contiene celle valide. \n
+    '''
+    date = is_valid_file(os.path.basename(file_path))
+    snow_year = nivological_year(date)
+    if is_multi_date_file(file_path):
+        # Senza limite di memoria il file viene letto in un'unica finestra, quindi in un unico blocco
+        chunks = list(iter_band_stack(file_path, warp=warp))
+        if not chunks:
+            raise ValueError(f"Il file {os.path.basename(file_path)} non contiene celle valide.")
+        df, crs, transform = chunks[0]
+    else:
+        df, crs, transform = geoTIFF_to_dataframe(file_path, date, snow_year, warp)
+    return date, snow_year, df, crs, transform
+
+
+# Funzione per convertire un file GeoTIFF raccogliendo le misure delle fasi
+def convert_file_with_stats(file_path: str, warp: dict = None) -> tuple[tuple, list]:
+    '''
+    Esegue convert_file raccogliendo le misure di lettura e conversione, da restituire al processo principale
+    quando la conversione avviene in un processo separato (vedi metrics.capture). \n
+    Args:
+        file_path: Il percorso del file GeoTIFF da convertire.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None. \n
+    Returns:
+        tuple: Il risultato di convert_file e la lista delle misure delle fasi. \n
+    '''
+    with capture() as records:
+        result = convert_file(file_path, warp)
+    return result, records
+
+
+# Funzione per controllare le geometrie e aggiungere quelle mancanti
+def check_geometries(cell_ids, crs, transform, geometry_table: str, session: UploadSession, check_mode: str = 'local') -> None:
+    '''
+    Controlla CRS e ID rispetto alla tabella delle geometrie e aggiunge le geometrie mancanti. \n
+    Args:
+        cell_ids: La serie (o l'array) degli ID da controllare.
+        crs: Il CRS del GeoTIFF.
+        transform: La matrice di trasformazione del GeoTIFF.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        session: La sessione di caricamento sul database PostgreSQL.
+        check_mode: 'local' per cercare gli ID nell'indice locale dei cell_id, 'server' per l'anti-join sul database
+            (vedi geometry_check_server). \n
+    '''
+    if check_mode == 'server':
+        inserted = geometry_check_server(cell_ids, crs, transform, geometry_table, session)
+        if inserted:
+            logging.warning(f"{inserted} geometrie mancanti aggiunte nella tabella '{geometry_table}'.")
+        else:
+            logging.info("Nessuna geometria mancante trovata.")
+        return
+    # Controlla il CRS e gli ID del GeoDataFrame rispetto alla tabella del database
+    missing_ids = geometry_check(cell_ids, crs, transform, geometry_table, session)
+    # Controlla se ci sono geometrie mancanti
+    if missing_ids:
+        logging.warning(f"{len(missing_ids)} geometrie mancanti trovate nel DB. Verranno aggiunte.")
+        # Aggiunge le geometrie mancanti al database
+        add_missing_geometries(missing_ids, crs, geometry_table, session)
+        logging.info("Eventuali geometrie mancanti aggiunte.")
+    else:
+        logging.info("Nessuna geometria mancante trovata.")
+
+
+# Funzione per leggere un file GeoTIFF come sequenza di blocchi convertiti
+def iter_file_chunks(file_path: str, date: str, snow_year: int, chunk_mb: int = None, warp: dict = None) -> Iterator[tuple[pd.DataFrame, CRS, affine.Affine]]:
+    '''
+    Legge e converte un file GeoTIFF nel modo adatto al file: a bande per i file con più date, a blocchi con chunk_mb,
+    altrimenti per intero. La lettura avviene solo mentre i blocchi vengono consumati. \n
+    Args:
+        file_path: Il percorso del file GeoTIFF da convertire.
+        date: La data estratta dal nome del file nel formato 'YYYY-MM-DD'.
+        snow_year: L'anno nivologico calcolato a partire dalla data.
+        chunk_mb: La memoria massima indicativa per blocco, in MB. Se None il file viene convertito per intero.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None. \n
+    Returns:
+        Iterator: Le tuple (dataframe, CRS, trasformazione) dei blocchi del file. \n
+    '''
+    if is_multi_date_file(file_path):
+        yield from iter_band_stack(file_path, chunk_mb, warp)
+    elif chunk_mb:
+        yield from iter_geoTIFF_chunks(file_path, date, snow_year, chunk_mb, warp)
+    else:
+        yield geoTIFF_to_dataframe(file_path, date, snow_year, warp)
+
+
+# Classe per il caricamento di un file nella tabella SWE, un blocco convertito alla volta
+class FileUpload:
+    '''
+    Stato del caricamento di un file GeoTIFF nella tabella SWE: conteggi, righe e copertura per data. \n
+    Il caricamento è diviso in fasi, eseguibili anche da thread diversi purché ogni blocco venga controllato prima
+    di essere caricato: start prima del primo blocco, check e load per ogni blocco, finish al termine del file. \n
+    '''
+    # Metodo di inizializzazione della classe FileUpload
+    def __init__(self, file_path: str, session: UploadSession, geometry_table: str = 'cell_geom_table',
+                 swe_table: str = 'cell_daily_swe_table', sparse_mode: str = None, tolerance: float = 0.0, parquet_sink=None,
+                 check_mode: str = 'local', reprocess: bool = False):
+        '''
+        Prepara il caricamento del file. \n
+        Args:
+            file_path: Il percorso del file GeoTIFF.
+            session: La sessione di caricamento sul database PostgreSQL, oppure None per scrivere solo nel dataset Parquet.
+            geometry_table: Il nome della tabella delle geometrie nel database.
+            swe_table: Il nome della tabella dei dati SWE nel database.
+            sparse_mode: La modalità di archiviazione ridotta ('zero' o 'delta'), oppure None per salvare tutte le righe.
+            tolerance: La tolleranza in mm usata dalla modalità di archiviazione ridotta.
+            parquet_sink: Il ParquetSink in cui scrivere i dati convertiti, oppure None.
+            check_mode: La modalità di controllo delle geometrie (vedi CHECK_MODES e check_geometries).
+            reprocess: Se True le righe già presenti vengono aggiornate se il valore è cambiato (vedi dataframe_to_postgresql). \n
+        Raises:
+            ValueError: Se la modalità di archiviazione ridotta o di controllo delle geometrie non è valida,
+                o se è richiesta la rielaborazione con l'archiviazione ridotta. \n
+        '''
+        check_sparse_mode(sparse_mode)
+        if check_mode not in CHECK_MODES:
+            raise ValueError(f"Modalità di controllo delle geometrie '{check_mode}' non valida: usare {' o '.join(CHECK_MODES)}.")
+        if reprocess and sparse_mode:
+            raise ValueError("La rielaborazione non è compatibile con l'archiviazione ridotta.")
+        self.file_path = file_path
+        self.session = session
+        self.geometry_table = geometry_table
+        self.swe_table = swe_table
+        self.sparse_mode = sparse_mode
+        self.tolerance = tolerance
+        self.parquet_sink = parquet_sink
+        self.check_mode = check_mode
+        self.reprocess = reprocess
+        self.date = is_valid_file(os.path.basename(file_path))
+        self.multi_date = is_multi_date_file(file_path)
+        self.counts = dict.fromkeys(UPLOAD_COUNTS, 0)
+        self.rows = 0
+        # Celle valide e righe salvate per data, per la copertura dell'archiviazione ridotta
+        self.coverage = {}
+        # Valori validi per data, per il riepilogo scritto al termine del file
+        self.summary = SummaryAccumulator()
+
+    # Metodo per preparare le destinazioni del file
+    def start(self) -> None:
+        '''Crea le partizioni degli anni nivologici del file, se la tabella SWE è partizionata, e inizia la scrittura in Parquet.'''
+        if self.session is not None:
+            first, last = file_date_range(os.path.basename(self.file_path))
+            for year in range(nivological_year(first), nivological_year(last) + 1):
+                self.session.ensure_partition(self.swe_table, year)
+        if self.parquet_sink is not None:
+            self.parquet_sink.start_file()
+
+    # Metodo per controllare le geometrie di un blocco
+    def check(self, chunk: tuple) -> None:
+        '''Controlla CRS e ID del blocco (dataframe, CRS, trasformazione) e aggiunge le geometrie mancanti.'''
+        if self.session is None:
+            return
+        df, crs, transform = chunk
+        # Nei file con più date un solo controllo per tutte le date del blocco
+        cell_ids = pd.unique(df['cell_id']) if self.multi_date else df['cell_id']
+        check_geometries(cell_ids, crs, transform, self.geometry_table, self.session, self.check_mode)
+
+    # Metodo per caricare un blocco già controllato
+    def load(self, chunk: tuple) -> None:
+        '''Carica il blocco (dataframe, CRS, trasformazione) nella tabella SWE e nel dataset Parquet, aggiornando i conteggi.'''
+        df, crs, transform = chunk
+        self.rows += len(df)
+        if self.parquet_sink is not None:
+            self.parquet_sink.write(df, crs)
+        if self.session is None:
+            self.counts['inserted'] += len(df)
+            return
+        # Raccoglie i valori del campo completo, prima che l'archiviazione ridotta ometta delle righe
+        if self.multi_date:
+            for group_date, values in df.groupby('date', sort=False)['swe_mm']:
+                self.summary.add(pd.Timestamp(group_date).strftime('%Y-%m-%d'), values.to_numpy())
+        else:
+            self.summary.add(self.date, df['swe_mm'].to_numpy())
+        if not self.multi_date:
+            groups = [(self.date, df)]
+        else:
+            groups = df.groupby('date', sort=True) if self.sparse_mode else [(None, df)]
+        for group_date, group in groups:
+            group_counts = dataframe_to_postgresql(group, self.swe_table, self.session, self.sparse_mode, self.tolerance, self.reprocess)
+            for key, value in group_counts.items():
+                self.counts[key] += value
+            if self.sparse_mode:
+                day = self.coverage.setdefault(pd.Timestamp(group_date).strftime('%Y-%m-%d'), [0, 0])
+                day[0] += len(group)
+                day[1] += group_counts['inserted'] + group_counts['updated'] + group_counts['skipped']
+
+    # Metodo per concludere il caricamento del file
+    def finish(self) -> dict:
+        '''
+        Registra la copertura di ogni data (con l'archiviazione ridotta) e il riepilogo di ogni data (vedi swe_summary),
+        quindi conclude il caricamento del file. \n
+        Returns:
+            dict: I conteggi delle righe inserite, aggiornate, già presenti e non salvate (vedi dataframe_to_postgresql);
+            senza database le righe scritte nel dataset Parquet risultano inserite. \n
+        '''
+        logging.info(f"File convertito e caricato: {self.rows} righe non nulle")
+        # Registra la copertura di ogni data per la ricostruzione del campo completo
+        if self.sparse_mode and self.session is not None:
+            for day, (valid_cells, stored_rows) in sorted(self.coverage.items()):
+                write_coverage(self.session, self.swe_table, nivological_year(day), day, self.sparse_mode, self.tolerance,
+                               valid_cells, stored_rows)
+        # Con la rielaborazione il riepilogo viene sostituito insieme ai dati, altrimenti resta quello già presente
+        if self.session is not None:
+            write_summary(self.session, self.summary.rows(nivological_year), self.swe_table, self.reprocess)
+        return self.counts
+
+
+# Funzione per preparare le somme per zona di un file GeoTIFF
+def zone_accumulator(file_path: str, date: str, zonal, warp: dict = None):
+    '''
+    Prepara le somme per zona di tutte le date del file, da aggiornare con i blocchi convertiti (vedi zonal_stats). \n
+    Args:
+        file_path: Il percorso del file GeoTIFF.
+        date: La data estratta dal nome del file nel formato 'YYYY-MM-DD'.
+        zonal: Lo ZonalStats delle zone da calcolare.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None. \n
+    Returns:
+        ZoneAccumulator: Le somme per zona del file. \n
+    '''
+    dates = read_file_band_dates(file_path) if is_multi_date_file(file_path) else [date]
+    return zonal.accumulator(file_path, dates, warp)
+
+
+# Funzione per aggiungere un blocco convertito alle somme per zona
+def add_zone_chunk(zones, chunk: tuple) -> None:
+    '''Aggiunge alle somme per zona il blocco (dataframe, CRS, trasformazione), misurando la fase 'zonal'.'''
+    df = chunk[0]
+    with stage('zonal', rows=len(df)) as zonal_stage:
+        zonal_stage['rows'] = zones.add(df)
+
+
+# Funzione per convertire e caricare un file GeoTIFF, per intero o a blocchi
+def upload_file(file_path: str, date: str, snow_year: int, session: UploadSession, geometry_table: str = 'cell_geom_table',
+                swe_table: str = 'cell_daily_swe_table', chunk_mb: int = None, sparse_mode: str = None, tolerance: float = 0.0,
+                converted: tuple = None, raster_table: str = None, parquet_sink=None, warp: dict = None,
+                check_mode: str = 'local', reprocess: bool = False, zonal=None) -> dict:
+    '''
+    Converte un file GeoTIFF e lo carica nella tabella SWE. \n
+    Con chunk_mb il file viene letto a finestre e ogni blocco viene controllato e caricato in una propria transazione:
+    in caso di errore il file può risultare caricato in parte, e una nuova esecuzione completa il caricamento
+    perché le righe già presenti vengono ignorate. \n
+    Con una modalità di archiviazione ridotta, al termine del caricamento viene registrata la copertura della data.
+    Se la tabella SWE è partizionata per anno nivologico, la partizione viene creata prima del caricamento.
+    Al termine del file viene scritta una riga per data nella tabella di riepilogo della tabella SWE (vedi swe_summary) e,
+    con zonal, vengono salvate le statistiche delle zone, sommate dai blocchi già convertiti (vedi zonal_stats).
+    Con raster_table il file viene salvato per intero come un'unica riga della tabella dei raster (vedi raster_storage),
+    senza righe per cella né geometrie.
+    Con parquet_sink i dati convertiti vengono scritti anche nel dataset Parquet (vedi parquet_sink);
+    se session è None vengono scritti solo nel dataset Parquet, senza accedere al database. \n
+    I GeoTIFF con più date ('SWE_YYYY-MM-DD_YYYY-MM-DD.tif', una banda per data) vengono letti in un solo passaggio:
+    gli ID di ogni blocco vengono controllati una sola volta per tutte le date e, senza archiviazione ridotta,
+    tutte le date del blocco vengono caricate insieme. Con l'archiviazione ridotta le date vengono caricate
+    una alla volta in ordine cronologico, perché la modalità 'delta' confronta ogni data con la precedente
+    già salvata e la copertura viene registrata per data. \n
+    Args:
+        file_path: Il percorso del file GeoTIFF da convertire.
+        date: La data estratta dal nome del file nel formato 'YYYY-MM-DD'.
+        snow_year: L'anno nivologico calcolato a partire dalla data.
+        session: La sessione di caricamento sul database PostgreSQL, oppure None per scrivere solo nel dataset Parquet.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        swe_table: Il nome della tabella dei dati SWE nel database.
+        chunk_mb: La memoria massima indicativa per blocco, in MB. Se None il file viene convertito per intero.
+        sparse_mode: La modalità di archiviazione ridotta ('zero' o 'delta'), oppure None per salvare tutte le righe.
+        tolerance: La tolleranza in mm usata dalla modalità di archiviazione ridotta.
+        converted: La tupla (dataframe, CRS, trasformazione) se il file è già stato convertito per intero, ad esempio in un altro processo.
+        raster_table: Il nome della tabella dei raster in cui salvare il file per intero, oppure None per le righe per cella.
+        parquet_sink: Il ParquetSink in cui scrivere i dati convertiti, oppure None.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None per leggere il file così com'è.
+        check_mode: La modalità di controllo delle geometrie, 'local' o 'server' (vedi check_geometries).
+        reprocess: Se True le righe (o i raster) già presenti vengono aggiornati se il valore è cambiato.
+        zonal: Lo ZonalStats delle zone di cui calcolare le statistiche, oppure None. \n
+    Returns:
+        dict: I conteggi delle righe inserite, aggiornate, già presenti e non salvate (vedi dataframe_to_postgresql);
+        senza database le righe scritte nel dataset Parquet risultano inserite. \n
+    '''
+    if raster_table:
+        dates = read_file_band_dates(file_path) if is_multi_date_file(file_path) else [date]
+        with for_file(file_path):
+            counts = raster_to_postgresql(file_path, dates, session, raster_table, warp, reprocess,
+                                          zonal if session is not None else None)
+    else:
+        upload = FileUpload(file_path, session, geometry_table, swe_table, sparse_mode, tolerance, parquet_sink, check_mode, reprocess)
+        upload.start()
+        chunks = [converted] if converted is not None else iter_file_chunks(file_path, date, snow_year, chunk_mb, warp)
+        # Controlla e carica il file un blocco alla volta (un solo blocco se convertito per intero)
+        with for_file(file_path):
+            zones = zone_accumulator(file_path, date, zonal, warp) if zonal is not None and session is not None else None
+            for chunk in chunks:
+                upload.check(chunk)
+                upload.load(chunk)
+                if zones is not None:
+                    add_zone_chunk(zones, chunk)
+        counts = upload.finish()
+        if zones is not None:
+            zonal.write(zones.results(), reprocess)
+    return counts
+
+
+# Funzione per caricare un file GeoTIFF solo se non è già registrato nel manifest
+def upload_file_once(file_path: str, date: str, snow_year: int, session: UploadSession, geometry_table: str = 'cell_geom_table',
+                     swe_table: str = 'cell_daily_swe_table', chunk_mb: int = None, sparse_mode: str = None, tolerance: float = 0.0,
+                     converted: tuple = None, force: bool = False, raster_table: str = None, parquet_sink=None,
+                     warp: dict = None, check_mode: str = 'local', reprocess: bool = False, zonal=None) -> dict:
+    '''
+    Carica un file GeoTIFF con upload_file e lo registra nel manifest delle ingestioni. \n
+    Se il manifest indica che il file è già stato caricato e non è cambiato, la conversione viene saltata.
+    Con parquet_sink il dataset ha una propria voce nel manifest: un file già caricato nel database ma non nel dataset
+    viene convertito e scritto solo nel dataset. Senza sessione (scrittura solo in Parquet) il manifest non viene usato. \n
+    Args:
+        file_path: Il percorso del file GeoTIFF da convertire.
+        date: La data estratta dal nome del file nel formato 'YYYY-MM-DD'.
+        snow_year: L'anno nivologico calcolato a partire dalla data.
+        session: La sessione di caricamento sul database PostgreSQL.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        swe_table: Il nome della tabella dei dati SWE nel database.
+        chunk_mb: La memoria massima indicativa per blocco, in MB. Se None il file viene convertito per intero.
+        sparse_mode: La modalità di archiviazione ridotta ('zero' o 'delta'), oppure None per salvare tutte le righe.
+        tolerance: La tolleranza in mm usata dalla modalità di archiviazione ridotta.
+        converted: La tupla (dataframe, CRS, trasformazione) se il file è già stato convertito per intero.
+        force: Se True il file viene caricato anche se è già registrato nel manifest.
+        raster_table: Il nome della tabella dei raster in cui salvare il file per intero, oppure None per le righe per cella.
+        parquet_sink: Il ParquetSink in cui scrivere i dati convertiti, oppure None.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None.
+        check_mode: La modalità di controllo delle geometrie, 'local' o 'server' (vedi check_geometries).
+        reprocess: Se True le righe già presenti vengono aggiornate se il valore è cambiato (vedi dataframe_to_postgresql).
+        zonal: Lo ZonalStats delle zone di cui calcolare le statistiche, oppure None. \n
+    Returns:
+        dict: I conteggi delle righe caricate, oppure None se il file è stato saltato. \n
+    '''
+    if session is None:
+        return upload_file(file_path, date, snow_year, None, geometry_table, swe_table, chunk_mb, sparse_mode, tolerance, converted,
+                           parquet_sink=parquet_sink, warp=warp, check_mode=check_mode, reprocess=reprocess)
+    manifest = session.manifest(raster_table or swe_table)
+    sink_manifest = session.manifest(parquet_sink.manifest_key) if parquet_sink is not None and not raster_table else None
+    if not force and manifest.is_loaded(file_path):
+        if sink_manifest is None or sink_manifest.is_loaded(file_path):
+            logging.info(f"File '{os.path.basename(file_path)}' già caricato e invariato: conversione saltata.")
+            return None
+        # Già caricato nel database ma non nel dataset Parquet: viene scritto solo nel dataset
+        logging.info(f"File '{os.path.basename(file_path)}' già caricato nel database: scrittura solo nel dataset Parquet.")
+        counts = upload_file(file_path, date, snow_year, None, geometry_table, swe_table, chunk_mb, sparse_mode, tolerance, converted,
+                             parquet_sink=parquet_sink, warp=warp, check_mode=check_mode, reprocess=reprocess)
+        sink_manifest.record(file_path, date, counts)
+        return counts
+    counts = upload_file(file_path, date, snow_year, session, geometry_table, swe_table, chunk_mb, sparse_mode, tolerance, converted,
+                         raster_table, parquet_sink, warp, check_mode, reprocess, zonal)
+    manifest.record(file_path, date, counts)
+    if sink_manifest is not None:
+        sink_manifest.record(file_path, date, counts)
+    return counts
 
 
 # funzione completa per eseguire la conversione e il caricamento dei file GeoTIFF
-def convert_and_upload(file_path: str, db_url: str, geometry_table: str = 'cell_geom_table', swe_table: str = 'cell_daily_swe_table') -> None:
+def convert_and_upload(file_path: str, db_url: str, geometry_table: str = 'cell_geom_table', swe_table: str = 'cell_daily_swe_table', session: UploadSession = None, chunk_mb: int = None,
+                       sparse_mode: str = None, tolerance: float = 0.0, force: bool = False, raster_table: str = None,
+                       parquet_dir: str = None, resampling: str = None, check_mode: str = 'local', reprocess: bool = False,
+                       zone_table: str = None) -> None:
     '''
     Converte un file GeoTIFF in un dataframe pandas e lo carica su un server postgreSQL. \n
     Args:
         file_path: Il percorso del file GeoTIFF da convertire.
-        db_url: L'URL di connessione al database PostgreSQL.
+        db_url: L'URL di connessione al database PostgreSQL. Se None (e session è None) i dati vengono scritti solo in parquet_dir.
         geometry_table: Il nome della tabella delle geometrie nel database.
-        swe_table: Il nome della tabella dei dati SWE nel database. \n
+        swe_table: Il nome della tabella dei dati SWE nel database.
+        session: La sessione di caricamento da riutilizzare. Se None viene aperta e chiusa una sessione per il solo file.
+        chunk_mb: Se indicato, il file viene convertito e caricato a blocchi indipendenti che non superano circa chunk_mb MB.
+        sparse_mode: La modalità di archiviazione ridotta ('zero' o 'delta', vedi sparse_storage), oppure None per salvare tutte le righe.
+        tolerance: La tolleranza in mm usata dalla modalità di archiviazione ridotta.
+        force: Se True il file viene caricato anche se il manifest lo indica come già caricato e invariato.
+        raster_table: Se indicato, il file viene salvato per intero come un'unica riga di questa tabella (vedi raster_storage).
+        parquet_dir: Se indicata, i dati convertiti vengono scritti anche nel dataset Parquet in questa cartella (vedi parquet_sink).
+        resampling: Se indicato, il file viene riproiettato sulla griglia della tabella delle geometrie con questo metodo
+            di ricampionamento (vedi reprojection) invece di essere scartato se CRS o pixel non corrispondono.
+        check_mode: 'local' per controllare gli ID con l'indice locale dei cell_id, 'server' con un anti-join sul database
+            senza scaricare gli ID della tabella delle geometrie (vedi geometry_check_server).
+        reprocess: Se True, per i raster corretti, le righe già presenti vengono aggiornate se il valore è cambiato
+            (vedi dataframe_to_postgresql).
+        zone_table: Se indicata, la tabella PostGIS delle zone di cui calcolare le statistiche zonali (vedi zonal_stats). \n
     Returns:
         None \n
     '''
@@ -246,21 +980,20 @@ def convert_and_upload(file_path: str, db_url: str, geometry_table: str = 'cell_
 
     # Esegue la conversione e il caricamento del file GeoTIFF
     try:
-        # Converte il file GeoTIFF in un dataframe pandas
-        df, crs, transform = geoTIFF_to_dataframe(file_path, date, snow_year)
-        logging.info(f"File convertito in DataFrame: {len(df)} righe non nulle")
-        # Controlla il CRS e gli ID del GeoDataFrame rispetto alla tabella del database
-        missing_ids = geometry_check(df['cell_id'], crs, transform, geometry_table, db_url)
-        # Controlla se ci sono geometrie mancanti
-        if missing_ids:
-            logging.warning(f"{len(missing_ids)} geometrie mancanti trovate nel DB. Verranno aggiunte.")
-            # Aggiunge le geometrie mancanti al database
-            add_missing_geometries(missing_ids, crs, geometry_table, db_url)
-            logging.info("Eventuali geometrie mancanti aggiunte.")
+        parquet_sink = ParquetSink(parquet_dir) if parquet_dir else None
+        if session is None and db_url:
+            with UploadSession(db_url) as file_session:
+                warp = warp_target(file_session, geometry_table, resampling) if resampling else None
+                zonal = ZonalStats(file_session, zone_table) if zone_table else None
+                upload_file_once(file_path, date, snow_year, file_session, geometry_table, swe_table, chunk_mb, sparse_mode, tolerance, force=force,
+                                 raster_table=raster_table, parquet_sink=parquet_sink, warp=warp, check_mode=check_mode, reprocess=reprocess,
+                                 zonal=zonal)
         else:
-            logging.info("Nessuna geometria mancante trovata.")
-        # Carica il GeoDataFrame nella tabella delle geometrie del database
-        dataframe_to_postgresql(df, swe_table, db_url)
+            warp = warp_target(session, geometry_table, resampling) if resampling and session is not None else None
+            zonal = ZonalStats(session, zone_table) if zone_table and session is not None else None
+            upload_file_once(file_path, date, snow_year, session, geometry_table, swe_table, chunk_mb, sparse_mode, tolerance, force=force,
+                             raster_table=raster_table, parquet_sink=parquet_sink, warp=warp, check_mode=check_mode, reprocess=reprocess,
+                             zonal=zonal)
     # Gestisce eventuali errori durante la conversione e il caricamento
     except Exception as e:
         logging.error(f"Errore durante l'elaborazione di '{file}': {e}", exc_info=True)
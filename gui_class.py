@@ -4,9 +4,22 @@ import threading
 import logging
 import queue
 import os
-from geoTIFF_converter import convert_and_upload, GuiLogHandler
+import time
+from gui_log import GuiLogHandler
+from batch_runner import run_batch
 
 status_label_idle_text = "In attesa..."
+# Modalità di archiviazione mostrate nell'interfaccia e relativo valore di sparse_mode
+storage_modes = {"Completa": None, "Senza celle a 0": "zero", "Solo variazioni": "delta"}
+# Colonne del pannello delle statistiche: chiave, intestazione e larghezza
+stats_columns = (("stage", "Fase", 140), ("seconds", "Tempo (s)", 90), ("rows", "Righe", 110),
+                 ("mb", "MB", 80), ("rows_per_s", "Righe/s", 100))
+# Intervallo in millisecondi tra due aggiornamenti dell'interfaccia
+refresh_ms = 100
+# Tempo massimo in secondi dedicato agli eventi della coda in ogni aggiornamento, per non bloccare la finestra
+refresh_budget_s = 0.05
+# Numero massimo di righe mantenute nel log della finestra (le più vecchie vengono eliminate)
+log_max_lines = 5000
 
 # Classe per l'interfaccia grafica del convertitore SWE
 class SWEConverterGUI(tk.Tk):
@@ -20,12 +33,17 @@ class SWEConverterGUI(tk.Tk):
         self.geometry("700x500")
         # Inizializza variabili e coda per la gestione dei thread
         self.selected_files = []
+        self.file_list = []
         self.queue = queue.Queue()
         self.stop_event = threading.Event()
+        # Totali per fase mostrati nel pannello delle statistiche
+        self.stage_totals = {}
+        # Stato dell'elaborazione
+        self._running = False
         # Configura il gestore di log per l'interfaccia grafica
-        gui_handler = GuiLogHandler(self.queue)
-        gui_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logging.getLogger().addHandler(gui_handler)
+        self.log_handler = GuiLogHandler(self.queue)
+        self.log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logging.getLogger().addHandler(self.log_handler)
         logging.getLogger().setLevel(logging.INFO)  # o DEBUG se vuoi più dettagli
         # Crea i widget dell'interfaccia grafica
         self._create_widgets()
@@ -44,6 +62,10 @@ class SWEConverterGUI(tk.Tk):
         log_frame = ttk.Frame(notebook)
         notebook.add(log_frame, text="Log")
         self._populate_log_tab(log_frame)
+        # TAB 3 - Statistiche
+        stats_frame = ttk.Frame(notebook)
+        notebook.add(stats_frame, text="Statistiche")
+        self._populate_stats_tab(stats_frame)
         # Crea i widget a fondo della finestra
         bottom_frame = ttk.Frame(self)
         bottom_frame.pack(side="bottom", fill="x", padx=10, pady=10)
@@ -77,6 +99,43 @@ class SWEConverterGUI(tk.Tk):
         self.entry_dbname = tk.Entry(conn_frame, width=20)
         self.entry_dbname.grid(row=4, column=1)
 
+        # Frame per le opzioni di elaborazione
+        options_frame = tk.LabelFrame(frame, text="Opzioni di elaborazione")
+        options_frame.pack(fill="x", padx=20, pady=10)
+        # Crea il campo del numero di processi di conversione, predefinito al numero di core
+        tk.Label(options_frame, text="Processi paralleli:").grid(row=0, column=0, sticky='e')
+        self.spin_workers = tk.Spinbox(options_frame, from_=1, to=max(1, os.cpu_count() or 1) * 2, width=5)
+        self.spin_workers.grid(row=0, column=1, sticky='w')
+        self.spin_workers.delete(0, tk.END)
+        self.spin_workers.insert(0, str(os.cpu_count() or 1))
+        # Crea il campo della memoria massima per blocco (vuoto = conversione del file intero)
+        tk.Label(options_frame, text="Blocchi (MB, vuoto = file intero):").grid(row=1, column=0, sticky='e')
+        self.entry_chunk_mb = tk.Entry(options_frame, width=7)
+        self.entry_chunk_mb.grid(row=1, column=1, sticky='w')
+        # Crea il menu della modalità di archiviazione e il campo della tolleranza
+        tk.Label(options_frame, text="Archiviazione:").grid(row=2, column=0, sticky='e')
+        self.combo_storage = ttk.Combobox(options_frame, values=list(storage_modes), state="readonly", width=18)
+        self.combo_storage.current(0)
+        self.combo_storage.grid(row=2, column=1, sticky='w')
+        tk.Label(options_frame, text="Tolleranza (mm):").grid(row=3, column=0, sticky='e')
+        self.entry_tolerance = tk.Entry(options_frame, width=7)
+        self.entry_tolerance.grid(row=3, column=1, sticky='w')
+        self.entry_tolerance.insert(0, "0")
+        # Crea l'opzione per ricaricare i file già registrati nel manifest
+        self.force_var = tk.BooleanVar(value=False)
+        self.check_force = tk.Checkbutton(options_frame, text="Ricarica i file già caricati", variable=self.force_var)
+        self.check_force.grid(row=4, column=0, columnspan=2, sticky='w')
+        # Crea l'opzione per controllare le geometrie sul server, senza scaricare gli ID (database remoto)
+        self.server_check_var = tk.BooleanVar(value=False)
+        self.check_server = tk.Checkbutton(options_frame, text="Controlla le geometrie sul server (database remoto)",
+                                           variable=self.server_check_var)
+        self.check_server.grid(row=5, column=0, columnspan=2, sticky='w')
+        # Crea l'opzione per aggiornare solo i valori cambiati dei raster corretti (solo con archiviazione completa)
+        self.reprocess_var = tk.BooleanVar(value=False)
+        self.check_reprocess = tk.Checkbutton(options_frame, text="Aggiorna i valori cambiati (raster corretti)",
+                                              variable=self.reprocess_var)
+        self.check_reprocess.grid(row=6, column=0, columnspan=2, sticky='w')
+
         # Frame per selezione dei file
         file_frame = tk.LabelFrame(frame, text="Selezione file GeoTIFF")
         file_frame.pack(fill="both", expand=True, padx=20, pady=10)
@@ -112,6 +171,33 @@ class SWEConverterGUI(tk.Tk):
         scrollbar = tk.Scrollbar(log_container, command=self.log_text.yview)
         self.log_text['yscrollcommand'] = scrollbar.set
 
+    # Metodo per popolare la tab delle statistiche
+    def _populate_stats_tab(self, frame: ttk.Frame):
+        '''Popola la tab delle statistiche con la tabella dei tempi e delle righe per fase.'''
+        self.stats_tree = ttk.Treeview(frame, columns=[key for key, _, _ in stats_columns], show="headings", height=8)
+        for key, heading, width in stats_columns:
+            self.stats_tree.heading(key, text=heading)
+            self.stats_tree.column(key, width=width, anchor="w" if key == "stage" else "e")
+        self.stats_tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.stats_file_var = tk.StringVar(value="")
+        ttk.Label(frame, textvariable=self.stats_file_var, anchor="w").pack(fill="x", padx=10, pady=(0, 10))
+
+    # Metodo per aggiornare il pannello delle statistiche con la misura di una fase
+    def _update_stats(self, record: dict):
+        '''Aggiunge la misura di una fase ai totali e aggiorna la relativa riga della tabella.'''
+        total = self.stage_totals.setdefault(record['stage'], {'seconds': 0.0, 'rows': 0, 'bytes': 0})
+        total['seconds'] += record['seconds']
+        total['rows'] += record['rows'] or 0
+        total['bytes'] += record['bytes'] or 0
+        rate = f"{total['rows'] / total['seconds']:,.0f}" if total['seconds'] and total['rows'] else "-"
+        values = (record['stage'], f"{total['seconds']:.2f}", f"{total['rows']:,}", f"{total['bytes'] / 2 ** 20:,.1f}", rate)
+        if self.stats_tree.exists(record['stage']):
+            self.stats_tree.item(record['stage'], values=values)
+        else:
+            self.stats_tree.insert("", tk.END, iid=record['stage'], values=values)
+        if record['file']:
+            self.stats_file_var.set(f"Ultima misura: {record['stage']} di {record['file']} ({record['seconds']:.2f} s)")
+
     # Metodo per creare i widget a fondo della finestra
     def _populate_bottom_frame(self, frame: ttk.Frame):
         '''Crea i widget a fondo della finestra principale.'''
@@ -125,7 +211,7 @@ class SWEConverterGUI(tk.Tk):
         self.progress_bar = ttk.Progressbar(progress_button_frame, mode='determinate')
         self.progress_bar.pack(side="left", fill="x", expand=True, pady=(0, 5))
         # Pulsante per interrompere la conversione
-        self.btn_stop = tk.Button(progress_button_frame, text="Interrompi", command=self.quit)
+        self.btn_stop = tk.Button(progress_button_frame, text="Interrompi", command=self._stop_processing)
         self.btn_stop.pack(side="right", padx=(10, 0), pady=(0, 5))
         # Disabilita il pulsante di stop inizialmente
         self.btn_stop.config(state="disabled")
@@ -168,6 +254,29 @@ class SWEConverterGUI(tk.Tk):
             return
         # Crea l'URL di connessione al database PostgreSQL
         db_url = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
+        # Estrae il numero di processi di conversione
+        try:
+            workers = int(self.spin_workers.get())
+        except ValueError:
+            messagebox.showwarning("Attenzione", "Il numero di processi deve essere un intero.")
+            return
+        # Estrae la memoria massima per blocco, se indicata
+        try:
+            chunk_mb = int(self.entry_chunk_mb.get()) if self.entry_chunk_mb.get().strip() else None
+        except ValueError:
+            messagebox.showwarning("Attenzione", "La dimensione dei blocchi deve essere un intero in MB.")
+            return
+        # Estrae la modalità di archiviazione e la tolleranza
+        sparse_mode = storage_modes[self.combo_storage.get()]
+        try:
+            tolerance = float(self.entry_tolerance.get() or 0)
+        except ValueError:
+            messagebox.showwarning("Attenzione", "La tolleranza deve essere un numero in mm.")
+            return
+        reprocess = self.reprocess_var.get()
+        if reprocess and sparse_mode:
+            messagebox.showwarning("Attenzione", "L'aggiornamento dei valori cambiati richiede l'archiviazione completa.")
+            return
 
         # Da valore alla progress bar
         self.progress_bar["value"] = 0
@@ -177,12 +286,26 @@ class SWEConverterGUI(tk.Tk):
         self.btn_stop.config(state="normal")
         self.btn_select.config(state="disabled")
         self._toggle_db_fields("disabled")
+        self.spin_workers.config(state="disabled")
+        self.entry_chunk_mb.config(state="disabled")
+        self.combo_storage.config(state="disabled")
+        self.entry_tolerance.config(state="disabled")
+        self.check_force.config(state="disabled")
+        self.check_server.config(state="disabled")
+        self.check_reprocess.config(state="disabled")
         self.stop_event.clear()
+        # Azzera il pannello delle statistiche
+        self.stage_totals.clear()
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        self.stats_file_var.set("")
         self._append_log("Avvio conversione...\n")
+        self._running = True
 
         # Crea un thread per eseguire la conversione e il caricamento
-        threading.Thread(target=self._worker_thread, args=(db_url,), daemon=True).start()
-        self.after(100, self._process_queue)
+        check_mode = "server" if self.server_check_var.get() else "local"
+        worker_args = (db_url, workers, chunk_mb, sparse_mode, tolerance, self.force_var.get(), check_mode, reprocess)
+        threading.Thread(target=self._worker_thread, args=worker_args, daemon=True).start()
+        self.after(refresh_ms, self._process_queue)
     
     # Metodo per abilitare/disabilitare i campi del database
     def _toggle_db_fields(self, state):
@@ -194,36 +317,38 @@ class SWEConverterGUI(tk.Tk):
     
     # Metodo per interrompere il processo di conversione
     def _stop_processing(self):
+        '''Interrompe l'elaborazione: le query in corso vengono annullate e la loro transazione annullata con un rollback.'''
         self.stop_event.set()
+        self.btn_stop.config(state="disabled")
+        self.status_label.config(text="Interruzione in corso...")
         self._append_log("Interruzione richiesta dall'utente.")
     
     # Metodo per eseguire la conversione e il caricamento in un thread separato
-    def _worker_thread(self, db_url):
+    def _worker_thread(self, db_url, workers, chunk_mb, sparse_mode, tolerance, force, check_mode, reprocess):
         '''Esegue la conversione e il caricamento dei file in un thread separato.'''
-        success = True
-        failed_files = []
-        for idx, file in enumerate(self.file_list, start=1):
-            if self.stop_event.is_set():
-                self.queue.put(("log", "Elaborazione interrotta."))
-                success = False
-                break
-            self.queue.put(("update", file, idx))
-            try:
-                convert_and_upload(file, db_url)
-                self.queue.put(("log", f"Completato: {file}"))
-            except Exception as e:
-                success = False
-                failed_files.append(file)
-                self.queue.put(("error", file, str(e)))
-                # Continua con il prossimo file in caso di errore
-                continue
+        # La conversione avviene in un pool di processi, il caricamento in questo thread in ordine di data;
+        # con Interrompi le query in corso vengono annullate senza attendere la fine del blocco
+        try:
+            failed_files = run_batch(self.file_list, db_url, workers=workers, notify=self._notify, stop_event=self.stop_event,
+                                     chunk_mb=chunk_mb, sparse_mode=sparse_mode, tolerance=tolerance, force=force,
+                                     check_mode=check_mode, reprocess=reprocess, cancel_on_stop=True)
+            success = not self.stop_event.is_set()
+        except Exception as e:
+            logging.error(f"Errore durante l'elaborazione: {e}", exc_info=True)
+            failed_files, success = [], False
         self.queue.put(("done", success, failed_files))
 
     # Metodo per processare la coda degli eventi
     def _process_queue(self):
-        '''Processa gli eventi nella coda e aggiorna l'interfaccia grafica.'''
+        '''
+        Processa gli eventi nella coda e aggiorna l'interfaccia grafica. \n
+        Ogni aggiornamento dedica agli eventi al più refresh_budget_s secondi (quelli restanti passano all'aggiornamento
+        successivo) e mostra le nuove righe del log in un'unica scrittura. L'aggiornamento viene ripianificato
+        finché l'elaborazione non è terminata, anche dopo una richiesta di interruzione.
+        '''
+        deadline = time.perf_counter() + refresh_budget_s
         try:
-            while True:
+            while time.perf_counter() < deadline:
                 # Ottiene il messaggio dalla coda
                 msg = self.queue.get_nowait()
                 kind = msg[0]
@@ -233,18 +358,17 @@ class SWEConverterGUI(tk.Tk):
                     self.progress_bar["value"] = idx
                     filename = os.path.basename(file)
                     self.status_label.config(text=f"Elaborazione file {idx}/{len(self.file_list)}: {filename}")
-                    self._append_log(f"Elaborazione file {idx}: {os.path.basename(file)}")
-                # Caso log, aggiunge il messaggio al log
-                elif kind == "log":
-                    _, text = msg
-                    self._append_log(text)
+                # Caso stats, aggiorna il pannello delle statistiche con la misura di una fase
+                elif kind == "stats":
+                    _, record = msg
+                    self._update_stats(record)
                 # Caso error, mostra un messaggio di errore
                 elif kind == "error":
                     _, file, err = msg
-                    self._append_log(f"Errore su {file}: {err}")
                     messagebox.showerror("Errore", f"Errore su {file}:\n{err}")
                 # Caso done, aggiorna la barra di progresso e mostra un messaggio di successo o errore  
                 elif kind == "done":
+                    self._running = False
                     if len(msg) == 3:
                         _, success, failed_files = msg
                     else:
@@ -254,6 +378,13 @@ class SWEConverterGUI(tk.Tk):
                     self.btn_stop.config(state="disabled")
                     self.btn_select.config(state="normal")
                     self._toggle_db_fields("normal")
+                    self.spin_workers.config(state="normal")
+                    self.entry_chunk_mb.config(state="normal")
+                    self.combo_storage.config(state="readonly")
+                    self.entry_tolerance.config(state="normal")
+                    self.check_force.config(state="normal")
+                    self.check_server.config(state="normal")
+                    self.check_reprocess.config(state="normal")
                     if success and not failed_files:
                         self._append_log("Conversione completata con successo")
                         self.status_label.config(text="Conversione completata con successo")
@@ -268,16 +399,51 @@ class SWEConverterGUI(tk.Tk):
         except queue.Empty:
             pass
         finally:
-            if not self.stop_event.is_set():
-                self.after(100, self._process_queue)
+            self._flush_log()
+            if self._running:
+                self.after(refresh_ms, self._process_queue)
+
+    # Metodo per ricevere gli eventi di avanzamento dal thread di elaborazione
+    def _notify(self, event):
+        '''
+        Registra subito nel log la riga dell'evento, così resta nell'ordine rispetto ai messaggi dei logger,
+        e passa l'evento alla coda dell'interfaccia per gli altri aggiornamenti.
+        '''
+        kind = event[0]
+        if kind == "update":
+            self.log_handler.append(f"Elaborazione file {event[2]}: {os.path.basename(event[1])}")
+        elif kind == "log":
+            self.log_handler.append(event[1])
+        elif kind == "error":
+            self.log_handler.append(f"Errore su {event[1]}: {event[2]}")
+        self.queue.put(event)
 
     # Metodo per aggiungere un messaggio al log
     def _append_log(self, text):
-        '''Aggiunge un messaggio al log della finestra di avanzamento.'''
+        '''Aggiunge un messaggio al log della finestra di avanzamento, mostrato al prossimo aggiornamento.'''
+        self.log_handler.append(text)
+        if not self._running:
+            self._flush_log()
+
+    # Metodo per mostrare le righe del log in attesa
+    def _flush_log(self):
+        '''
+        Mostra in un'unica scrittura le righe in attesa (dell'interfaccia, degli eventi e dei logger, nell'ordine di arrivo), mantenendo nel widget
+        al più log_max_lines righe e segnalando le righe scartate perché arrivate troppo velocemente.
+        '''
+        lines, dropped = self.log_handler.drain()
+        if dropped:
+            lines.insert(0, f"... {dropped} righe del log non mostrate ...")
+        if not lines:
+            return
+        # Scorre automaticamente solo se il log era già visualizzato fino in fondo
+        at_bottom = self.log_text.yview()[1] >= 1.0
         self.log_text.config(state="normal")
-        self.log_text.insert(tk.END, text + "\n")
-        self.log_text.see(tk.END)
+        self.log_text.insert(tk.END, "\n".join(lines[-log_max_lines:]) + "\n")
+        self.log_text.delete("1.0", f"end-{log_max_lines + 1}l")
         self.log_text.config(state="disabled")
+        if at_bottom:
+            self.log_text.see(tk.END)
 
 
 if __name__ == "__main__":
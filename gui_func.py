@@ -4,8 +4,9 @@ L'interfaccia consente di selezionare più file e li carica in un server postgre
 '''
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
+import os
 import threading
-from geoTIFF_converter import convert_and_upload
+from batch_runner import run_batch
 
 
 def launch_gui():
@@ -99,26 +100,29 @@ def launch_gui():
 
         # Funzione per eseguire la conversione e il caricamento in un thread separato
         def worker():
-            success = True
-            for idx, file in enumerate(selected_files, 1):
-                def update_gui():
-                    progress_label.config(text=f"Sto convertendo: {file.split('/')[-1]} ({idx}/{len(selected_files)})")
-                    progress_bar['value'] = idx - 1
-                root.after(0, update_gui)
-                root.after(0, lambda f=file: log(f"Inizio conversione: {f}"))
-
-                try:
-                    convert_and_upload(file, db_url)
-                    root.after(0, lambda f=file: log(f"Completato: {f}"))
-                except Exception as e:
-                    success = False
-                    def show_error(error):
-                        progress_label.config(text=f"Errore su {file.split('/')[-1]}: {e}")
-                        progress_bar['value'] = idx
+            # Notifica gli eventi del runner all'interfaccia grafica tramite root.after
+            def notify(event):
+                kind = event[0]
+                if kind == "update":
+                    _, file, idx = event
+                    def update_gui():
+                        progress_label.config(text=f"Sto convertendo: {os.path.basename(file)} ({idx}/{len(selected_files)})")
+                        progress_bar['value'] = idx - 1
+                    root.after(0, update_gui)
+                    root.after(0, lambda f=file: log(f"Inizio conversione: {f}"))
+                elif kind == "log":
+                    root.after(0, lambda m=event[1]: log(m))
+                elif kind == "error":
+                    _, file, error = event
+                    def show_error():
+                        progress_label.config(text=f"Errore su {os.path.basename(file)}: {error}")
                         log(f"Errore su {file}: {error}")
                         messagebox.showerror("Errore", f"Errore su {file}:\n{error}")
-                    root.after(0, lambda err=e: show_error(err))
-                    break
+                    root.after(0, show_error)
+
+            # Converte i file in parallelo e li carica in ordine di data
+            failed_files = run_batch(list(selected_files), db_url, notify=notify)
+            success = not failed_files
 
             def finish():
                 progress_bar['value'] = len(selected_files)
@@ -0,0 +1,77 @@
+'''
+Questo modulo contiene l'handler di logging che inoltra i messaggi all'interfaccia grafica. \n
+È separato da geoTIFF_converter perché l'interfaccia lo importa all'avvio, quando le librerie
+per la conversione non sono ancora state caricate. \n
+I messaggi vengono raccolti in un buffer circolare di al più max_lines righe, che l'interfaccia svuota
+periodicamente con drain e mostra in un solo aggiornamento: se tra due aggiornamenti arrivano più righe
+(ad esempio al livello DEBUG), le più vecchie vengono scartate e contate, senza che la memoria cresca.
+Anche i messaggi dell'interfaccia e degli eventi di avanzamento passano dallo stesso buffer (vedi append),
+così il log mostra tutte le righe nell'ordine in cui sono arrivate. \n
+'''
+import logging
+from collections import deque
+
+# Numero massimo predefinito di righe in attesa di essere mostrate
+MAX_PENDING_LINES = 2000
+
+
+# Configura il logger con un handler
+class GuiLogHandler(logging.Handler):
+    '''Handler di logging che raccoglie le righe per l'interfaccia grafica in un buffer circolare.'''
+    # Metodo di inizializzazione della classe GuiLogHandler
+    def __init__(self, queue, max_lines: int = MAX_PENDING_LINES):
+        '''
+        Inizializza l'handler. \n
+        Args:
+            queue: La coda degli eventi dell'interfaccia, in cui vengono inoltrate le misure delle fasi.
+            max_lines: Il numero massimo di righe in attesa di essere mostrate. \n
+        '''
+        super().__init__()
+        self.queue = queue
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+
+    def emit(self, record):
+        # Le misure delle fasi (vedi metrics) vengono inoltrate anche come eventi per il pannello delle statistiche
+        stats = getattr(record, 'stats', None)
+        if stats is not None:
+            self.queue.put(("stats", stats))
+        msg = self.format(record)
+        # emit viene chiamato con il lock dell'handler, condiviso con drain
+        self._append(msg)
+
+    # Metodo per aggiungere una riga al buffer, con il lock dell'handler già acquisito
+    def _append(self, line: str) -> None:
+        '''Aggiunge la riga al buffer, contando la riga più vecchia scartata se il buffer è pieno.'''
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+
+    # Metodo per aggiungere una riga che non proviene dai logger
+    def append(self, line: str) -> None:
+        '''
+        Aggiunge al buffer una riga dell'interfaccia o di un evento di avanzamento, dopo le righe già arrivate. \n
+        Args:
+            line: La riga da mostrare. \n
+        '''
+        self.acquire()
+        try:
+            self._append(line)
+        finally:
+            self.release()
+
+    # Metodo per prelevare le righe in attesa
+    def drain(self) -> tuple[list, int]:
+        '''
+        Preleva le righe in attesa e il numero di righe scartate dall'ultimo prelievo. \n
+        Returns:
+            tuple: La lista delle righe, dalla più vecchia, e il numero di righe scartate. \n
+        '''
+        self.acquire()
+        try:
+            lines = list(self.lines)
+            self.lines.clear()
+            dropped, self.dropped = self.dropped, 0
+        finally:
+            self.release()
+        return lines, dropped
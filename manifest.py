@@ -0,0 +1,134 @@
+'''
+Questo modulo gestisce il manifest delle ingestioni, una tabella del database che registra i file GeoTIFF già caricati. \n
+Per ogni tabella SWE e nome del file vengono salvati la (prima) data, la dimensione, la data di modifica e l'hash SHA-256
+del file, insieme ai conteggi delle righe caricate. La chiave è il nome del file e non la data, perché un GeoTIFF con più date
+('SWE_YYYY-MM-DD_YYYY-MM-DD.tif') inizia nello stesso giorno del file con una sola data o di altri GeoTIFF con più date.
+Prima della conversione il file viene confrontato con il manifest: se dimensione e data di modifica coincidono il file
+viene saltato senza leggerlo; se cambia solo la data di modifica viene calcolato l'hash e il file viene saltato
+quando il contenuto è invariato. \n
+'''
+import os
+import hashlib
+import logging
+from sqlalchemy import text
+
+# Dimensione dei blocchi letti per il calcolo dell'hash
+_HASH_BLOCK_SIZE = 4 * 2 ** 20
+
+
+# Funzione per calcolare l'hash SHA-256 di un file
+def file_hash(file_path: str) -> str:
+    '''
+    Calcola l'hash SHA-256 del contenuto di un file, leggendolo a blocchi. \n
+    Args:
+        file_path: Il percorso del file. \n
+    Returns:
+        str: L'hash esadecimale del file. \n
+    '''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Classe per il manifest delle ingestioni di una tabella SWE
+class IngestManifest:
+    '''Manifest dei file già caricati in una tabella SWE, letto una sola volta per sessione.'''
+    # Metodo di inizializzazione della classe IngestManifest
+    def __init__(self, engine, swe_table: str, manifest_table: str = 'swe_ingest_manifest'):
+        '''Crea la tabella del manifest, se non esiste, e carica le voci della tabella SWE indicata.'''
+        self.engine = engine
+        self.swe_table = swe_table
+        self.manifest_table = manifest_table
+        with engine.begin() as connection:
+            connection.execute(text(f'''
+                CREATE TABLE IF NOT EXISTS {manifest_table} (
+                    swe_table text NOT NULL,
+                    file_date date NOT NULL,
+                    file_name text NOT NULL,
+                    file_size bigint NOT NULL,
+                    file_mtime double precision NOT NULL,
+                    sha256 text NOT NULL,
+                    rows_inserted bigint NOT NULL,
+                    rows_updated bigint NOT NULL DEFAULT 0,
+                    rows_skipped bigint NOT NULL,
+                    rows_omitted bigint NOT NULL,
+                    loaded_at timestamptz NOT NULL DEFAULT now(),
+                    PRIMARY KEY (swe_table, file_name)
+                );
+            '''))
+            # Sposta la chiave primaria dalla data al nome del file nei manifest creati prima dei GeoTIFF con più date
+            primary_key = connection.execute(text('''
+                SELECT c.conname, array_agg(a.attname::text ORDER BY a.attnum)
+                FROM pg_constraint c
+                JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+                WHERE c.conrelid = to_regclass(:table) AND c.contype = 'p'
+                GROUP BY c.conname;
+            '''), {"table": manifest_table}).fetchone()
+            if primary_key is not None and sorted(primary_key[1]) != ['file_name', 'swe_table']:
+                connection.execute(text(f'''
+                    ALTER TABLE {manifest_table} DROP CONSTRAINT {primary_key[0]}, ADD PRIMARY KEY (swe_table, file_name);
+                '''))
+            # Aggiunge la colonna delle righe aggiornate ai manifest creati prima della rielaborazione
+            connection.execute(text(f'''
+                ALTER TABLE {manifest_table} ADD COLUMN IF NOT EXISTS rows_updated bigint NOT NULL DEFAULT 0;
+            '''))
+            rows = connection.execute(text(f'''
+                SELECT file_name, file_size, file_mtime, sha256 FROM {manifest_table} WHERE swe_table = :swe_table
+            '''), {"swe_table": swe_table}).fetchall()
+        self.entries = {file_name: (file_size, file_mtime, sha256) for file_name, file_size, file_mtime, sha256 in rows}
+        logging.debug(f"Manifest caricato: {len(self.entries)} file già registrati per '{swe_table}'.")
+
+    # Metodo per controllare se un file è già stato caricato senza modifiche
+    def is_loaded(self, file_path: str) -> bool:
+        '''
+        Controlla se il file è già stato caricato e non è cambiato. \n
+        Args:
+            file_path: Il percorso del file GeoTIFF. \n
+        Returns:
+            bool: True se il file può essere saltato. \n
+        Raises:
+            OSError: Se il file non esiste più o non è leggibile. \n
+        '''
+        entry = self.entries.get(os.path.basename(file_path))
+        if entry is None:
+            return False
+        file_size, file_mtime, sha256 = entry
+        stat = os.stat(file_path)
+        if stat.st_size != file_size:
+            return False
+        # Stessa dimensione e stessa data di modifica: il file non viene letto
+        if stat.st_mtime == file_mtime:
+            return True
+        # Data di modifica diversa: confronta il contenuto
+        return file_hash(file_path) == sha256
+
+    # Metodo per registrare un file caricato
+    def record(self, file_path: str, date: str, counts: dict) -> None:
+        '''
+        Registra (o aggiorna) il file caricato nel manifest. \n
+        Args:
+            file_path: Il percorso del file GeoTIFF.
+            date: La data del file nel formato 'YYYY-MM-DD' (la prima data per i file con più date).
+            counts: I conteggi delle righe restituiti dal caricamento. \n
+        '''
+        stat = os.stat(file_path)
+        sha256 = file_hash(file_path)
+        with self.engine.begin() as connection:
+            connection.execute(text(f'''
+                INSERT INTO {self.manifest_table} (swe_table, file_date, file_name, file_size, file_mtime, sha256,
+                                                   rows_inserted, rows_updated, rows_skipped, rows_omitted)
+                VALUES (:swe_table, :file_date, :file_name, :file_size, :file_mtime, :sha256,
+                        :rows_inserted, :rows_updated, :rows_skipped, :rows_omitted)
+                ON CONFLICT (swe_table, file_name) DO UPDATE SET
+                    file_date = EXCLUDED.file_date, file_size = EXCLUDED.file_size, file_mtime = EXCLUDED.file_mtime,
+                    sha256 = EXCLUDED.sha256, rows_inserted = EXCLUDED.rows_inserted, rows_updated = EXCLUDED.rows_updated,
+                    rows_skipped = EXCLUDED.rows_skipped,
+                    rows_omitted = EXCLUDED.rows_omitted, loaded_at = now();
+            '''), {"swe_table": self.swe_table, "file_date": date, "file_name": os.path.basename(file_path),
+                   "file_size": stat.st_size, "file_mtime": stat.st_mtime, "sha256": sha256,
+                   "rows_inserted": counts.get('inserted', 0), "rows_updated": counts.get('updated', 0),
+                   "rows_skipped": counts.get('skipped', 0),
+                   "rows_omitted": counts.get('omitted', 0)})
+        self.entries[os.path.basename(file_path)] = (stat.st_size, stat.st_mtime, sha256)
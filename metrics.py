@@ -0,0 +1,181 @@
+'''
+Questo modulo misura le fasi della conversione e del caricamento (lettura, conversione, controllo, inserimento
+delle geometrie, caricamento) e produce il report di un'elaborazione. \n
+Ogni fase viene misurata con il context manager stage, che registra durata, righe, byte e righe al secondo.
+Le misure vengono scritte nel log con il logger 'swe.metrics' e allegate al record di logging (attributo 'stats'):
+GuiLogHandler le inoltra alla coda dell'interfaccia grafica come eventi ("stats", misura). \n
+Durante un'elaborazione (start_run / end_run) le misure vengono raccolte in un RunMetrics, che al termine
+scrive il report in JSON e CSV nella cartella REPORT_DIR (modificabile con la variabile d'ambiente SWE_REPORT_DIR). \n
+Le misure prese in un processo di conversione separato vengono raccolte con capture e restituite al processo principale. \n
+Il file assegnato con for_file e la raccolta di capture valgono per il solo thread corrente, così le fasi
+dell'elaborazione a pipeline (vedi batch_runner), eseguite in thread diversi, attribuiscono le misure al proprio file. \n
+'''
+import os
+import csv
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Cartella predefinita dei report delle elaborazioni
+REPORT_DIR = os.environ.get('SWE_REPORT_DIR', os.path.join(os.path.expanduser('~'), '.swe_converter', 'reports'))
+# Colonne delle misure nel report CSV
+REPORT_FIELDS = ('file', 'stage', 'seconds', 'rows', 'bytes', 'rows_per_s')
+
+logger = logging.getLogger('swe.metrics')
+
+# Raccolta delle misure attiva nel processo corrente
+_current = None
+# Stato del thread corrente: file in elaborazione ('file'), assegnato alle misure che non indicano un file,
+# e raccolta di capture ('captured'), che sostituisce quella del processo
+_local = threading.local()
+
+
+# Classe per la raccolta delle misure di un'elaborazione
+class RunMetrics:
+    '''Raccolta delle misure delle fasi di un'elaborazione.'''
+    # Metodo di inizializzazione della classe RunMetrics
+    def __init__(self, emit: bool = True):
+        '''Inizializza una raccolta vuota; con emit le misure aggiunte vengono scritte anche nel log.'''
+        self.records = []
+        self.emit = emit
+        self.started = time.time()
+
+    # Metodo per aggiungere una misura
+    def add(self, record: dict) -> None:
+        '''Aggiunge una misura alla raccolta e, se richiesto, la scrive nel log.'''
+        self.records.append(record)
+        if self.emit:
+            _emit(record)
+
+    # Metodo per calcolare i totali per fase
+    def totals(self) -> dict:
+        '''
+        Calcola i totali di durata, righe e byte per ogni fase. \n
+        Returns:
+            dict: Un dizionario fase -> {'seconds', 'rows', 'bytes', 'rows_per_s'}. \n
+        '''
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'seconds': 0.0, 'rows': 0, 'bytes': 0})
+            total['seconds'] += record['seconds']
+            total['rows'] += record['rows'] or 0
+            total['bytes'] += record['bytes'] or 0
+        for total in totals.values():
+            total['rows_per_s'] = round(total['rows'] / total['seconds'], 1) if total['seconds'] else None
+            total['seconds'] = round(total['seconds'], 4)
+        return totals
+
+    # Metodo per scrivere il report dell'elaborazione
+    def write_report(self, path: str = None) -> tuple[str, str]:
+        '''
+        Scrive il report dell'elaborazione in JSON (misure e totali) e in CSV (misure). \n
+        Args:
+            path: Il percorso del report senza estensione. Se None viene creato in REPORT_DIR con data e ora di inizio. \n
+        Returns:
+            tuple: I percorsi del report JSON e del report CSV. \n
+        '''
+        if path is None:
+            path = os.path.join(REPORT_DIR, time.strftime('run_%Y%m%d_%H%M%S', time.localtime(self.started)))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        json_path, csv_path = path + '.json', path + '.csv'
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed_seconds': round(time.time() - self.started, 2),
+            'totals': self.totals(),
+            'stages': self.records,
+        }
+        with open(json_path, 'w') as file:
+            json.dump(report, file, indent=2)
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows({field: record.get(field) for field in REPORT_FIELDS} for record in self.records)
+        return json_path, csv_path
+
+
+# Funzione per scrivere una misura nel log
+def _emit(record: dict) -> None:
+    '''Scrive la misura nel log allegandola al record (attributo 'stats').'''
+    rate = f", {record['rows_per_s']:.0f} righe/s" if record['rows_per_s'] else ""
+    rows = f", {record['rows']} righe" if record['rows'] is not None else ""
+    logger.info(f"Fase '{record['stage']}' ({record['file'] or '-'}): {record['seconds']:.2f} s{rows}{rate}",
+                extra={'stats': dict(record)})
+
+
+# Funzione per iniziare la raccolta delle misure di un'elaborazione
+def start_run() -> RunMetrics:
+    '''Inizia una nuova raccolta delle misure nel processo corrente e la restituisce.'''
+    global _current
+    _current = RunMetrics()
+    return _current
+
+
+# Funzione per terminare la raccolta delle misure di un'elaborazione
+def end_run() -> None:
+    '''Termina la raccolta delle misure nel processo corrente.'''
+    global _current
+    _current = None
+
+
+# Funzione per raccogliere le misure di un blocco di codice senza scriverle nel log
+@contextmanager
+def capture():
+    '''
+    Raccoglie le misure prese nel blocco in una lista, senza scriverle nel log, ad esempio in un processo separato. \n
+    Returns:
+        list: La lista delle misure, completa all'uscita dal blocco. \n
+    '''
+    previous = getattr(_local, 'captured', None)
+    _local.captured = RunMetrics(emit=False)
+    try:
+        yield _local.captured.records
+    finally:
+        _local.captured = previous
+
+
+# Funzione per assegnare a un file le misure di un blocco di codice
+@contextmanager
+def for_file(file_path: str):
+    '''Assegna al file indicato le misure prese nel blocco che non indicano un file.'''
+    previous = getattr(_local, 'file', None)
+    _local.file = file_path
+    try:
+        yield
+    finally:
+        _local.file = previous
+
+
+# Funzione per aggiungere alla raccolta attiva misure prese altrove
+def add_records(records: list) -> None:
+    '''Aggiunge alla raccolta attiva (o al solo log, se non c'è una raccolta) misure prese con capture.'''
+    collector = getattr(_local, 'captured', None) or _current
+    for record in records:
+        if collector is not None:
+            collector.add(record)
+        else:
+            _emit(record)
+
+
+# Funzione per misurare una fase
+@contextmanager
+def stage(name: str, file: str = None, rows: int = None, nbytes: int = None):
+    '''
+    Misura la durata di una fase. Il blocco può aggiornare le chiavi 'rows' e 'bytes' del dizionario restituito. \n
+    Args:
+        name: Il nome della fase (ad esempio 'read', 'convert', 'check', 'geometry_insert', 'upload').
+        file: Il percorso o il nome del file elaborato. Se None viene usato quello indicato con for_file.
+        rows: Il numero di righe elaborate, se già noto.
+        nbytes: Il numero di byte elaborati, se già noto. \n
+    Returns:
+        dict: La misura della fase, completata all'uscita dal blocco. \n
+    '''
+    file = file or getattr(_local, 'file', None)
+    record = {'file': os.path.basename(file) if file else None, 'stage': name, 'rows': rows, 'bytes': nbytes}
+    start = time.perf_counter()
+    yield record
+    elapsed = time.perf_counter() - start
+    record['seconds'] = round(elapsed, 4)
+    record['rows_per_s'] = round(record['rows'] / elapsed, 1) if record['rows'] and elapsed else None
+    add_records([record])
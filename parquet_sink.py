@@ -0,0 +1,186 @@
+'''
+Questo modulo scrive i dati SWE convertiti in file Parquet, in alternativa o in aggiunta al caricamento nel database. \n
+I dati vengono scritti in un dataset partizionato alla maniera di Hive, leggibile con pyarrow.dataset, DuckDB o pandas:
+    <cartella>/swe/snow_year=YYYY/date=YYYY-MM-DD/part-NNNN.parquet   (colonne cell_id, swe_mm)
+    <cartella>/cells/cells-YYYY-MM-DD-NNNN.parquet                     (colonne cell_id, geometry in GeoParquet)
+La colonna cell_id è codificata a dizionario e swe_mm è salvata in float32. Le geometrie delle celle vengono scritte
+una sola volta, la prima volta che una cella compare, come poligoni WKB con i metadati GeoParquet 1.0. \n
+Il caricamento di una data sostituisce i file già scritti per la stessa data. \n
+pyarrow è una dipendenza opzionale, richiesta solo quando si usa questo modulo. \n
+'''
+import os
+import glob
+import json
+import shutil
+import logging
+import numpy as np
+import pandas as pd
+from cell_index import cell_ids_to_coords, cell_ids_to_keys
+from metrics import stage
+
+# Lato in metri delle celle della griglia
+CELL_SIZE = 500
+# Compressione dei file Parquet
+COMPRESSION = 'zstd'
+
+# Tipo strutturato di un poligono WKB little endian con un anello di 5 punti
+_WKB_POLYGON = np.dtype([('order', 'u1'), ('type', '<u4'), ('rings', '<u4'), ('points', '<u4'), ('coords', '<f8', (10,))])
+
+
+# Funzione per importare pyarrow, dipendenza opzionale
+def _import_pyarrow():
+    '''Importa pyarrow e pyarrow.parquet, segnalando in modo chiaro se non è installato.'''
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("La scrittura in Parquet richiede il pacchetto pyarrow (pip install pyarrow).") from e
+    return pa, pq
+
+
+# Funzione per costruire i poligoni WKB delle celle
+def cell_polygons_wkb(cell_ids) -> tuple[np.ndarray, int]:
+    '''
+    Costruisce i poligoni WKB delle celle a partire dagli ID (angolo superiore sinistro), senza librerie geometriche. \n
+    Args:
+        cell_ids: Una sequenza di cell_id nel formato 'XXXXXXX_YYYYYYY'. \n
+    Returns:
+        tuple: L'array strutturato dei poligoni, contiguo in memoria, e la dimensione in byte di ogni poligono. \n
+    '''
+    lons, lats = cell_ids_to_coords(cell_ids)
+    lons, lats = lons.astype(np.float64), lats.astype(np.float64)
+    polygons = np.empty(len(lons), dtype=_WKB_POLYGON)
+    polygons['order'], polygons['type'], polygons['rings'], polygons['points'] = 1, 3, 1, 5
+    # Anello esterno in senso antiorario, chiuso sul primo punto
+    ring_x = (lons, lons + CELL_SIZE, lons + CELL_SIZE, lons, lons)
+    ring_y = (lats - CELL_SIZE, lats - CELL_SIZE, lats, lats, lats - CELL_SIZE)
+    for point, (x, y) in enumerate(zip(ring_x, ring_y)):
+        polygons['coords'][:, 2 * point] = x
+        polygons['coords'][:, 2 * point + 1] = y
+    return polygons, _WKB_POLYGON.itemsize
+
+
+# Classe per la scrittura dei dati SWE in un dataset Parquet
+class ParquetSink:
+    '''Dataset Parquet dei dati SWE partizionato per anno nivologico e data, con le geometrie delle celle in GeoParquet.'''
+    # Metodo di inizializzazione della classe ParquetSink
+    def __init__(self, output_dir: str):
+        '''
+        Prepara la scrittura nella cartella indicata, controllando che pyarrow sia disponibile. \n
+        Args:
+            output_dir: La cartella radice del dataset. \n
+        '''
+        _import_pyarrow()
+        self.output_dir = output_dir
+        # Voce del dataset nel manifest delle ingestioni, distinta da quella della tabella SWE
+        self.manifest_key = f"parquet:{os.path.abspath(output_dir)}"
+        self.cell_keys = None
+        self._parts = None
+        self._date = None
+
+    # Metodo per iniziare la scrittura di un file
+    def start_file(self) -> None:
+        '''Inizia la scrittura di un file: le date scritte da qui in poi sostituiscono i file già presenti per le stesse date.'''
+        self._parts = {}
+
+    # Metodo per scrivere un dataframe (o un blocco) del file corrente
+    def write(self, df: pd.DataFrame, crs) -> int:
+        '''
+        Scrive un dataframe prodotto dalla conversione, una partizione per data, e le geometrie delle celle non ancora scritte. \n
+        Args:
+            df: Il dataframe con le colonne 'cell_id', 'snow_year', 'date' e 'swe_mm' (anche con più date).
+            crs: Il CRS del GeoTIFF, salvato nei metadati GeoParquet delle geometrie. \n
+        Returns:
+            int: Il numero di righe scritte. \n
+        Raises:
+            RuntimeError: Se non è stata iniziata la scrittura di un file con start_file. \n
+        '''
+        if self._parts is None:
+            raise RuntimeError("Chiamare start_file prima di scrivere i dati di un file.")
+        pa, pq = _import_pyarrow()
+        with stage('parquet', rows=len(df)) as parquet_stage:
+            parquet_stage['bytes'] = 0
+            for (snow_year, date), group in df.groupby(['snow_year', 'date'], sort=True):
+                self._date = pd.Timestamp(date).strftime('%Y-%m-%d')
+                date_dir = os.path.join(self.output_dir, 'swe', f"snow_year={int(snow_year)}", f"date={self._date}")
+                # Alla prima scrittura della data nel file corrente elimina i file scritti in precedenza
+                if self._date not in self._parts:
+                    if os.path.isdir(date_dir):
+                        shutil.rmtree(date_dir)
+                    os.makedirs(date_dir)
+                    self._parts[self._date] = 0
+                path = os.path.join(date_dir, f"part-{self._parts[self._date]:04d}.parquet")
+                table = pa.table({
+                    'cell_id': pa.array(group['cell_id'].to_numpy(dtype=object), type=pa.string()).dictionary_encode(),
+                    'swe_mm': pa.array(group['swe_mm'].to_numpy(dtype=np.float32)),
+                })
+                _write_table(pq, table, path)
+                self._parts[self._date] += 1
+                parquet_stage['bytes'] += os.path.getsize(path)
+        self.add_cells(df['cell_id'], crs)
+        return len(df)
+
+    # Metodo per scrivere le geometrie delle celle non ancora presenti nel dataset
+    def add_cells(self, cell_ids, crs) -> int:
+        '''
+        Scrive in GeoParquet le geometrie delle celle che non compaiono ancora nel dataset. \n
+        Args:
+            cell_ids: La sequenza dei cell_id.
+            crs: Il CRS delle coordinate delle celle. \n
+        Returns:
+            int: Il numero di nuove celle scritte. \n
+        '''
+        pa, pq = _import_pyarrow()
+        cells_dir = os.path.join(self.output_dir, 'cells')
+        # Legge una sola volta gli ID delle celle già scritte
+        if self.cell_keys is None:
+            self.cell_keys = np.empty(0, dtype=np.int64)
+            existing = sorted(glob.glob(os.path.join(cells_dir, '*.parquet')))
+            if existing:
+                ids = pa.concat_arrays([pq.read_table(path, columns=['cell_id'])['cell_id'].combine_chunks()
+                                        for path in existing]).to_pandas()
+                self.cell_keys = np.unique(cell_ids_to_keys(ids))
+        cell_ids = pd.Series(cell_ids, dtype=object).to_numpy()
+        is_new = ~np.isin(cell_ids_to_keys(cell_ids), self.cell_keys)
+        new_ids = pd.unique(cell_ids[is_new])
+        if len(new_ids) == 0:
+            return 0
+
+        # Costruisce la colonna geometry (WKB) senza copiare i poligoni riga per riga
+        polygons, size = cell_polygons_wkb(new_ids)
+        offsets = pa.py_buffer((np.arange(len(new_ids) + 1, dtype=np.int32) * size).tobytes())
+        geometry = pa.Array.from_buffers(pa.binary(), len(new_ids), [None, offsets, pa.py_buffer(polygons.tobytes())])
+        table = pa.table({'cell_id': pa.array(new_ids, type=pa.string()), 'geometry': geometry})
+        table = table.replace_schema_metadata({b'geo': json.dumps(_geo_metadata(polygons, crs)).encode()})
+        os.makedirs(cells_dir, exist_ok=True)
+        path = os.path.join(cells_dir, f"cells-{self._date or 'nd'}-{len(glob.glob(os.path.join(cells_dir, '*.parquet'))):04d}.parquet")
+        _write_table(pq, table, path)
+        self.cell_keys = np.union1d(self.cell_keys, cell_ids_to_keys(new_ids))
+        logging.info(f"Geometrie di {len(new_ids)} nuove celle scritte in {path}.")
+        return len(new_ids)
+
+
+# Funzione per costruire i metadati GeoParquet della colonna geometry
+def _geo_metadata(polygons: np.ndarray, crs) -> dict:
+    '''Restituisce i metadati GeoParquet 1.0 della colonna geometry, con CRS in PROJJSON (se pyproj è disponibile) e bbox.'''
+    coords = polygons['coords']
+    column = {
+        'encoding': 'WKB',
+        'geometry_types': ['Polygon'],
+        'bbox': [float(coords[:, 0::2].min()), float(coords[:, 1::2].min()),
+                 float(coords[:, 0::2].max()), float(coords[:, 1::2].max())],
+    }
+    try:
+        import pyproj
+        column['crs'] = pyproj.CRS.from_wkt(crs.to_wkt()).to_json_dict()
+    except ImportError:
+        logging.warning("pyproj non disponibile: il CRS non viene salvato nei metadati GeoParquet.")
+    return {'version': '1.0.0', 'primary_column': 'geometry', 'columns': {'geometry': column}}
+
+
+# Funzione per scrivere una tabella Arrow in modo atomico
+def _write_table(pq, table, path: str) -> None:
+    '''Scrive la tabella in un file temporaneo e lo rinomina, così un'interruzione non lascia file Parquet incompleti.'''
+    temp_path = path + '.tmp'
+    pq.write_table(table, temp_path, compression=COMPRESSION)
+    os.replace(temp_path, path)
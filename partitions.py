@@ -0,0 +1,229 @@
+'''
+Questo modulo gestisce il partizionamento dichiarativo della tabella SWE per anno nivologico (PARTITION BY LIST (snow_year)). \n
+Con la tabella partizionata ogni stagione ha la propria partizione, con il proprio indice sulla chiave
+(cell_id, snow_year, date): il controllo ON CONFLICT del caricamento lavora solo sull'indice della stagione caricata,
+che non cresce con gli anni, e le stagioni passate possono essere staccate e archiviate. \n
+Il caricamento crea le partizioni mancanti prima di scrivere (vedi UploadSession.ensure_partition);
+se la tabella SWE non è partizionata il caricamento procede come prima. \n
+Le partizioni si chiamano '<tabella SWE>_sy<anno nivologico>'. Per la gestione da riga di comando:
+    python partitions.py create  --db-url URL [--swe-table T]
+    python partitions.py convert --db-url URL [--swe-table T] [--drop-old]
+    python partitions.py list    --db-url URL [--swe-table T]
+    python partitions.py detach  --db-url URL --snow-year 2020 [--archive-schema swe_archive]
+    python partitions.py attach  --db-url URL --snow-year 2020 [--archive-schema swe_archive]
+'''
+import re
+import logging
+from sqlalchemy import text
+
+# Schema predefinito in cui spostare le partizioni archiviate
+DEFAULT_ARCHIVE_SCHEMA = 'swe_archive'
+
+
+# Funzione per ottenere il nome della partizione di un anno nivologico
+def partition_name(swe_table: str, snow_year: int) -> str:
+    '''Restituisce il nome della partizione della tabella SWE per l'anno nivologico indicato.'''
+    return f"{swe_table}_sy{int(snow_year)}"
+
+
+# Funzione per controllare se la tabella SWE è partizionata
+def is_partitioned(connection, swe_table: str) -> bool:
+    '''
+    Controlla se la tabella è una tabella partizionata. \n
+    Args:
+        connection: La connessione SQLAlchemy al database.
+        swe_table: Il nome della tabella SWE. \n
+    Returns:
+        bool: True se la tabella esiste ed è partizionata. \n
+    '''
+    return connection.execute(text('''
+        SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table));
+    '''), {"table": swe_table}).scalar()
+
+
+# Funzione per elencare le partizioni della tabella SWE
+def list_partitions(connection, swe_table: str) -> dict:
+    '''
+    Elenca le partizioni collegate alla tabella SWE. \n
+    Args:
+        connection: La connessione SQLAlchemy al database.
+        swe_table: Il nome della tabella SWE partizionata. \n
+    Returns:
+        dict: Un dizionario anno nivologico -> nome della partizione. \n
+    '''
+    rows = connection.execute(text('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table);
+    '''), {"table": swe_table}).fetchall()
+    partitions = {}
+    for name, bound in rows:
+        match = re.search(r"IN \('?(-?\d+)'?\)", bound or '')
+        if match:
+            partitions[int(match.group(1))] = name
+    return partitions
+
+
+# Funzione per creare la partizione di un anno nivologico
+def ensure_partition(connection, swe_table: str, snow_year: int) -> str:
+    '''
+    Crea, se non esiste, la partizione della tabella SWE per l'anno nivologico indicato. \n
+    Args:
+        connection: La connessione SQLAlchemy (con transazione aperta) al database.
+        swe_table: Il nome della tabella SWE partizionata.
+        snow_year: L'anno nivologico della partizione. \n
+    Returns:
+        str: Il nome della partizione. \n
+    '''
+    name = partition_name(swe_table, snow_year)
+    connection.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF {swe_table} FOR VALUES IN ({int(snow_year)});
+    '''))
+    return name
+
+
+# Funzione per creare una tabella SWE partizionata vuota
+def create_partitioned_table(engine, swe_table: str = 'cell_daily_swe_table') -> None:
+    '''
+    Crea la tabella SWE partizionata per anno nivologico, se non esiste. Le partizioni vengono create dal caricamento. \n
+    Args:
+        engine: L'engine SQLAlchemy per la connessione al database.
+        swe_table: Il nome della tabella SWE. \n
+    '''
+    with engine.begin() as connection:
+        connection.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS {swe_table} (
+                cell_id text NOT NULL,
+                snow_year integer NOT NULL,
+                date date NOT NULL,
+                swe_mm real,
+                PRIMARY KEY (cell_id, snow_year, date)
+            ) PARTITION BY LIST (snow_year);
+        '''))
+    logging.info(f"Tabella partizionata '{swe_table}' pronta.")
+
+
+# Funzione per convertire una tabella SWE esistente in tabella partizionata
+def convert_to_partitioned(engine, swe_table: str = 'cell_daily_swe_table', drop_old: bool = False) -> dict:
+    '''
+    Converte la tabella SWE esistente in una tabella partizionata per anno nivologico, in un'unica transazione. \n
+    La tabella esistente viene rinominata in '<tabella>_unpartitioned', la nuova tabella ne copia colonne, default e vincoli
+    di controllo, e i dati vengono copiati una stagione alla volta nella relativa partizione. Chiavi esterne, indici
+    aggiuntivi e permessi della tabella originale non vengono copiati e vanno ricreati se necessari. \n
+    Args:
+        engine: L'engine SQLAlchemy per la connessione al database.
+        swe_table: Il nome della tabella SWE da convertire.
+        drop_old: Se True la tabella originale viene eliminata al termine della copia. \n
+    Returns:
+        dict: Un dizionario anno nivologico -> numero di righe copiate. \n
+    Raises:
+        ValueError: Se la tabella è già partizionata. \n
+    '''
+    old_table = f"{swe_table}_unpartitioned"
+    copied = {}
+    with engine.begin() as connection:
+        if is_partitioned(connection, swe_table):
+            raise ValueError(f"La tabella '{swe_table}' è già partizionata.")
+        # Rinomina la tabella e il suo indice di chiave primaria, per liberare i nomi
+        primary_key = connection.execute(text('''
+            SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p';
+        '''), {"table": swe_table}).scalar()
+        connection.execute(text(f'ALTER TABLE {swe_table} RENAME TO {old_table};'))
+        if primary_key:
+            connection.execute(text(f'ALTER TABLE {old_table} RENAME CONSTRAINT {primary_key} TO {old_table}_pkey;'))
+        connection.execute(text(f'''
+            CREATE TABLE {swe_table} (
+                LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                PRIMARY KEY (cell_id, snow_year, date)
+            ) PARTITION BY LIST (snow_year);
+        '''))
+        # Copia i dati una stagione alla volta
+        snow_years = connection.execute(text(f'SELECT DISTINCT snow_year FROM {old_table} ORDER BY snow_year;')).scalars().all()
+        for snow_year in snow_years:
+            ensure_partition(connection, swe_table, snow_year)
+            copied[snow_year] = connection.execute(text(f'''
+                INSERT INTO {swe_table} SELECT * FROM {old_table} WHERE snow_year = :snow_year;
+            '''), {"snow_year": snow_year}).rowcount
+            logging.info(f"Anno nivologico {snow_year}: {copied[snow_year]} righe copiate nella partizione.")
+        if drop_old:
+            connection.execute(text(f'DROP TABLE {old_table};'))
+    logging.info(f"Tabella '{swe_table}' convertita in tabella partizionata con {len(copied)} partizioni.")
+    return copied
+
+
+# Funzione per staccare (e archiviare) la partizione di una stagione passata
+def detach_partition(engine, swe_table: str, snow_year: int, archive_schema: str = None) -> str:
+    '''
+    Stacca dalla tabella SWE la partizione dell'anno nivologico indicato, che resta una tabella a sé con i suoi dati,
+    e la sposta nello schema di archivio se indicato. \n
+    Args:
+        engine: L'engine SQLAlchemy per la connessione al database.
+        swe_table: Il nome della tabella SWE partizionata.
+        snow_year: L'anno nivologico da staccare.
+        archive_schema: Lo schema in cui spostare la partizione staccata (creato se non esiste), oppure None. \n
+    Returns:
+        str: Il nome completo della tabella staccata. \n
+    '''
+    name = partition_name(swe_table, snow_year)
+    with engine.begin() as connection:
+        connection.execute(text(f'ALTER TABLE {swe_table} DETACH PARTITION {name};'))
+        if archive_schema:
+            connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS {archive_schema};'))
+            connection.execute(text(f'ALTER TABLE {name} SET SCHEMA {archive_schema};'))
+            name = f"{archive_schema}.{name}"
+    logging.info(f"Partizione dell'anno nivologico {snow_year} staccata: {name}.")
+    return name
+
+
+# Funzione per ricollegare la partizione di una stagione archiviata
+def attach_partition(engine, swe_table: str, snow_year: int, archive_schema: str = None) -> None:
+    '''
+    Ricollega alla tabella SWE la partizione staccata dell'anno nivologico indicato, riportandola nello schema della tabella. \n
+    Args:
+        engine: L'engine SQLAlchemy per la connessione al database.
+        swe_table: Il nome della tabella SWE partizionata.
+        snow_year: L'anno nivologico da ricollegare.
+        archive_schema: Lo schema in cui si trova la partizione archiviata, oppure None se non è stata spostata. \n
+    '''
+    name = partition_name(swe_table, snow_year)
+    with engine.begin() as connection:
+        if archive_schema:
+            schema = connection.execute(text('SELECT current_schema();')).scalar()
+            connection.execute(text(f'ALTER TABLE {archive_schema}.{name} SET SCHEMA {schema};'))
+        connection.execute(text(f'''
+            ALTER TABLE {swe_table} ATTACH PARTITION {name} FOR VALUES IN ({int(snow_year)});
+        '''))
+    logging.info(f"Partizione dell'anno nivologico {snow_year} ricollegata alla tabella '{swe_table}'.")
+
+
+if __name__ == "__main__":
+    import argparse
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Gestione delle partizioni per anno nivologico della tabella SWE.")
+    parser.add_argument('action', choices=['create', 'convert', 'list', 'detach', 'attach'])
+    parser.add_argument('--db-url', required=True, help="URL completo di connessione al database.")
+    parser.add_argument('--swe-table', default='cell_daily_swe_table', help="Tabella dei dati SWE.")
+    parser.add_argument('--snow-year', type=int, help="Anno nivologico da staccare o ricollegare.")
+    parser.add_argument('--archive-schema', default=None,
+                        help=f"Schema di archivio delle partizioni staccate (ad esempio {DEFAULT_ARCHIVE_SCHEMA}).")
+    parser.add_argument('--drop-old', action='store_true', help="Con convert, elimina la tabella originale dopo la copia.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.action in ('detach', 'attach') and args.snow_year is None:
+        parser.error("--snow-year è obbligatorio con detach e attach.")
+
+    engine = create_engine(args.db_url)
+    if args.action == 'create':
+        create_partitioned_table(engine, args.swe_table)
+    elif args.action == 'convert':
+        convert_to_partitioned(engine, args.swe_table, args.drop_old)
+    elif args.action == 'list':
+        with engine.connect() as connection:
+            for snow_year, name in sorted(list_partitions(connection, args.swe_table).items()):
+                print(f"{snow_year}\t{name}")
+    elif args.action == 'detach':
+        print(detach_partition(engine, args.swe_table, args.snow_year, args.archive_schema))
+    else:
+        attach_partition(engine, args.swe_table, args.snow_year, args.archive_schema)
+    engine.dispose()
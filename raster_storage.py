@@ -0,0 +1,221 @@
+'''
+Questo modulo gestisce l'archiviazione dei raster per intero, con una sola riga per data, in alternativa
+alla tabella SWE con una riga per cella (vedi dataframe_to_postgresql). \n
+Ogni riga della tabella dei raster (una per data, quindi una per banda nei GeoTIFF con più date) contiene anno nivologico,
+data, dimensioni della griglia, matrice di trasformazione, CRS e l'array dei valori in float32 (noData come NaN) compresso in bytea: i byte dei valori vengono riordinati
+per posizione (shuffle) prima della compressione zlib, così i campi lisci di SWE si comprimono molto meglio. \n
+Il caricamento di un file diventa un unico INSERT e lo spazio occupato è una piccola frazione di quello
+delle righe per cella, che hanno un costo fisso di tupla e di indice per ogni valore da 4 byte. \n
+Per la lettura sono disponibili read_raster_field (il campo di una data) e read_cell_series (le serie temporali di una o più celle). \n
+'''
+import zlib
+import logging
+import numpy as np
+import pandas as pd
+from rasterio.crs import CRS
+import affine
+from sqlalchemy import text
+from cell_index import cell_ids_to_coords
+from functions import nivological_year
+from metrics import stage
+from reprojection import open_raster
+from swe_summary import SummaryAccumulator, write_summary
+from zonal_stats import reduce_zones
+
+# Codifica dei valori salvati: float32 little endian, byte riordinati per posizione, compressi con zlib
+CODEC = 'f4-shuffle-zlib'
+# Livello di compressione zlib
+_ZLIB_LEVEL = 6
+
+
+# Funzione per comprimere un array di valori
+def encode_array(values: np.ndarray) -> bytes:
+    '''
+    Comprime un array di valori in float32 con lo shuffle dei byte e zlib. \n
+    Args:
+        values: L'array dei valori, con i noData come NaN. \n
+    Returns:
+        bytes: L'array compresso. \n
+    '''
+    raw = np.ascontiguousarray(values, dtype='<f4').reshape(-1).view(np.uint8)
+    shuffled = raw.reshape(-1, 4).T.copy()
+    return zlib.compress(shuffled.tobytes(), _ZLIB_LEVEL)
+
+
+# Funzione per decomprimere un array di valori
+def decode_array(data: bytes, height: int, width: int, codec: str = CODEC) -> np.ndarray:
+    '''
+    Decomprime un array salvato con encode_array. \n
+    Args:
+        data: L'array compresso.
+        height: Il numero di righe della griglia.
+        width: Il numero di colonne della griglia.
+        codec: La codifica dell'array. \n
+    Returns:
+        np.ndarray: La matrice dei valori in float32, con i noData come NaN. \n
+    Raises:
+        ValueError: Se la codifica non è supportata. \n
+    '''
+    if codec != CODEC:
+        raise ValueError(f"Codifica dell'array '{codec}' non supportata.")
+    shuffled = np.frombuffer(zlib.decompress(bytes(data)), dtype=np.uint8).reshape(4, -1)
+    return shuffled.T.copy().view('<f4').reshape(height, width)
+
+
+# Funzione per creare la tabella dei raster
+def create_raster_table(connection, raster_table: str) -> None:
+    '''Crea, se non esiste, la tabella dei raster con una riga per data.'''
+    connection.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {raster_table} (
+            snow_year integer NOT NULL,
+            date date NOT NULL,
+            height integer NOT NULL,
+            width integer NOT NULL,
+            transform double precision[] NOT NULL,
+            crs text NOT NULL,
+            codec text NOT NULL,
+            valid_cells bigint NOT NULL,
+            data bytea NOT NULL,
+            loaded_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (snow_year, date)
+        );
+    '''))
+
+
+# Funzione per caricare un file GeoTIFF come una riga per data della tabella dei raster
+def raster_to_postgresql(geoTIFF_path: str, dates: list, session, raster_table: str = 'swe_raster_table', warp: dict = None,
+                         reprocess: bool = False, zonal=None) -> dict:
+    '''
+    Legge il GeoTIFF e salva ogni banda come un'unica riga della tabella dei raster, ignorando le date già presenti. \n
+    Con reprocess le date già presenti vengono sostituite, ma solo se il raster compresso è cambiato.
+    Al termine viene scritta una riga per data nella tabella di riepilogo di raster_table (vedi swe_summary) e, con zonal,
+    vengono salvate le statistiche delle zone, ridotte dalle bande già lette (vedi zonal_stats.reduce_zones). \n
+    Args:
+        geoTIFF_path: Il percorso del file GeoTIFF.
+        dates: Le date delle bande nel formato 'YYYY-MM-DD', nell'ordine delle bande (una sola data per i file con una banda).
+        session: La sessione di caricamento sul database PostgreSQL.
+        raster_table: Il nome della tabella dei raster.
+        warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None per salvare la griglia del file.
+        reprocess: Se True le date già presenti con un raster diverso vengono aggiornate.
+        zonal: Lo ZonalStats delle zone di cui calcolare le statistiche, oppure None. \n
+    Returns:
+        dict: I conteggi delle celle valide inserite ('inserted'), aggiornate ('updated'), già presenti ('skipped')
+        e non salvate ('omitted', sempre 0). \n
+    '''
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0, 'omitted': 0}
+    # Con la rielaborazione la riga viene sostituita solo se il raster è cambiato; xmax = 0 indica una riga nuova
+    conflict_sql = f'''
+        ON CONFLICT (snow_year, date) DO UPDATE SET
+            height = EXCLUDED.height, width = EXCLUDED.width, transform = EXCLUDED.transform, crs = EXCLUDED.crs,
+            codec = EXCLUDED.codec, valid_cells = EXCLUDED.valid_cells, data = EXCLUDED.data, loaded_at = now()
+        WHERE ({raster_table}.data, {raster_table}.transform) IS DISTINCT FROM (EXCLUDED.data, EXCLUDED.transform)
+        RETURNING (xmax = 0) AS inserted
+    ''' if reprocess else 'ON CONFLICT (snow_year, date) DO NOTHING RETURNING true AS inserted'
+    summary = SummaryAccumulator()
+    zones = {}
+    with open_raster(geoTIFF_path, warp) as raster:
+        transform = raster.transform
+        crs = raster.crs
+        mask = zonal.mask(crs, transform, raster.width, raster.height) if zonal is not None else None
+        # Legge e carica una banda alla volta
+        for band, date in enumerate(dates, start=1):
+            with stage('read', geoTIFF_path) as read_stage:
+                # I noData (secondo la maschera della banda) diventano NaN
+                values = raster.read(band, masked=True).astype(np.float32).filled(np.nan)
+                read_stage.update(rows=values.size, bytes=values.nbytes)
+            valid = ~np.isnan(values)
+            valid_cells = int(np.count_nonzero(valid))
+            summary.add(date, values[valid])
+            if mask is not None:
+                zones[date] = reduce_zones(values, mask)
+
+            with stage('convert', geoTIFF_path, rows=values.size) as convert_stage:
+                data = encode_array(values)
+                convert_stage['bytes'] = len(data)
+            logging.info(f"Raster del {date} compresso: {values.nbytes / 2 ** 20:.1f} MB -> {len(data) / 2 ** 20:.1f} MB.")
+
+            with stage('upload', geoTIFF_path, rows=1, nbytes=len(data)), session.engine.begin() as connection:
+                create_raster_table(connection, raster_table)
+                inserted = connection.execute(text(f'''
+                    INSERT INTO {raster_table} (snow_year, date, height, width, transform, crs, codec, valid_cells, data)
+                    VALUES (:snow_year, :date, :height, :width, :transform, :crs, :codec, :valid_cells, :data)
+                    {conflict_sql};
+                '''), {"snow_year": nivological_year(date), "date": date, "height": values.shape[0], "width": values.shape[1],
+                       "transform": list(transform)[:6], "crs": crs.to_wkt(), "codec": CODEC,
+                       "valid_cells": valid_cells, "data": data}).scalar()
+            if inserted:
+                counts['inserted'] += valid_cells
+                logging.info(f"Raster del {date} caricato nella tabella '{raster_table}': {valid_cells} celle valide.")
+            elif inserted is not None:
+                counts['updated'] += valid_cells
+                logging.info(f"Raster del {date} aggiornato nella tabella '{raster_table}': {valid_cells} celle valide.")
+            else:
+                counts['skipped'] += valid_cells
+                logging.info(f"Raster del {date} già presente nella tabella '{raster_table}'.")
+    write_summary(session, summary.rows(nivological_year), raster_table, reprocess)
+    if zonal is not None:
+        zonal.write(zones, reprocess)
+    return counts
+
+
+# Funzione per leggere il campo di una data dalla tabella dei raster
+def read_raster_field(session, date: str, raster_table: str = 'swe_raster_table') -> tuple[np.ndarray, affine.Affine, CRS]:
+    '''
+    Legge il campo SWE di una data dalla tabella dei raster. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        date: La data nel formato 'YYYY-MM-DD'.
+        raster_table: Il nome della tabella dei raster. \n
+    Returns:
+        tuple: La matrice dei valori (noData come NaN), la matrice di trasformazione e il CRS. \n
+    Raises:
+        ValueError: Se la data non è presente nella tabella. \n
+    '''
+    with session.engine.connect() as connection:
+        row = connection.execute(text(f'''
+            SELECT height, width, transform, crs, codec, data FROM {raster_table} WHERE date = :date;
+        '''), {"date": date}).fetchone()
+    if row is None:
+        raise ValueError(f"Nessun raster per la data {date} nella tabella '{raster_table}'.")
+    height, width, transform, crs, codec, data = row
+    return decode_array(data, height, width, codec), affine.Affine(*transform), CRS.from_wkt(crs)
+
+
+# Funzione per leggere le serie temporali di alcune celle dalla tabella dei raster
+def read_cell_series(session, cell_ids: list, start_date: str = None, end_date: str = None,
+                     raster_table: str = 'swe_raster_table') -> pd.DataFrame:
+    '''
+    Legge le serie temporali delle celle indicate dalla tabella dei raster. \n
+    Ogni raster viene decompresso una sola volta per tutte le celle richieste; le celle fuori dalla griglia
+    di una data o con noData risultano NaN. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        cell_ids: La lista dei cell_id nel formato 'XXXXXXX_YYYYYYY'.
+        start_date: La prima data (inclusa) nel formato 'YYYY-MM-DD', oppure None.
+        end_date: L'ultima data (inclusa) nel formato 'YYYY-MM-DD', oppure None. \n
+    Returns:
+        pd.DataFrame: Un dataframe con una riga per data (indice 'date') e una colonna per cell_id. \n
+    '''
+    lons, lats = cell_ids_to_coords(cell_ids)
+    query = f'SELECT date, height, width, transform, codec, data FROM {raster_table} WHERE TRUE'
+    params = {}
+    if start_date:
+        query += ' AND date >= :start_date'
+        params['start_date'] = start_date
+    if end_date:
+        query += ' AND date <= :end_date'
+        params['end_date'] = end_date
+    series = {}
+    with session.engine.connect() as connection:
+        for date, height, width, transform, codec, data in connection.execute(text(query + ' ORDER BY date;'), params):
+            # Posizione delle celle nella griglia della data (gli ID indicano l'angolo superiore sinistro)
+            cols, rows = ~affine.Affine(*transform) * (lons, lats)
+            cols, rows = np.rint(cols).astype(np.int64), np.rint(rows).astype(np.int64)
+            inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+            values = np.full(len(cell_ids), np.nan, dtype=np.float32)
+            field = decode_array(data, height, width, codec)
+            values[inside] = field[rows[inside], cols[inside]]
+            series[date] = values
+    dataframe = pd.DataFrame.from_dict(series, orient='index', columns=list(cell_ids))
+    dataframe.index.name = 'date'
+    return dataframe
@@ -0,0 +1,118 @@
+'''
+Questo modulo permette di caricare GeoTIFF con CRS o dimensione dei pixel diversi da quelli della tabella delle geometrie,
+riproiettandoli al volo con un WarpedVRT di rasterio invece di scartarli. \n
+La griglia di destinazione ha il CRS della tabella, pixel di 500 m ed è allineata all'origine dei cell_id già presenti
+(l'angolo di una cella qualsiasi della tabella), così le celle riproiettate coincidono con quelle esistenti.
+La riproiezione avviene finestra per finestra durante la lettura, senza scrivere file intermedi. \n
+La destinazione viene descritta da un dizionario semplice (vedi warp_target), che può essere passato
+ai processi di conversione. \n
+'''
+import math
+import logging
+from contextlib import contextmanager
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+import affine
+from sqlalchemy import text
+
+# Lato in metri delle celle della griglia
+CELL_SIZE = 500
+# Metodi di ricampionamento disponibili
+RESAMPLING_METHODS = ('nearest', 'bilinear', 'cubic', 'average')
+# Metodo di ricampionamento predefinito: la media conserva lo SWE medio quando i pixel di origine sono più piccoli
+DEFAULT_RESAMPLING = 'average'
+
+
+# Funzione per calcolare l'origine della griglia delle celle
+def grid_origin(session, geometry_table: str) -> tuple[int, int]:
+    '''
+    Restituisce l'origine della griglia delle celle: l'angolo di una cella della tabella delle geometrie,
+    ridotto al resto della divisione per il lato della cella ((0, 0) se la tabella è vuota). \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        geometry_table: Il nome della tabella delle geometrie nel database. \n
+    Returns:
+        tuple: Le coordinate x e y dell'origine. \n
+    '''
+    # Legge una sola cella, senza caricare l'indice dei cell_id (che con il controllo sul server non serve)
+    with session.engine.connect() as connection:
+        cell_id = connection.execute(text(f'SELECT cell_id FROM {geometry_table} LIMIT 1;')).scalar()
+    if cell_id is None:
+        return (0, 0)
+    x, y = (int(coord) for coord in cell_id.split('_', 1))
+    return (x % CELL_SIZE, y % CELL_SIZE)
+
+
+# Funzione per calcolare la griglia di destinazione della riproiezione
+def warp_target(session, geometry_table: str, resampling: str = DEFAULT_RESAMPLING) -> dict:
+    '''
+    Calcola la destinazione della riproiezione: CRS della tabella delle geometrie e origine della griglia delle celle. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        resampling: Il metodo di ricampionamento (vedi RESAMPLING_METHODS). \n
+    Returns:
+        dict: Un dizionario con il CRS ('crs', in WKT), l'origine della griglia ('origin') e il ricampionamento ('resampling'). \n
+    Raises:
+        ValueError: Se il metodo di ricampionamento non è valido. \n
+    '''
+    if resampling not in RESAMPLING_METHODS:
+        raise ValueError(f"Ricampionamento '{resampling}' non valido: usare uno tra {', '.join(RESAMPLING_METHODS)}.")
+    crs = session.get_crs(geometry_table)
+    origin = grid_origin(session, geometry_table)
+    logging.info(f"Riproiezione attiva verso EPSG:{crs.to_epsg()} con griglia di {CELL_SIZE} m e origine {origin}.")
+    return {'crs': crs.to_wkt(), 'origin': origin, 'resampling': resampling}
+
+
+# Funzione per calcolare la griglia allineata che copre un dataset riproiettato
+def aligned_grid(raster, target: dict) -> tuple[affine.Affine, int, int]:
+    '''
+    Calcola la matrice di trasformazione e le dimensioni della griglia di destinazione che copre il dataset. \n
+    Args:
+        raster: Il dataset rasterio di origine.
+        target: La destinazione restituita da warp_target. \n
+    Returns:
+        tuple: La matrice di trasformazione, la larghezza e l'altezza della griglia. \n
+    '''
+    origin_x, origin_y = target['origin']
+    left, bottom, right, top = transform_bounds(raster.crs, target['crs'], *raster.bounds, densify_pts=21)
+    # Allinea i bordi alla griglia delle celle, includendo tutte le celle toccate dal dataset
+    left = math.floor((left - origin_x) / CELL_SIZE) * CELL_SIZE + origin_x
+    right = math.ceil((right - origin_x) / CELL_SIZE) * CELL_SIZE + origin_x
+    bottom = math.floor((bottom - origin_y) / CELL_SIZE) * CELL_SIZE + origin_y
+    top = math.ceil((top - origin_y) / CELL_SIZE) * CELL_SIZE + origin_y
+    transform = affine.Affine(CELL_SIZE, 0, left, 0, -CELL_SIZE, top)
+    return transform, int(round((right - left) / CELL_SIZE)), int(round((top - bottom) / CELL_SIZE))
+
+
+# Funzione per aprire un GeoTIFF, riproiettato se richiesto
+@contextmanager
+def open_raster(geoTIFF_path: str, target: dict = None):
+    '''
+    Apre il GeoTIFF con rasterio; con target restituisce invece un WarpedVRT sulla griglia di destinazione,
+    che si legge come il dataset originale (read, read_masks, finestre). \n
+    Se il GeoTIFF è già sulla griglia di destinazione il WarpedVRT non viene creato. \n
+    Args:
+        geoTIFF_path: Il percorso del file GeoTIFF.
+        target: La destinazione restituita da warp_target, oppure None per leggere il file così com'è. \n
+    Returns:
+        Il dataset rasterio o il WarpedVRT. \n
+    '''
+    with rasterio.open(geoTIFF_path) as raster:
+        if target is None:
+            yield raster
+            return
+        transform, width, height = aligned_grid(raster, target)
+        same_crs = raster.crs == CRS.from_wkt(target['crs'])
+        if same_crs and raster.transform.a == CELL_SIZE and raster.transform.e == -CELL_SIZE \
+                and (raster.transform.c - transform.c) % CELL_SIZE == 0 and (raster.transform.f - transform.f) % CELL_SIZE == 0:
+            yield raster
+            return
+        logging.info(f"Riproiezione di {geoTIFF_path} su una griglia di {width}x{height} celle.")
+        # Senza noData le aree fuori dal dataset vengono marcate con un canale alpha, letto da read_masks
+        with WarpedVRT(raster, crs=target['crs'], transform=transform, width=width, height=height,
+                       resampling=Resampling[target['resampling']], add_alpha=raster.nodata is None) as vrt:
+            yield vrt
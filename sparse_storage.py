@@ -0,0 +1,162 @@
+'''
+Questo modulo gestisce le modalità di archiviazione ridotta della tabella SWE. \n
+Nella modalità 'zero' le celle con SWE pari a 0 (entro la tolleranza) non vengono salvate;
+nella modalità 'delta' una cella viene salvata solo se il suo valore differisce, oltre la tolleranza,
+dall'ultimo valore salvato per la stessa cella nello stesso anno nivologico. \n
+Per ogni data caricata in modalità ridotta viene scritta una riga nella tabella di copertura, con la modalità,
+la tolleranza, il numero di celle valide del raster e il numero di righe salvate, così chi legge i dati può
+ricostruire il campo completo (vedi read_swe_field):
+    - modalità 'zero': le celle della tabella delle geometrie senza riga valgono 0. Le celle noData del raster
+      non si distinguono dalle celle a 0;
+    - modalità 'delta': il valore di una cella è l'ultimo salvato con data minore o uguale nello stesso anno nivologico.
+      Per essere ricostruibili le date devono essere caricate in ordine cronologico (come fa batch_runner).
+Le date senza riga di copertura sono state caricate per intero. \n
+Ogni tabella SWE ha la propria tabella di copertura, '<tabella SWE>_coverage' (vedi coverage_table_name),
+perché le stesse date possono essere caricate in tabelle diverse con modalità diverse. \n
+'''
+import logging
+import pandas as pd
+from sqlalchemy import text
+from functions import nivological_year
+
+# Modalità di archiviazione ridotta disponibili
+SPARSE_MODES = ('zero', 'delta')
+
+
+# Funzione per ottenere il nome della tabella di copertura di una tabella SWE
+def coverage_table_name(swe_table: str) -> str:
+    '''
+    Restituisce il nome della tabella di copertura di una tabella SWE. \n
+    Args:
+        swe_table: Il nome della tabella SWE. \n
+    Returns:
+        str: Il nome della tabella di copertura, '<swe_table>_coverage'. \n
+    '''
+    return f"{swe_table}_coverage"
+
+
+# Funzione per controllare la modalità di archiviazione
+def check_sparse_mode(sparse_mode: str) -> None:
+    '''
+    Controlla che la modalità di archiviazione sia valida. \n
+    Args:
+        sparse_mode: La modalità di archiviazione ('zero', 'delta' oppure None per l'archiviazione completa). \n
+    Raises:
+        ValueError: Se la modalità non è tra quelle disponibili. \n
+    '''
+    if sparse_mode is not None and sparse_mode not in SPARSE_MODES:
+        raise ValueError(f"Modalità di archiviazione '{sparse_mode}' non valida: usare una tra {', '.join(SPARSE_MODES)}.")
+
+
+# Funzione per eliminare dalla tabella di appoggio le righe invariate rispetto all'ultimo valore salvato
+def delete_unchanged_rows(connection, temp_table: str, swe_table: str, tolerance: float) -> int:
+    '''
+    Elimina dalla tabella di appoggio le righe il cui valore non differisce, oltre la tolleranza,
+    dall'ultimo valore salvato per la stessa cella in una data precedente dello stesso anno nivologico. \n
+    Args:
+        connection: La connessione SQLAlchemy con la transazione del caricamento.
+        temp_table: Il nome della tabella di appoggio.
+        swe_table: Il nome della tabella SWE nel database.
+        tolerance: La differenza massima, in mm, per considerare invariato un valore. \n
+    Returns:
+        int: Il numero di righe eliminate dalla tabella di appoggio. \n
+    '''
+    delete_sql = f'''
+        DELETE FROM {temp_table} s
+        WHERE EXISTS (
+            SELECT 1 FROM (
+                SELECT t.swe_mm FROM {swe_table} t
+                WHERE t.cell_id = s.cell_id AND t.snow_year = s.snow_year AND t.date < s.date
+                ORDER BY t.date DESC
+                LIMIT 1
+            ) previous
+            WHERE abs(previous.swe_mm - s.swe_mm) <= :tolerance
+        );
+    '''
+    return connection.execute(text(delete_sql), {"tolerance": tolerance}).rowcount
+
+
+# Funzione per registrare la copertura di una data caricata in modalità ridotta
+def write_coverage(session, swe_table: str, snow_year: int, date: str, sparse_mode: str, tolerance: float, valid_cells: int,
+                   stored_rows: int, coverage_table: str = None) -> None:
+    '''
+    Scrive (o aggiorna) la riga di copertura di una data, creando la tabella di copertura se non esiste. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        swe_table: Il nome della tabella SWE in cui è stata caricata la data.
+        snow_year: L'anno nivologico della data.
+        date: La data nel formato 'YYYY-MM-DD'.
+        sparse_mode: La modalità di archiviazione usata ('zero' o 'delta').
+        tolerance: La tolleranza usata, in mm.
+        valid_cells: Il numero di celle valide del raster.
+        stored_rows: Il numero di righe che portano informazione, salvate nella tabella SWE.
+        coverage_table: Il nome della tabella di copertura. Se None viene usato '<swe_table>_coverage'. \n
+    '''
+    coverage_table = coverage_table or coverage_table_name(swe_table)
+    with session.engine.begin() as connection:
+        connection.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS {coverage_table} (
+                snow_year integer NOT NULL,
+                date date NOT NULL,
+                mode text NOT NULL,
+                tolerance real NOT NULL,
+                valid_cells bigint NOT NULL,
+                stored_rows bigint NOT NULL,
+                loaded_at timestamptz NOT NULL DEFAULT now(),
+                PRIMARY KEY (snow_year, date)
+            );
+        '''))
+        connection.execute(text(f'''
+            INSERT INTO {coverage_table} (snow_year, date, mode, tolerance, valid_cells, stored_rows)
+            VALUES (:snow_year, :date, :mode, :tolerance, :valid_cells, :stored_rows)
+            ON CONFLICT (snow_year, date) DO UPDATE SET
+                mode = EXCLUDED.mode, tolerance = EXCLUDED.tolerance, valid_cells = EXCLUDED.valid_cells,
+                stored_rows = EXCLUDED.stored_rows, loaded_at = now();
+        '''), {"snow_year": snow_year, "date": date, "mode": sparse_mode, "tolerance": tolerance,
+               "valid_cells": valid_cells, "stored_rows": stored_rows})
+    logging.info(f"Copertura registrata nella tabella '{coverage_table}' per il {date}: modalità '{sparse_mode}', {stored_rows} righe salvate su {valid_cells} celle valide.")
+
+
+# Funzione per leggere il campo SWE completo di una data
+def read_swe_field(session, date: str, swe_table: str = 'cell_daily_swe_table', geometry_table: str = 'cell_geom_table',
+                   coverage_table: str = None) -> pd.DataFrame:
+    '''
+    Legge il campo SWE completo di una data, ricostruendo le celle non salvate in base alla copertura. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        date: La data nel formato 'YYYY-MM-DD'.
+        swe_table: Il nome della tabella SWE nel database.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        coverage_table: Il nome della tabella di copertura. Se None viene usato '<swe_table>_coverage'. \n
+    Returns:
+        pd.DataFrame: Un dataframe con le colonne 'cell_id' e 'swe_mm'. \n
+    '''
+    coverage_table = coverage_table or coverage_table_name(swe_table)
+    # Con l'anno nivologico la lettura resta nella partizione e nel tratto della chiave primaria della data
+    snow_year = nivological_year(date)
+    with session.engine.connect() as connection:
+        has_coverage = connection.execute(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": coverage_table}).scalar()
+        mode = None
+        if has_coverage:
+            mode = connection.execute(text(f'SELECT mode FROM {coverage_table} WHERE snow_year = :snow_year AND date = :date'),
+                                      {"snow_year": snow_year, "date": date}).scalar()
+    # Data caricata per intero
+    if mode is None:
+        query = f'SELECT cell_id, swe_mm FROM {swe_table} WHERE snow_year = %(snow_year)s AND date = %(date)s'
+        return pd.read_sql(query, session.engine, params={"snow_year": snow_year, "date": date})
+    # Modalità 'zero': le celle senza riga valgono 0
+    if mode == 'zero':
+        query = f'''
+            SELECT g.cell_id, COALESCE(s.swe_mm, 0) AS swe_mm
+            FROM {geometry_table} g
+            LEFT JOIN {swe_table} s ON s.cell_id = g.cell_id AND s.snow_year = %(snow_year)s AND s.date = %(date)s
+        '''
+    # Modalità 'delta': ultimo valore salvato fino alla data richiesta
+    else:
+        query = f'''
+            SELECT DISTINCT ON (cell_id) cell_id, swe_mm
+            FROM {swe_table}
+            WHERE snow_year = %(snow_year)s AND date <= %(date)s
+            ORDER BY cell_id, date DESC
+        '''
+    return pd.read_sql(query, session.engine, params={"snow_year": snow_year, "date": date})
@@ -0,0 +1,76 @@
+'''
+Questo modulo misura il tempo di avvio dell'applicazione e controlla che rispetti il budget previsto. \n
+Il budget riguarda l'import dei moduli caricati prima che la finestra compaia (gui_class) e prima che la
+riga di comando inizi l'elaborazione (swe_cli): entrambi devono restare sotto STARTUP_BUDGET_S secondi
+e non devono importare nessuna delle librerie pesanti in HEAVY_MODULES, che vengono caricate solo alla prima conversione. \n
+Ogni misura viene ripetuta in un nuovo interprete e viene considerato il tempo minimo, per ridurre il rumore. \n
+Il programma termina con codice 1 se il budget viene superato o se un modulo pesante viene importato all'avvio. \n
+Esempio:
+    python startup_check.py
+    python startup_check.py --budget 0.8 --runs 10
+'''
+import sys
+import json
+import argparse
+import subprocess
+
+# Budget di avvio in secondi per l'import dei moduli di ingresso
+STARTUP_BUDGET_S = 0.5
+# Moduli di ingresso da misurare
+ENTRY_MODULES = ('gui_class', 'swe_cli')
+# Librerie che non devono essere importate all'avvio
+HEAVY_MODULES = ('rasterio', 'pyproj', 'geopandas', 'shapely', 'pandas', 'numpy', 'sqlalchemy', 'psycopg2')
+
+# Codice eseguito nel nuovo interprete: importa il modulo e riporta tempo e librerie pesanti caricate
+_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+'''
+
+
+# Funzione per misurare il tempo di import di un modulo in un nuovo interprete
+def measure_import(module: str, runs: int) -> tuple[float, list]:
+    '''
+    Misura il tempo di import di un modulo in un nuovo interprete Python. \n
+    Args:
+        module: Il nome del modulo da importare.
+        runs: Il numero di ripetizioni della misura. \n
+    Returns:
+        tuple: Il tempo minimo in secondi e la lista delle librerie pesanti importate. \n
+    '''
+    times = []
+    heavy = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        times.append(result['elapsed'])
+        heavy = result['heavy']
+    return min(times), heavy
+
+
+# Funzione principale del controllo
+def main(argv: list = None) -> int:
+    '''Esegue il controllo del tempo di avvio e restituisce il codice di uscita.'''
+    parser = argparse.ArgumentParser(description="Controlla il tempo di avvio dell'applicazione.")
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET_S, help="Budget di avvio in secondi.")
+    parser.add_argument('--runs', type=int, default=5, help="Numero di misure per modulo.")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for module in ENTRY_MODULES:
+        elapsed, heavy = measure_import(module, args.runs)
+        status = "OK" if elapsed <= args.budget and not heavy else "FALLITO"
+        print(f"{module}: {elapsed * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms) {status}")
+        if heavy:
+            print(f"  librerie pesanti importate all'avvio: {', '.join(heavy)}")
+        ok = ok and status == "OK"
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
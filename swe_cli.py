@@ -0,0 +1,254 @@
+'''
+Questo modulo fornisce un'interfaccia a riga di comando per convertire e caricare i file GeoTIFF senza interfaccia grafica. \n
+I file possono essere indicati come percorsi, cartelle o pattern glob. I parametri di connessione al database
+vengono letti, in ordine di priorità, dagli argomenti, dalle variabili d'ambiente (SWE_DB_URL oppure
+SWE_DB_USER, SWE_DB_PASSWORD, SWE_DB_HOST, SWE_DB_PORT, SWE_DB_NAME) e dalla sezione [database] di un file di configurazione. \n
+Con --watch le cartelle indicate vengono controllate periodicamente e i nuovi file 'SWE_YYYY-MM-DD.tif'
+vengono caricati appena la loro dimensione smette di cambiare. \n
+Il programma termina con codice 1 se la conversione di almeno un file è fallita, elencando i file falliti. \n
+Esempio:
+    python swe_cli.py /dati/swe --config swe.ini --workers 4
+    python swe_cli.py "/dati/swe/SWE_2024-*.tif" --watch --interval 10
+'''
+import os
+import sys
+import glob
+import signal
+import logging
+import argparse
+import threading
+import time
+import configparser
+from multiprocessing import freeze_support
+from batch_runner import run_batch
+from functions import is_valid_file
+
+# Variabili d'ambiente per i parametri di connessione
+ENV_PREFIX = 'SWE_DB_'
+DB_FIELDS = ('user', 'password', 'host', 'port', 'name')
+
+
+# Funzione per costruire il parser degli argomenti
+def build_parser() -> argparse.ArgumentParser:
+    '''Crea il parser degli argomenti della riga di comando.'''
+    parser = argparse.ArgumentParser(description="Converte file GeoTIFF SWE e li carica su un database PostgreSQL.")
+    parser.add_argument('paths', nargs='+', help="File, cartelle o pattern glob dei GeoTIFF da caricare.")
+    parser.add_argument('--config', help="File di configurazione con una sezione [database] (user, password, host, port, name).")
+    parser.add_argument('--db-url', help="URL completo di connessione al database (ha priorità sui singoli parametri).")
+    parser.add_argument('--user', help="Utente del database.")
+    parser.add_argument('--password', help="Password del database.")
+    parser.add_argument('--host', help="Host del database.")
+    parser.add_argument('--port', help="Porta del database (predefinita 5432).")
+    parser.add_argument('--dbname', help="Nome del database.")
+    parser.add_argument('--geometry-table', default='cell_geom_table', help="Tabella delle geometrie.")
+    parser.add_argument('--swe-table', default='cell_daily_swe_table', help="Tabella dei dati SWE.")
+    parser.add_argument('--workers', type=int, default=None, help="Processi di conversione in parallelo (predefinito: numero di core).")
+    parser.add_argument('--queue-size', type=int, default=2,
+                        help="Blocchi convertiti in attesa tra una fase e l'altra della pipeline (limita la memoria, predefinito 2).")
+    parser.add_argument('--chunk-mb', type=int, default=None, help="Converte e carica i file a blocchi di circa CHUNK_MB MB.")
+    parser.add_argument('--sparse-mode', choices=['zero', 'delta'], default=None,
+                        help="Archiviazione ridotta: 'zero' non salva le celle a 0, 'delta' salva solo le celle cambiate rispetto al valore precedente.")
+    parser.add_argument('--tolerance', type=float, default=0.0, help="Tolleranza in mm per l'archiviazione ridotta.")
+    parser.add_argument('--force', action='store_true', help="Ricarica anche i file già registrati nel manifest come caricati e invariati.")
+    parser.add_argument('--reprocess', action='store_true',
+                        help="Per i raster corretti e ripubblicati: aggiorna solo le celle il cui valore è cambiato, invece di ignorare le righe già presenti.")
+    parser.add_argument('--raster-table', default=None,
+                        help="Salva ogni file per intero come un'unica riga di questa tabella, invece di una riga per cella.")
+    parser.add_argument('--parquet-dir', default=None,
+                        help="Scrive i dati convertiti anche in un dataset Parquet/GeoParquet partizionato per anno nivologico e data (richiede pyarrow); "
+                             "i file già caricati nel database ma non ancora nel dataset vengono scritti solo nel dataset.")
+    parser.add_argument('--check-mode', choices=['local', 'server'], default='local',
+                        help="Controllo delle geometrie: 'local' con l'indice dei cell_id scaricato e tenuto in cache, "
+                             "'server' con un anti-join sul database che trasmette solo gli ID dei file (utile con un database remoto).")
+    parser.add_argument('--warp', nargs='?', const='average', default=None, choices=['nearest', 'bilinear', 'cubic', 'average'],
+                        help="Riproietta al volo i file con CRS o pixel diversi sulla griglia della tabella delle geometrie, "
+                             "con il ricampionamento indicato (predefinito: average).")
+    parser.add_argument('--zone-table', default=None,
+                        help="Tabella PostGIS delle zone (colonne zone_id e geom, ad esempio i bacini) di cui calcolare le statistiche "
+                             "zonali di ogni file caricato; con --force vengono calcolate anche per i file già caricati.")
+    parser.add_argument('--zonal-table', default=None, help="Tabella delle statistiche zonali (predefinita: <zone-table>_swe).")
+    parser.add_argument('--no-db', action='store_true', help="Con --parquet-dir, scrive solo il dataset Parquet senza accedere al database.")
+    parser.add_argument('--report', default=None,
+                        help="Percorso, senza estensione, del report JSON/CSV delle fasi (predefinito: cartella dei report in SWE_REPORT_DIR o ~/.swe_converter/reports).")
+    parser.add_argument('--watch', action='store_true', help="Resta in ascolto e carica i nuovi file che compaiono nelle cartelle.")
+    parser.add_argument('--interval', type=float, default=5.0, help="Intervallo in secondi tra due controlli in modalità --watch.")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Livello di log.")
+    return parser
+
+
+# Funzione per costruire l'URL di connessione dagli argomenti, dall'ambiente o dal file di configurazione
+def resolve_db_url(args: argparse.Namespace) -> str:
+    '''
+    Costruisce l'URL di connessione al database PostgreSQL. \n
+    Args:
+        args: Gli argomenti della riga di comando. \n
+    Returns:
+        str: L'URL di connessione al database. \n
+    Raises:
+        ValueError: Se mancano uno o più parametri di connessione. \n
+    '''
+    if args.db_url or os.environ.get(ENV_PREFIX + 'URL'):
+        return args.db_url or os.environ[ENV_PREFIX + 'URL']
+    # Legge i parametri dal file di configurazione, se indicato
+    config = {}
+    if args.config:
+        parser = configparser.ConfigParser()
+        if not parser.read(args.config):
+            raise ValueError(f"Impossibile leggere il file di configurazione '{args.config}'.")
+        if parser.has_section('database'):
+            config = dict(parser.items('database'))
+    # Gli argomenti hanno priorità sulle variabili d'ambiente, che hanno priorità sul file di configurazione
+    cli_values = {'user': args.user, 'password': args.password, 'host': args.host, 'port': args.port, 'name': args.dbname}
+    values = {}
+    for field in DB_FIELDS:
+        values[field] = cli_values[field] or os.environ.get(ENV_PREFIX + field.upper()) or config.get(field)
+    values['port'] = values['port'] or '5432'
+    missing = [field for field in DB_FIELDS if not values[field]]
+    if missing:
+        raise ValueError(f"Parametri di connessione mancanti: {', '.join(missing)}.")
+    return f"postgresql+psycopg2://{values['user']}:{values['password']}@{values['host']}:{values['port']}/{values['name']}"
+
+
+# Funzione per trovare i file GeoTIFF indicati da percorsi, cartelle o pattern glob
+def collect_files(paths: list) -> list:
+    '''
+    Restituisce la lista ordinata dei file GeoTIFF indicati. \n
+    Args:
+        paths: La lista di file, cartelle o pattern glob. \n
+    Returns:
+        list: La lista dei percorsi dei file trovati, senza duplicati. \n
+    '''
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, 'SWE_*.tif')))
+        else:
+            files.update(match for match in glob.glob(path) if os.path.isfile(match))
+    return sorted(files)
+
+
+# Funzione per controllare se un file ha un nome valido senza sollevare eccezioni
+def _has_valid_name(file_path: str) -> bool:
+    '''Restituisce True se il nome del file è nel formato 'SWE_YYYY-MM-DD.tif'.'''
+    try:
+        is_valid_file(os.path.basename(file_path))
+        return True
+    except (ValueError, IndexError):
+        return False
+
+
+# Funzione per caricare periodicamente i nuovi file
+def watch(args: argparse.Namespace, db_url: str, stop_event: threading.Event) -> list:
+    '''
+    Controlla periodicamente i percorsi indicati e carica i file nuovi o modificati. \n
+    Un file viene caricato quando dimensione e data di modifica non sono cambiate tra due controlli consecutivi,
+    così i file ancora in fase di copia non vengono letti a metà. \n
+    Args:
+        args: Gli argomenti della riga di comando.
+        db_url: L'URL di connessione al database.
+        stop_event: Evento che interrompe il controllo. \n
+    Returns:
+        list: La lista dei file il cui caricamento è fallito. \n
+    '''
+    logging.info(f"Modalità watch attiva: controllo ogni {args.interval} secondi. Premere Ctrl+C per terminare.")
+    seen = {}        # file -> (dimensione, data di modifica) già caricato o fallito
+    candidates = {}  # file -> (dimensione, data di modifica) al controllo precedente
+    failed = set()
+    while not stop_event.is_set():
+        ready = {}
+        for file_path in collect_files(args.paths):
+            if not _has_valid_name(file_path):
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if seen.get(file_path) == signature:
+                continue
+            # Il file è pronto se non è cambiato dal controllo precedente
+            if candidates.pop(file_path, None) == signature:
+                ready[file_path] = signature
+            else:
+                candidates[file_path] = signature
+        if ready:
+            logging.info(f"Nuovi file da caricare: {len(ready)}")
+            # In ascolto ogni gruppo di file ha il proprio report
+            report_path = f"{args.report}_{time.strftime('%Y%m%d_%H%M%S')}" if args.report else None
+            batch_failed = run_batch(list(ready), db_url, workers=args.workers, stop_event=stop_event,
+                                     geometry_table=args.geometry_table, swe_table=args.swe_table, chunk_mb=args.chunk_mb,
+                                     sparse_mode=args.sparse_mode, tolerance=args.tolerance, force=args.force, report_path=report_path,
+                                     raster_table=args.raster_table, parquet_dir=args.parquet_dir, resampling=args.warp,
+                                     queue_size=args.queue_size, check_mode=args.check_mode,
+                                     reprocess=args.reprocess, zone_table=args.zone_table, zonal_table=args.zonal_table)
+            seen.update(ready)
+            failed.difference_update(ready)
+            failed.update(batch_failed)
+        stop_event.wait(args.interval)
+    return sorted(failed)
+
+
+# Funzione principale della riga di comando
+def main(argv: list = None) -> int:
+    '''
+    Esegue la conversione e il caricamento dalla riga di comando. \n
+    Args:
+        argv: Gli argomenti della riga di comando (predefinito: sys.argv[1:]). \n
+    Returns:
+        int: Il codice di uscita, 0 se tutti i file sono stati caricati, 1 se ci sono file falliti, 2 per errori di configurazione. \n
+    '''
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.raster_table and (args.sparse_mode or args.chunk_mb):
+        parser.error("--raster-table non è compatibile con --sparse-mode e --chunk-mb.")
+    if args.no_db and (not args.parquet_dir or args.raster_table):
+        parser.error("--no-db richiede --parquet-dir e non è compatibile con --raster-table.")
+    if args.no_db and args.warp:
+        parser.error("--warp richiede il database, da cui legge la griglia della tabella delle geometrie.")
+    if args.no_db and args.zone_table:
+        parser.error("--zone-table richiede il database, da cui legge le zone.")
+    if args.reprocess and args.sparse_mode:
+        parser.error("--reprocess non è compatibile con --sparse-mode.")
+    if args.queue_size < 1:
+        parser.error("--queue-size deve essere almeno 1.")
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        db_url = None if args.no_db else resolve_db_url(args)
+    except ValueError as e:
+        logging.error(e)
+        return 2
+
+    # Interrompe l'elaborazione in modo ordinato con SIGINT o SIGTERM
+    stop_event = threading.Event()
+    def request_stop(signum, frame):
+        logging.warning("Interruzione richiesta, termino dopo il blocco in corso.")
+        stop_event.set()
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    if args.watch:
+        failed = watch(args, db_url, stop_event)
+    else:
+        files = collect_files(args.paths)
+        if not files:
+            logging.error("Nessun file GeoTIFF trovato nei percorsi indicati.")
+            return 1
+        failed = run_batch(files, db_url, workers=args.workers, stop_event=stop_event,
+                           geometry_table=args.geometry_table, swe_table=args.swe_table, chunk_mb=args.chunk_mb,
+                           sparse_mode=args.sparse_mode, tolerance=args.tolerance, force=args.force, report_path=args.report,
+                           raster_table=args.raster_table, parquet_dir=args.parquet_dir, resampling=args.warp,
+                           queue_size=args.queue_size, check_mode=args.check_mode,
+                           reprocess=args.reprocess, zone_table=args.zone_table, zonal_table=args.zonal_table)
+
+    if failed:
+        print(f"Caricamento fallito per {len(failed)} file:", file=sys.stderr)
+        for file_path in failed:
+            print(f" - {file_path}", file=sys.stderr)
+        return 1
+    return 1 if stop_event.is_set() and not args.watch else 0
+
+
+if __name__ == "__main__":
+    # Necessario per il pool di processi nell'eseguibile PyInstaller
+    freeze_support()
+    sys.exit(main())
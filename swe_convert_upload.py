@@ -1,3 +1,4 @@
+from multiprocessing import freeze_support
 from gui_class import SWEConverterGUI
 
 def main():
@@ -6,4 +7,6 @@ def main():
     app.mainloop()
 
 if __name__ == "__main__":
+    # Necessario per il pool di processi nell'eseguibile PyInstaller
+    freeze_support()
     main()
\ No newline at end of file
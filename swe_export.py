@@ -0,0 +1,238 @@
+'''
+Questo modulo esporta i dati della tabella SWE in GeoTIFF, ricostruendo i raster dalle righe per cella. \n
+Le righe di ogni data vengono lette a blocchi con un cursore sul server e gli ID delle celle ('XXXXXXX_YYYYYYY',
+angolo superiore sinistro) vengono decodificati in riga e colonna con la trasformazione inversa della griglia da 500 m,
+con operazioni vettoriali: i valori vengono inseriti direttamente nella matrice della banda. \n
+La griglia ha il CRS e l'origine della tabella delle geometrie e copre il riquadro indicato (allineato alle celle)
+oppure, senza riquadro, tutte le celle della tabella delle geometrie. Un intervallo di date produce un GeoTIFF
+con una banda per data, con la data nella descrizione della banda (come i file con più date caricati da geoTIFF_converter).
+Il GeoTIFF è in float32 con noData NaN, a blocchi 256x256 e compresso con DEFLATE. \n
+Le date caricate con l'archiviazione ridotta vengono ricostruite con sparse_storage.read_swe_field. \n
+Esempio:
+    python swe_export.py --db-url URL --start 2024-02-01 --end 2024-02-07 --bbox 600000 5000000 700000 5100000
+'''
+import os
+import math
+import logging
+import numpy as np
+import pandas as pd
+import rasterio
+import affine
+from sqlalchemy import text
+from cell_index import cell_ids_to_coords
+from functions import nivological_year
+from metrics import stage
+from reprojection import CELL_SIZE, grid_origin
+from sparse_storage import coverage_table_name, read_swe_field
+
+# Righe lette dal database per ogni blocco
+CHUNK_ROWS = 500_000
+# Opzioni di scrittura del GeoTIFF: blocchi 256x256, DEFLATE con predittore per i valori in virgola mobile
+GTIFF_OPTIONS = {'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'compress': 'deflate', 'predictor': 3, 'BIGTIFF': 'IF_SAFER'}
+
+
+# Funzione per calcolare la griglia dell'esportazione
+def export_grid(session, geometry_table: str = 'cell_geom_table', bbox: tuple = None) -> tuple[affine.Affine, int, int]:
+    '''
+    Calcola la griglia da 500 m dell'esportazione, allineata alle celle della tabella delle geometrie. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        bbox: Il riquadro (xmin, ymin, xmax, ymax) nel CRS della tabella, oppure None per coprire tutte le celle della tabella. \n
+    Returns:
+        tuple: La matrice di trasformazione, la larghezza e l'altezza della griglia. \n
+    Raises:
+        ValueError: Se il riquadro non è valido o la tabella delle geometrie è vuota. \n
+    '''
+    if bbox is None:
+        # Estensione delle celle: gli ID indicano l'angolo superiore sinistro
+        with session.engine.connect() as connection:
+            extent = connection.execute(text(f'''
+                SELECT min(split_part(cell_id, '_', 1)::bigint), min(split_part(cell_id, '_', 2)::bigint),
+                       max(split_part(cell_id, '_', 1)::bigint), max(split_part(cell_id, '_', 2)::bigint)
+                FROM {geometry_table};
+            ''')).fetchone()
+        if extent[0] is None:
+            raise ValueError(f"La tabella delle geometrie '{geometry_table}' è vuota: indicare il riquadro da esportare.")
+        xmin, ymin, xmax, ymax = extent[0], extent[1] - CELL_SIZE, extent[2] + CELL_SIZE, extent[3]
+    else:
+        xmin, ymin, xmax, ymax = bbox
+        if xmin >= xmax or ymin >= ymax:
+            raise ValueError(f"Riquadro {bbox} non valido: indicare xmin ymin xmax ymax con xmin < xmax e ymin < ymax.")
+        # Allinea i bordi alla griglia delle celle, includendo tutte le celle toccate dal riquadro
+        origin_x, origin_y = grid_origin(session, geometry_table)
+        xmin = math.floor((xmin - origin_x) / CELL_SIZE) * CELL_SIZE + origin_x
+        xmax = math.ceil((xmax - origin_x) / CELL_SIZE) * CELL_SIZE + origin_x
+        ymin = math.floor((ymin - origin_y) / CELL_SIZE) * CELL_SIZE + origin_y
+        ymax = math.ceil((ymax - origin_y) / CELL_SIZE) * CELL_SIZE + origin_y
+    transform = affine.Affine(CELL_SIZE, 0, xmin, 0, -CELL_SIZE, ymax)
+    return transform, int((xmax - xmin) // CELL_SIZE), int((ymax - ymin) // CELL_SIZE)
+
+
+# Funzione per leggere le date presenti in un intervallo
+def export_dates(session, start_date: str, end_date: str, swe_table: str = 'cell_daily_swe_table',
+                 coverage_table: str = None) -> list:
+    '''
+    Restituisce, in ordine, le date dell'intervallo presenti nella tabella SWE o nella tabella di copertura
+    (una data in modalità 'zero' può non avere righe). \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        start_date: La prima data (inclusa) nel formato 'YYYY-MM-DD'.
+        end_date: L'ultima data (inclusa) nel formato 'YYYY-MM-DD'.
+        swe_table: Il nome della tabella SWE nel database.
+        coverage_table: Il nome della tabella di copertura. Se None viene usato '<swe_table>_coverage'. \n
+    Returns:
+        list: Le date nel formato 'YYYY-MM-DD'. \n
+    '''
+    coverage_table = coverage_table or coverage_table_name(swe_table)
+    # Il filtro sugli anni nivologici limita la lettura alle partizioni e al tratto della chiave primaria dell'intervallo
+    params = {"start_date": start_date, "end_date": end_date,
+              "first_year": nivological_year(start_date), "last_year": nivological_year(end_date)}
+    filters = 'snow_year BETWEEN :first_year AND :last_year AND date BETWEEN :start_date AND :end_date'
+    with session.engine.connect() as connection:
+        query = f'SELECT DISTINCT date FROM {swe_table} WHERE {filters}'
+        if connection.execute(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": coverage_table}).scalar():
+            query += f' UNION SELECT date FROM {coverage_table} WHERE {filters}'
+        dates = connection.execute(text(query + ' ORDER BY date;'), params).scalars().all()
+    return [date.strftime('%Y-%m-%d') for date in dates]
+
+
+# Funzione per inserire i valori di un blocco di righe nella matrice della banda
+def scatter_cells(band: np.ndarray, transform: affine.Affine, cell_ids, values) -> int:
+    '''
+    Decodifica gli ID delle celle in riga e colonna della griglia e vi inserisce i valori, ignorando le celle esterne. \n
+    Args:
+        band: La matrice della banda, aggiornata sul posto.
+        transform: La matrice di trasformazione della griglia.
+        cell_ids: La sequenza dei cell_id.
+        values: I valori SWE in mm, nello stesso ordine degli ID. \n
+    Returns:
+        int: Il numero di celle inserite. \n
+    '''
+    if not len(cell_ids):
+        return 0
+    lons, lats = cell_ids_to_coords(cell_ids)
+    # Trasformazione inversa della griglia da 500 m: l'angolo superiore sinistro individua la cella
+    cols = (lons - int(transform.c)) // CELL_SIZE
+    rows = (int(transform.f) - lats) // CELL_SIZE
+    inside = (rows >= 0) & (rows < band.shape[0]) & (cols >= 0) & (cols < band.shape[1])
+    band[rows[inside], cols[inside]] = np.asarray(values, dtype=np.float32)[inside]
+    return int(np.count_nonzero(inside))
+
+
+# Funzione per ricostruire il raster di una data
+def read_date_band(session, date: str, transform: affine.Affine, width: int, height: int, swe_table: str = 'cell_daily_swe_table',
+                   geometry_table: str = 'cell_geom_table', coverage_table: str = None) -> np.ndarray:
+    '''
+    Ricostruisce il raster SWE di una data sulla griglia indicata, leggendo le righe a blocchi. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        date: La data nel formato 'YYYY-MM-DD'.
+        transform: La matrice di trasformazione della griglia.
+        width: La larghezza della griglia.
+        height: L'altezza della griglia.
+        swe_table: Il nome della tabella SWE nel database.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        coverage_table: Il nome della tabella di copertura. Se None viene usato '<swe_table>_coverage'. \n
+    Returns:
+        np.ndarray: La matrice dei valori in float32, con NaN dove la cella non ha un valore. \n
+    '''
+    coverage_table = coverage_table or coverage_table_name(swe_table)
+    band = np.full((height, width), np.nan, dtype=np.float32)
+    snow_year = nivological_year(date)
+    with stage('export', rows=0) as export_stage, session.engine.connect() as connection:
+        coverage = None
+        if connection.execute(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": coverage_table}).scalar():
+            coverage = connection.execute(text(f'SELECT 1 FROM {coverage_table} WHERE snow_year = :snow_year AND date = :date'),
+                                          {"snow_year": snow_year, "date": date}).scalar()
+        if coverage:
+            # Data in archiviazione ridotta: il campo completo viene ricostruito in base alla copertura
+            field = read_swe_field(session, date, swe_table, geometry_table, coverage_table)
+            export_stage['rows'] = scatter_cells(band, transform, field['cell_id'], field['swe_mm'])
+        else:
+            # Filtro sul riquadro nel database, per trasferire solo le celle della griglia
+            left, top = int(transform.c), int(transform.f)
+            query = f'''
+                SELECT cell_id, swe_mm FROM {swe_table}
+                WHERE snow_year = %(snow_year)s AND date = %(date)s AND swe_mm IS NOT NULL
+                  AND split_part(cell_id, '_', 1)::bigint BETWEEN %(left)s AND %(right)s
+                  AND split_part(cell_id, '_', 2)::bigint BETWEEN %(bottom)s AND %(top)s
+            '''
+            params = {"snow_year": snow_year, "date": date, "left": left, "right": left + (width - 1) * CELL_SIZE,
+                      "bottom": top - (height - 1) * CELL_SIZE, "top": top}
+            # Cursore sul server: in memoria resta un solo blocco di righe alla volta
+            streaming = connection.execution_options(stream_results=True)
+            for chunk in pd.read_sql(query, streaming, params=params, chunksize=CHUNK_ROWS):
+                export_stage['rows'] += scatter_cells(band, transform, chunk['cell_id'].to_numpy(), chunk['swe_mm'].to_numpy())
+        export_stage['bytes'] = band.nbytes
+    logging.info(f"Raster del {date} ricostruito: {export_stage['rows']} celle con valore.")
+    return band
+
+
+# Funzione per esportare una o più date in un GeoTIFF
+def export_geotiff(session, output_path: str, start_date: str, end_date: str = None, bbox: tuple = None,
+                   swe_table: str = 'cell_daily_swe_table', geometry_table: str = 'cell_geom_table',
+                   coverage_table: str = None) -> list:
+    '''
+    Ricostruisce i raster delle date richieste dalla tabella SWE e li scrive in un GeoTIFF, una banda per data.
+    Le bande vengono lette e scritte una alla volta, quindi la memoria usata è quella di una sola banda. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        output_path: Il percorso del GeoTIFF da scrivere.
+        start_date: La prima data (inclusa) nel formato 'YYYY-MM-DD'.
+        end_date: L'ultima data (inclusa) nel formato 'YYYY-MM-DD'. Se None viene esportata solo start_date.
+        bbox: Il riquadro (xmin, ymin, xmax, ymax) nel CRS della tabella delle geometrie, oppure None per tutte le celle.
+        swe_table: Il nome della tabella SWE nel database.
+        geometry_table: Il nome della tabella delle geometrie nel database.
+        coverage_table: Il nome della tabella di copertura. Se None viene usato '<swe_table>_coverage'. \n
+    Returns:
+        list: Le date esportate, nell'ordine delle bande. \n
+    Raises:
+        ValueError: Se nell'intervallo non ci sono date. \n
+    '''
+    dates = export_dates(session, start_date, end_date or start_date, swe_table, coverage_table)
+    if not dates:
+        raise ValueError(f"Nessuna data tra {start_date} e {end_date or start_date} nella tabella '{swe_table}'.")
+    transform, width, height = export_grid(session, geometry_table, bbox)
+    logging.info(f"Esportazione di {len(dates)} date su una griglia di {width}x{height} celle in {output_path}.")
+    profile = {'driver': 'GTiff', 'width': width, 'height': height, 'count': len(dates), 'dtype': 'float32',
+               'crs': session.get_crs(geometry_table), 'transform': transform, 'nodata': np.nan, **GTIFF_OPTIONS}
+    # Le opzioni dei blocchi valgono solo se la griglia è più grande di un blocco
+    if width < GTIFF_OPTIONS['blockxsize'] or height < GTIFF_OPTIONS['blockysize']:
+        profile.update(tiled=False)
+        profile.pop('blockxsize')
+        profile.pop('blockysize')
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    temp_path = output_path + '.tmp'
+    with rasterio.open(temp_path, 'w', **profile) as output:
+        for band_index, date in enumerate(dates, start=1):
+            band = read_date_band(session, date, transform, width, height, swe_table, geometry_table, coverage_table)
+            output.write(band, band_index)
+            output.set_band_description(band_index, date)
+    # Il GeoTIFF compare solo completo
+    os.replace(temp_path, output_path)
+    logging.info(f"GeoTIFF scritto: {output_path}")
+    return dates
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_session import UploadSession
+
+    parser = argparse.ArgumentParser(description="Esporta i dati della tabella SWE in un GeoTIFF, una banda per data.")
+    parser.add_argument('--db-url', required=True, help="URL completo di connessione al database.")
+    parser.add_argument('--start', required=True, help="Prima data da esportare (YYYY-MM-DD).")
+    parser.add_argument('--end', default=None, help="Ultima data da esportare (YYYY-MM-DD); se assente viene esportata solo --start.")
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'), default=None,
+                        help="Riquadro da esportare nel CRS della tabella delle geometrie (predefinito: tutte le celle).")
+    parser.add_argument('--output', default=None,
+                        help="GeoTIFF da scrivere (predefinito: SWE_<start>.tif o SWE_<start>_<end>.tif, caricabile di nuovo).")
+    parser.add_argument('--swe-table', default='cell_daily_swe_table', help="Tabella dei dati SWE.")
+    parser.add_argument('--geometry-table', default='cell_geom_table', help="Tabella delle geometrie.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    output_path = args.output or (f"SWE_{args.start}_{args.end}.tif" if args.end and args.end != args.start else f"SWE_{args.start}.tif")
+    with UploadSession(args.db_url) as session:
+        export_geotiff(session, output_path, args.start, args.end, tuple(args.bbox) if args.bbox else None,
+                       args.swe_table, args.geometry_table)
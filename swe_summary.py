@@ -0,0 +1,224 @@
+'''
+Questo modulo mantiene le tabelle di riepilogo dei dati SWE, con una riga per anno nivologico e data. \n
+Ogni tabella SWE (o tabella dei raster) ha la propria tabella di riepilogo, '<tabella>_summary' (vedi summary_table_name),
+così i caricamenti in tabelle diverse non si sovrascrivono a vicenda. \n
+Ogni riga contiene il numero di celle valide e di celle con neve, somma, media, percentili e massimo dello SWE,
+l'area innevata (celle da 500 m con SWE maggiore di 0) e il volume d'acqua equivalente: i cruscotti leggono
+una riga invece di scorrere milioni di righe della tabella SWE. \n
+Il riepilogo viene calcolato durante il caricamento a partire dal campo completo del raster (celle a 0 comprese,
+anche con l'archiviazione ridotta) e scritto alla fine di ogni file (vedi FileUpload). La riga segue la stessa regola
+dei dati: un nuovo caricamento di una data già presente non la modifica, mentre la rielaborazione (reprocess)
+la sostituisce insieme ai valori aggiornati, così riepilogo e tabella SWE restano coerenti. \n
+Per le date caricate prima dell'introduzione del riepilogo la tabella può essere ricostruita dalla tabella SWE:
+    python swe_summary.py rebuild --db-url URL [--swe-table T] [--summary-table S] [--snow-year 2024]
+'''
+import logging
+import numpy as np
+from sqlalchemy import text
+from sparse_storage import coverage_table_name
+
+# Percentili dello SWE salvati nel riepilogo
+PERCENTILES = (10, 25, 50, 75, 90)
+# Area di una cella da 500 m, in km² e in m²
+CELL_AREA_KM2 = 0.25
+_CELL_AREA_M2 = 250_000
+
+
+# Funzione per ottenere il nome della tabella di riepilogo di una tabella SWE
+def summary_table_name(source_table: str) -> str:
+    '''
+    Restituisce il nome della tabella di riepilogo dei dati caricati in una tabella. \n
+    Args:
+        source_table: Il nome della tabella SWE o della tabella dei raster. \n
+    Returns:
+        str: Il nome della tabella di riepilogo, '<source_table>_summary'. \n
+    '''
+    return f"{source_table}_summary"
+
+
+# Funzione per creare la tabella di riepilogo
+def create_summary_table(connection, summary_table: str) -> None:
+    '''Crea, se non esiste, la tabella di riepilogo con una riga per anno nivologico e data.'''
+    percentile_columns = "".join(f"swe_p{p}_mm real,\n                " for p in PERCENTILES)
+    connection.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {summary_table} (
+            snow_year integer NOT NULL,
+            date date NOT NULL,
+            valid_cells bigint NOT NULL,
+            snow_cells bigint NOT NULL,
+            swe_sum_mm double precision NOT NULL,
+            swe_mean_mm double precision,
+            {percentile_columns}swe_max_mm real,
+            snow_area_km2 double precision NOT NULL,
+            swe_volume_m3 double precision NOT NULL,
+            loaded_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (snow_year, date)
+        );
+    '''))
+
+
+# Funzione per calcolare il riepilogo di un campo SWE
+def summarize(values: np.ndarray) -> dict:
+    '''
+    Calcola il riepilogo dei valori validi di un campo SWE. \n
+    Args:
+        values: L'array dei valori SWE in mm delle celle valide (eventuali NaN vengono ignorati). \n
+    Returns:
+        dict: Il riepilogo con le colonne della tabella di riepilogo (senza anno nivologico e data). \n
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    count = int(values.size)
+    total = float(values.sum()) if count else 0.0
+    snow_cells = int(np.count_nonzero(values > 0))
+    row = {
+        'valid_cells': count,
+        'snow_cells': snow_cells,
+        'swe_sum_mm': total,
+        'swe_mean_mm': total / count if count else None,
+        'swe_max_mm': float(values.max()) if count else None,
+        'snow_area_km2': snow_cells * CELL_AREA_KM2,
+        # mm su una cella da 500 m: 1 mm = 0.001 m d'acqua su 250000 m²
+        'swe_volume_m3': total * 0.001 * _CELL_AREA_M2,
+    }
+    # Percentili con interpolazione lineare, come percentile_cont di PostgreSQL
+    quantiles = np.percentile(values, PERCENTILES) if count else [None] * len(PERCENTILES)
+    for p, quantile in zip(PERCENTILES, quantiles):
+        row[f'swe_p{p}_mm'] = float(quantile) if quantile is not None else None
+    return row
+
+
+# Classe per raccogliere i valori di un file, anche a blocchi, fino al calcolo del riepilogo
+class SummaryAccumulator:
+    '''Raccolta dei valori validi di ogni data di un file, per calcolarne il riepilogo al termine del caricamento.'''
+    # Metodo di inizializzazione della classe SummaryAccumulator
+    def __init__(self):
+        '''Inizializza una raccolta vuota.'''
+        self._values = {}
+
+    # Metodo per aggiungere i valori di una data
+    def add(self, date: str, values) -> None:
+        '''
+        Aggiunge i valori validi (in float32, 4 byte per cella) di una data o di un blocco di una data. \n
+        Args:
+            date: La data nel formato 'YYYY-MM-DD'.
+            values: I valori SWE in mm delle celle valide. \n
+        '''
+        self._values.setdefault(date, []).append(np.asarray(values, dtype=np.float32))
+
+    # Metodo per calcolare le righe di riepilogo
+    def rows(self, nivological_year) -> list:
+        '''
+        Calcola una riga di riepilogo per ogni data raccolta. \n
+        Args:
+            nivological_year: La funzione che calcola l'anno nivologico di una data. \n
+        Returns:
+            list: Le righe di riepilogo, con anno nivologico e data, in ordine di data. \n
+        '''
+        rows = []
+        for date, chunks in sorted(self._values.items()):
+            row = summarize(np.concatenate(chunks))
+            rows.append({'snow_year': nivological_year(date), 'date': date, **row})
+        return rows
+
+
+# Funzione per scrivere le righe di riepilogo
+def write_summary(session, rows: list, source_table: str, replace: bool = False, summary_table: str = None) -> int:
+    '''
+    Scrive le righe di riepilogo in un'unica transazione, creando la tabella se non esiste. \n
+    Args:
+        session: La sessione di caricamento sul database PostgreSQL.
+        rows: Le righe calcolate con SummaryAccumulator.rows.
+        source_table: Il nome della tabella SWE o della tabella dei raster in cui sono stati caricati i dati.
+        replace: Se True sostituisce le righe già presenti (rielaborazione), altrimenti le lascia invariate come i dati.
+        summary_table: Il nome della tabella di riepilogo. Se None viene usato '<source_table>_summary'. \n
+    Returns:
+        int: Il numero di righe scritte. \n
+    '''
+    if not rows:
+        return 0
+    summary_table = summary_table or summary_table_name(source_table)
+    columns = list(rows[0])
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in ('snow_year', 'date'))
+    conflict = f"DO UPDATE SET {updates}, loaded_at = now()" if replace else "DO NOTHING"
+    with session.engine.begin() as connection:
+        create_summary_table(connection, summary_table)
+        written = connection.execute(text(f'''
+            INSERT INTO {summary_table} ({", ".join(columns)})
+            VALUES ({", ".join(f":{column}" for column in columns)})
+            ON CONFLICT (snow_year, date) {conflict};
+        '''), rows).rowcount
+    logging.info(f"Riepilogo scritto nella tabella '{summary_table}' per {written} date su {len(rows)}.")
+    return written
+
+
+# Funzione per ricostruire il riepilogo a partire dalla tabella SWE
+def rebuild_summary(engine, swe_table: str = 'cell_daily_swe_table', summary_table: str = None,
+                    snow_year: int = None, coverage_table: str = None) -> int:
+    '''
+    Ricalcola con il database il riepilogo delle date salvate per intero nella tabella SWE, sostituendo le righe presenti. \n
+    Le date caricate con l'archiviazione ridotta (presenti nella tabella di copertura) vengono escluse, perché
+    la tabella SWE non contiene tutte le loro celle. \n
+    Args:
+        engine: L'engine SQLAlchemy per la connessione al database.
+        swe_table: Il nome della tabella SWE.
+        summary_table: Il nome della tabella di riepilogo. Se None viene usato '<swe_table>_summary'.
+        snow_year: Se indicato, ricalcola solo l'anno nivologico indicato.
+        coverage_table: Il nome della tabella di copertura dell'archiviazione ridotta. Se None viene usato '<swe_table>_coverage'. \n
+    Returns:
+        int: Il numero di date ricalcolate. \n
+    '''
+    summary_table = summary_table or summary_table_name(swe_table)
+    coverage_table = coverage_table or coverage_table_name(swe_table)
+    fractions = ", ".join(str(p / 100) for p in PERCENTILES)
+    percentiles = "".join(f"q[{i}], " for i in range(1, len(PERCENTILES) + 1))
+    percentile_columns = "".join(f"swe_p{p}_mm, " for p in PERCENTILES)
+    with engine.begin() as connection:
+        create_summary_table(connection, summary_table)
+        filters = ["s.swe_mm IS NOT NULL"]
+        params = {"cell_area_km2": CELL_AREA_KM2, "cell_area_m2": _CELL_AREA_M2}
+        if snow_year is not None:
+            filters.append("s.snow_year = :snow_year")
+            params["snow_year"] = snow_year
+        if connection.execute(text('SELECT to_regclass(:table) IS NOT NULL;'), {"table": coverage_table}).scalar():
+            filters.append(f"NOT EXISTS (SELECT 1 FROM {coverage_table} c WHERE c.snow_year = s.snow_year AND c.date = s.date)")
+        rebuilt = connection.execute(text(f'''
+            INSERT INTO {summary_table} (snow_year, date, valid_cells, snow_cells, swe_sum_mm, swe_mean_mm,
+                                         {percentile_columns}swe_max_mm, snow_area_km2, swe_volume_m3)
+            SELECT snow_year, date, valid_cells, snow_cells, swe_sum_mm, swe_mean_mm,
+                   {percentiles}swe_max_mm, snow_cells * :cell_area_km2, swe_sum_mm * 0.001 * :cell_area_m2
+            FROM (
+                SELECT s.snow_year, s.date, count(*) AS valid_cells, count(*) FILTER (WHERE s.swe_mm > 0) AS snow_cells,
+                       sum(s.swe_mm)::double precision AS swe_sum_mm, avg(s.swe_mm)::double precision AS swe_mean_mm,
+                       percentile_cont(ARRAY[{fractions}]) WITHIN GROUP (ORDER BY s.swe_mm) AS q,
+                       max(s.swe_mm) AS swe_max_mm
+                FROM {swe_table} s
+                WHERE {" AND ".join(filters)}
+                GROUP BY s.snow_year, s.date
+            ) daily
+            ON CONFLICT (snow_year, date) DO UPDATE SET
+                valid_cells = EXCLUDED.valid_cells, snow_cells = EXCLUDED.snow_cells, swe_sum_mm = EXCLUDED.swe_sum_mm,
+                swe_mean_mm = EXCLUDED.swe_mean_mm, {", ".join(f"swe_p{p}_mm = EXCLUDED.swe_p{p}_mm" for p in PERCENTILES)},
+                swe_max_mm = EXCLUDED.swe_max_mm, snow_area_km2 = EXCLUDED.snow_area_km2,
+                swe_volume_m3 = EXCLUDED.swe_volume_m3, loaded_at = now();
+        '''), params).rowcount
+    logging.info(f"Riepilogo ricostruito nella tabella '{summary_table}' per {rebuilt} date.")
+    return rebuilt
+
+
+if __name__ == "__main__":
+    import argparse
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Gestione della tabella di riepilogo dei dati SWE.")
+    parser.add_argument('action', choices=['rebuild'])
+    parser.add_argument('--db-url', required=True, help="URL completo di connessione al database.")
+    parser.add_argument('--swe-table', default='cell_daily_swe_table', help="Tabella dei dati SWE.")
+    parser.add_argument('--summary-table', default=None, help="Tabella di riepilogo (predefinita: '<swe-table>_summary').")
+    parser.add_argument('--snow-year', type=int, default=None, help="Ricalcola solo l'anno nivologico indicato.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    engine = create_engine(args.db_url)
+    rebuild_summary(engine, args.swe_table, args.summary_table, args.snow_year)
+    engine.dispose()
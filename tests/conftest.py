@@ -0,0 +1,10 @@
+'''
+Configurazione dei test: i moduli dell'applicazione sono nella cartella principale del repository,
+che viene aggiunta al percorso di import. I test non richiedono il database né GDAL. \n
+Esempio:
+    python -m pytest tests
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
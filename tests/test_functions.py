@@ -0,0 +1,27 @@
+'''Test dell'estrazione delle date dal nome dei file (functions).'''
+import pytest
+from functions import file_date_range
+
+
+# Test di un file con una sola data
+def test_file_date_range_single_date():
+    assert file_date_range('SWE_2024-02-01.tif') == ('2024-02-01', '2024-02-01')
+
+
+# Test di un file con una banda per data
+def test_file_date_range_multi_date():
+    assert file_date_range('SWE_2024-02-01_2024-02-07.tif') == ('2024-02-01', '2024-02-07')
+
+
+# Test dei nomi non validi
+@pytest.mark.parametrize('file_name', [
+    'SWE_2024-02-01.tiff',
+    'swe_2024-02-01.tif',
+    'SWE_2024-02-30.tif',
+    'SWE_2024-02-07_2024-02-01.tif',
+    'SWE_2024-02-01_2024-02-02_2024-02-03.tif',
+    None,
+])
+def test_file_date_range_invalid(file_name):
+    with pytest.raises(ValueError):
+        file_date_range(file_name)
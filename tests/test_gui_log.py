@@ -0,0 +1,44 @@
+'''Test del buffer circolare dell'handler di logging dell'interfaccia (gui_log).'''
+import logging
+from queue import Queue
+from gui_log import GuiLogHandler
+
+
+# Crea un logger che scrive solo nell'handler indicato
+def make_logger(handler):
+    logger = logging.getLogger(f'test_gui_log_{id(handler)}')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+# Test del conteggio delle righe scartate quando il buffer è pieno
+def test_drain_counts_dropped_lines():
+    handler = GuiLogHandler(Queue(), max_lines=3)
+    logger = make_logger(handler)
+    for i in range(5):
+        logger.info(f'riga {i}')
+    assert handler.drain() == (['riga 2', 'riga 3', 'riga 4'], 2)
+    # Il prelievo azzera il buffer e il contatore
+    assert handler.drain() == ([], 0)
+
+
+# Test dell'ordine di arrivo tra righe dei logger e righe dell'interfaccia
+def test_append_keeps_arrival_order():
+    handler = GuiLogHandler(Queue(), max_lines=3)
+    logger = make_logger(handler)
+    logger.info('primo')
+    handler.append('secondo')
+    logger.info('terzo')
+    handler.append('quarto')
+    assert handler.drain() == (['secondo', 'terzo', 'quarto'], 1)
+
+
+# Test dell'inoltro delle misure delle fasi come eventi
+def test_stats_forwarded_to_queue():
+    queue = Queue()
+    handler = GuiLogHandler(queue)
+    make_logger(handler).info('misura', extra={'stats': {'stage': 'read'}})
+    assert queue.get_nowait() == ('stats', {'stage': 'read'})
+    assert handler.drain() == (['misura'], 0)
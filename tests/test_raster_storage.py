@@ -0,0 +1,19 @@
+'''Test della compressione degli array della tabella dei raster (raster_storage).'''
+import numpy as np
+import pytest
+from raster_storage import decode_array, encode_array
+
+
+# Test della compressione e decompressione, con i noData come NaN
+def test_encode_decode_round_trip():
+    values = np.arange(12, dtype=np.float64).reshape(3, 4) * 1.5
+    values[1, 2] = np.nan
+    decoded = decode_array(encode_array(values), 3, 4)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, values.astype(np.float32))
+
+
+# Test di una codifica non supportata
+def test_decode_unknown_codec():
+    with pytest.raises(ValueError):
+        decode_array(encode_array(np.zeros((1, 1))), 1, 1, codec='f8-zlib')
@@ -0,0 +1,23 @@
+'''Test dell'inserimento delle righe per cella nella matrice di una banda (swe_export).'''
+import affine
+import numpy as np
+from swe_export import scatter_cells
+
+
+# Test dell'inserimento dei valori, ignorando le celle fuori dalla griglia
+def test_scatter_cells():
+    transform = affine.Affine(500, 0, 600000, 0, -500, 5000000)
+    band = np.full((2, 3), np.nan, dtype=np.float32)
+    cell_ids = ['0600000_5000000', '0601000_4999500', '0601500_5000000', '0599500_5000000', '0600500_4999000']
+    inserted = scatter_cells(band, transform, cell_ids, [1.0, 2.0, 3.0, 4.0, 5.0])
+    assert inserted == 2
+    expected = np.full((2, 3), np.nan, dtype=np.float32)
+    expected[0, 0] = 1.0
+    expected[1, 2] = 2.0
+    np.testing.assert_array_equal(band, expected)
+
+
+# Test di un blocco vuoto
+def test_scatter_cells_empty():
+    band = np.zeros((1, 1), dtype=np.float32)
+    assert scatter_cells(band, affine.Affine(500, 0, 0, 0, -500, 500), [], []) == 0
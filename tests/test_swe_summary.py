@@ -0,0 +1,28 @@
+'''Test del riepilogo di un campo SWE (swe_summary).'''
+import numpy as np
+import pytest
+from swe_summary import CELL_AREA_KM2, PERCENTILES, summarize
+
+
+# Test del riepilogo dei valori validi, ignorando i NaN
+def test_summarize():
+    row = summarize(np.array([0.0, 10.0, np.nan, 30.0]))
+    assert row['valid_cells'] == 3
+    assert row['snow_cells'] == 2
+    assert row['swe_sum_mm'] == 40.0
+    assert row['swe_mean_mm'] == pytest.approx(40.0 / 3)
+    assert row['swe_max_mm'] == 30.0
+    assert row['snow_area_km2'] == pytest.approx(2 * CELL_AREA_KM2)
+    # Percentili con interpolazione lineare, come percentile_cont di PostgreSQL
+    for p in PERCENTILES:
+        assert row[f'swe_p{p}_mm'] == pytest.approx(np.percentile([0.0, 10.0, 30.0], p))
+
+
+# Test del riepilogo senza celle valide
+def test_summarize_no_valid_cells():
+    row = summarize(np.array([np.nan, np.nan]))
+    assert row['valid_cells'] == 0
+    assert row['swe_sum_mm'] == 0.0
+    assert row['swe_mean_mm'] is None
+    assert row['swe_max_mm'] is None
+    assert all(row[f'swe_p{p}_mm'] is None for p in PERCENTILES)
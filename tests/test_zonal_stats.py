@@ -0,0 +1,34 @@
+'''Test della riduzione per zona di un campo SWE (zonal_stats).'''
+import numpy as np
+from zonal_stats import reduce_zones
+
+
+# Maschera di prova su una griglia 2 x 3: zona 10 nella prima riga, zona 20 nei due pixel a destra della seconda
+def make_mask():
+    grid = np.array([[1, 1, 1], [0, 2, 2]], dtype=np.uint16)
+    pixels = np.flatnonzero(grid)
+    labels = grid.reshape(-1)[pixels]
+    return {'zone_ids': np.array([10, 20], dtype=np.int32), 'pixels': pixels, 'labels': labels,
+            'zone_cells': np.bincount(labels, minlength=3)}
+
+
+# Test delle statistiche per zona, con i NaN esclusi dalle celle valide
+def test_reduce_zones():
+    values = np.array([[0.0, 5.0, np.nan], [100.0, 2.0, 4.0]], dtype=np.float32)
+    zones = reduce_zones(values, make_mask())
+    np.testing.assert_array_equal(zones['zone_id'], [10, 20])
+    np.testing.assert_array_equal(zones['zone_cells'], [3, 2])
+    np.testing.assert_array_equal(zones['valid_cells'], [2, 2])
+    np.testing.assert_array_equal(zones['snow_cells'], [1, 2])
+    np.testing.assert_allclose(zones['swe_sum_mm'], [5.0, 6.0])
+    np.testing.assert_allclose(zones['swe_mean_mm'], [2.5, 3.0])
+
+
+# Test di una zona senza celle valide: media NaN
+def test_reduce_zones_without_valid_cells():
+    values = np.array([[np.nan, np.nan, np.nan], [1.0, 0.0, 0.0]], dtype=np.float32)
+    zones = reduce_zones(values, make_mask())
+    np.testing.assert_array_equal(zones['valid_cells'], [0, 2])
+    np.testing.assert_array_equal(zones['snow_cells'], [0, 0])
+    assert np.isnan(zones['swe_mean_mm'][0])
+    assert zones['swe_mean_mm'][1] == 0.0
@@ -0,0 +1,312 @@
+'''
+Questo modulo calcola le statistiche zonali dello SWE (ad esempio per bacino o per fascia altimetrica) direttamente
+dai GeoTIFF, al posto del join spaziale tra i poligoni di cell_geom_table e la tabella SWE. \n
+I poligoni delle zone vengono letti una sola volta da una tabella PostGIS con le colonne 'zone_id' (intero) e 'geom'
+e rasterizzati sulla griglia da 500 m dei file: ogni pixel appartiene alla zona che contiene il suo centro (con zone
+sovrapposte prevale quella con zone_id maggiore, quindi fasce altimetriche e bacini vanno in tabelle separate).
+Le maschere delle zone vengono salvate su disco nella cartella MASK_CACHE_DIR, identificate dalla versione
+dell'insieme di zone (impronta MD5 di zone_id e geometrie, calcolata dal database) e dalla griglia (CRS, trasformazione
+e dimensioni): un cambiamento delle zone o della griglia produce una nuova maschera. \n
+Le somme per zona vengono calcolate con np.bincount dai dati già convertiti, senza leggere di nuovo il GeoTIFF:
+per le righe per cella ZoneAccumulator riceve i blocchi della fase di lettura e riporta gli ID delle celle ai pixel
+della maschera, per i raster salvati per intero reduce_zones riduce le bande già lette. Solo il risultato, piccolo,
+arriva allo scrittore, che lo salva nella tabella zonale con una riga per data e zona (celle della zona, celle valide,
+celle con neve, somma e media dello SWE).
+Come per i dati, un nuovo caricamento lascia invariate le righe presenti, mentre la rielaborazione le sostituisce. \n
+'''
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from cell_index import cell_ids_to_coords
+from functions import nivological_year
+from metrics import stage
+from reprojection import open_raster
+
+# Cartella in cui vengono salvate le maschere delle zone (modificabile con la variabile d'ambiente SWE_MASK_CACHE_DIR)
+MASK_CACHE_DIR = os.environ.get('SWE_MASK_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.swe_converter', 'zone_masks'))
+
+
+# Funzione per creare la tabella delle statistiche zonali
+def create_zonal_table(connection, zonal_table: str) -> None:
+    '''Crea, se non esiste, la tabella delle statistiche zonali con una riga per data e zona.'''
+    connection.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {zonal_table} (
+            date date NOT NULL,
+            zone_id integer NOT NULL,
+            snow_year integer NOT NULL,
+            zone_cells integer NOT NULL,
+            valid_cells integer NOT NULL,
+            snow_cells integer NOT NULL,
+            swe_sum_mm double precision NOT NULL,
+            swe_mean_mm real,
+            PRIMARY KEY (date, zone_id)
+        );
+    '''))
+
+
+# Funzione per sommare per zona i valori di un insieme di pixel
+def zone_sums(labels: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    '''
+    Somma per numero di zona le celle valide, lo SWE e le celle con neve (np.bincount), ignorando i NaN. \n
+    Args:
+        labels: Il numero della zona (da 1) di ogni pixel.
+        values: I valori SWE in mm dei pixel, nello stesso ordine.
+        size: Il numero di zone più uno (l'elemento 0 non è usato). \n
+    Returns:
+        np.ndarray: La matrice 3 x size con celle valide, somma dello SWE e celle con neve per numero di zona. \n
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    labels, values = labels[valid], values[valid]
+    return np.vstack([np.bincount(labels, minlength=size),
+                      np.bincount(labels, weights=values, minlength=size),
+                      np.bincount(labels, weights=values > 0, minlength=size)])
+
+
+# Funzione per calcolare le statistiche delle zone a partire dalle somme
+def zone_stats(mask: dict, sums: np.ndarray) -> dict:
+    '''
+    Calcola le statistiche di ogni zona a partire dalle somme di zone_sums. \n
+    Args:
+        mask: La maschera delle zone restituita da ZonalStats.mask.
+        sums: La matrice delle somme per numero di zona. \n
+    Returns:
+        dict: Gli array 'zone_id', 'zone_cells', 'valid_cells', 'snow_cells', 'swe_sum_mm' e 'swe_mean_mm', uno per zona. \n
+    '''
+    valid_cells, swe_sum, snow_cells = sums[:, 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        swe_mean = swe_sum / valid_cells
+    return {
+        'zone_id': mask['zone_ids'],
+        'zone_cells': mask['zone_cells'][1:],
+        'valid_cells': valid_cells.astype(np.int64),
+        'snow_cells': snow_cells.astype(np.int64),
+        'swe_sum_mm': swe_sum,
+        'swe_mean_mm': swe_mean,
+    }
+
+
+# Funzione per ridurre un campo SWE per zona
+def reduce_zones(values: np.ndarray, mask: dict) -> dict:
+    '''
+    Calcola le statistiche di ogni zona di un campo SWE con operazioni vettoriali (np.bincount). \n
+    Args:
+        values: La matrice dei valori SWE in mm, con i noData come NaN, sulla griglia della maschera.
+        mask: La maschera delle zone restituita da ZonalStats.mask. \n
+    Returns:
+        dict: Gli array 'zone_id', 'zone_cells', 'valid_cells', 'snow_cells', 'swe_sum_mm' e 'swe_mean_mm', uno per zona. \n
+    '''
+    # Solo i pixel che cadono in una zona, con il numero della zona (da 1) in labels
+    zone_values = values.reshape(-1)[mask['pixels']]
+    return zone_stats(mask, zone_sums(mask['labels'], zone_values, len(mask['zone_ids']) + 1))
+
+
+# Classe per accumulare le somme per zona dei blocchi convertiti di un file
+class ZoneAccumulator:
+    '''Somme per zona di ogni data di un file, calcolate dai dataframe della conversione invece che dal GeoTIFF.'''
+    # Metodo di inizializzazione della classe ZoneAccumulator
+    def __init__(self, mask: dict, transform, width: int, dates: list):
+        '''
+        Inizializza le somme a zero per ogni data del file. \n
+        Args:
+            mask: La maschera delle zone sulla griglia del file (vedi ZonalStats.mask).
+            transform: La matrice di trasformazione della griglia.
+            width: La larghezza della griglia in pixel.
+            dates: Le date del file nel formato 'YYYY-MM-DD'. \n
+        '''
+        self.mask = mask
+        self.transform = transform
+        self.width = width
+        self.size = len(mask['zone_ids']) + 1
+        self.sums = {date: np.zeros((3, self.size)) for date in dates}
+
+    # Metodo per aggiungere un blocco convertito
+    def add(self, df: pd.DataFrame) -> int:
+        '''
+        Aggiunge alle somme le righe di un blocco, riportando gli ID delle celle ai pixel della maschera. \n
+        Args:
+            df: Il dataframe con le colonne 'cell_id', 'date' e 'swe_mm' (anche con più date). \n
+        Returns:
+            int: Il numero di righe che cadono in una zona. \n
+        '''
+        pixels_in_zones = self.mask['pixels']
+        if df.empty or not len(pixels_in_zones):
+            return 0
+        # Trasformazione inversa: gli ID indicano l'angolo superiore sinistro della cella
+        lons, lats = cell_ids_to_coords(df['cell_id'].to_numpy())
+        cols = np.rint((lons - self.transform.c) / self.transform.a).astype(np.int64)
+        rows = np.rint((lats - self.transform.f) / self.transform.e).astype(np.int64)
+        pixels = rows * self.width + cols
+        # Gli indici dei pixel della maschera sono ordinati: ricerca binaria del numero di zona
+        position = np.minimum(np.searchsorted(pixels_in_zones, pixels), len(pixels_in_zones) - 1)
+        inside = (pixels_in_zones[position] == pixels) & (cols >= 0) & (cols < self.width)
+        labels = self.mask['labels'][position[inside]]
+        values = df['swe_mm'].to_numpy(dtype=np.float64)[inside]
+        codes, dates = pd.factorize(df['date'].to_numpy()[inside])
+        for code, date in enumerate(dates):
+            selected = codes == code if len(dates) > 1 else slice(None)
+            day = pd.Timestamp(date).strftime('%Y-%m-%d')
+            day_sums = self.sums.setdefault(day, np.zeros((3, self.size)))
+            day_sums += zone_sums(labels[selected], values[selected], self.size)
+        return int(np.count_nonzero(inside))
+
+    # Metodo per calcolare le statistiche delle zone
+    def results(self) -> dict:
+        '''Restituisce, per ogni data in ordine, le statistiche delle zone (vedi zone_stats).'''
+        return {date: zone_stats(self.mask, sums) for date, sums in sorted(self.sums.items())}
+
+
+# Classe per il calcolo delle statistiche zonali con le maschere delle zone in cache
+class ZonalStats:
+    '''Statistiche zonali dello SWE per le zone di una tabella PostGIS, con le maschere rasterizzate in cache.'''
+    # Metodo di inizializzazione della classe ZonalStats
+    def __init__(self, session, zone_table: str, zonal_table: str = None, geometry_column: str = 'geom',
+                 cache_dir: str = MASK_CACHE_DIR):
+        '''
+        Prepara il calcolo per le zone indicate. \n
+        Args:
+            session: La sessione di caricamento sul database PostgreSQL.
+            zone_table: Il nome della tabella PostGIS delle zone, con le colonne 'zone_id' (intero) e geometry_column.
+            zonal_table: Il nome della tabella delle statistiche zonali. Se None viene usato '<zone_table>_swe'.
+            geometry_column: Il nome della colonna geometrica della tabella delle zone.
+            cache_dir: La cartella in cui salvare le maschere delle zone. \n
+        '''
+        self.session = session
+        self.zone_table = zone_table
+        self.zonal_table = zonal_table or f"{zone_table}_swe"
+        self.geometry_column = geometry_column
+        self.cache_dir = cache_dir
+        self.version = None
+        self._masks = {}
+
+    # Metodo per leggere la versione dell'insieme di zone
+    def zone_version(self) -> str:
+        '''Restituisce l'impronta MD5 di zone_id e geometrie delle zone, letta dal database una sola volta.'''
+        if self.version is None:
+            with self.session.engine.connect() as connection:
+                self.version = connection.execute(text(f'''
+                    SELECT md5(coalesce(string_agg(zone_id::text || ':' || md5(ST_AsEWKB({self.geometry_column})), ',' ORDER BY zone_id), ''))
+                    FROM {self.zone_table};
+                ''')).scalar()
+        return self.version
+
+    # Metodo per ottenere la maschera delle zone di una griglia
+    def mask(self, crs, transform, width: int, height: int) -> dict:
+        '''
+        Restituisce la maschera delle zone sulla griglia indicata: dalla memoria, dalla cache su disco
+        o, se manca, rasterizzando i poligoni delle zone. \n
+        Args:
+            crs: Il CRS della griglia.
+            transform: La matrice di trasformazione della griglia.
+            width: La larghezza della griglia in pixel.
+            height: L'altezza della griglia in pixel. \n
+        Returns:
+            dict: Gli array 'zone_ids' (zone_id in ordine), 'pixels' (indici lineari dei pixel in una zona),
+            'labels' (numero della zona da 1 di ogni pixel) e 'zone_cells' (pixel per numero di zona; l'elemento 0 non è usato). \n
+        '''
+        grid = json.dumps([crs.to_wkt(), list(transform)[:6], width, height])
+        digest = hashlib.sha1(f"{self.zone_version()}|{grid}".encode('utf-8')).hexdigest()[:16]
+        if digest in self._masks:
+            return self._masks[digest]
+        cache_path = os.path.join(self.cache_dir, f"{self.zone_table}_{digest}.npz")
+        mask = None
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cached:
+                    mask = {key: cached[key] for key in ('zone_ids', 'pixels', 'labels', 'zone_cells')}
+                logging.info(f"Maschera delle zone '{self.zone_table}' caricata dalla cache locale.")
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Impossibile leggere la maschera delle zone locale: {e}")
+        if mask is None:
+            mask = self._rasterize(crs, transform, width, height)
+            self._save(cache_path, mask)
+        self._masks[digest] = mask
+        return mask
+
+    # Metodo per rasterizzare i poligoni delle zone
+    def _rasterize(self, crs, transform, width: int, height: int) -> dict:
+        '''Legge i poligoni delle zone nel CRS della griglia e li rasterizza, con il numero della zona (da 1) come valore.'''
+        from rasterio import features
+        epsg = crs.to_epsg()
+        if epsg is None:
+            raise ValueError("Le statistiche zonali richiedono una griglia con un codice EPSG.")
+        with stage('zone_mask', rows=width * height) as mask_stage, self.session.engine.connect() as connection:
+            zones = connection.execute(text(f'''
+                SELECT zone_id, ST_AsGeoJSON(ST_Transform({self.geometry_column}, :srid))
+                FROM {self.zone_table} WHERE {self.geometry_column} IS NOT NULL ORDER BY zone_id;
+            '''), {"srid": epsg}).fetchall()
+            zone_ids = np.array([zone_id for zone_id, _ in zones], dtype=np.int32)
+            dtype = np.uint16 if len(zones) < np.iinfo(np.uint16).max else np.int32
+            grid = np.zeros((height, width), dtype=dtype)
+            if zones:
+                features.rasterize(((json.loads(geometry), number) for number, (_, geometry) in enumerate(zones, start=1)),
+                                   out=grid, transform=transform)
+            pixels = np.flatnonzero(grid)
+            labels = grid.reshape(-1)[pixels]
+            mask_stage['bytes'] = pixels.nbytes + labels.nbytes
+        logging.info(f"Maschera delle zone '{self.zone_table}' rasterizzata: {len(zones)} zone, {len(pixels)} celle.")
+        return {'zone_ids': zone_ids, 'pixels': pixels, 'labels': labels,
+                'zone_cells': np.bincount(labels, minlength=len(zones) + 1)}
+
+    # Metodo per salvare una maschera su disco
+    def _save(self, cache_path: str, mask: dict) -> None:
+        '''Salva la maschera su disco in modo atomico.'''
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = cache_path + '.tmp.npz'
+            np.savez(temp_path, **mask)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logging.warning(f"Impossibile salvare la maschera delle zone su disco: {e}")
+
+    # Metodo per preparare le somme per zona di un file
+    def accumulator(self, geoTIFF_path: str, dates: list, warp: dict = None) -> ZoneAccumulator:
+        '''
+        Prepara le somme per zona di un file, leggendo dal GeoTIFF la sola griglia (senza decodificare le bande). \n
+        Args:
+            geoTIFF_path: Il percorso del file GeoTIFF.
+            dates: Le date del file nel formato 'YYYY-MM-DD'.
+            warp: La destinazione della riproiezione (vedi reprojection.warp_target), oppure None per la griglia del file. \n
+        Returns:
+            ZoneAccumulator: Le somme per zona, da aggiornare con i blocchi convertiti del file. \n
+        '''
+        with open_raster(geoTIFF_path, warp) as raster:
+            mask = self.mask(raster.crs, raster.transform, raster.width, raster.height)
+            return ZoneAccumulator(mask, raster.transform, raster.width, dates)
+
+    # Metodo per salvare le statistiche zonali di un file
+    def write(self, results: dict, reprocess: bool = False) -> int:
+        '''
+        Salva le statistiche delle zone di ogni data nella tabella zonale, in un'unica transazione. \n
+        Args:
+            results: Le statistiche delle zone per data (vedi ZoneAccumulator.results e reduce_zones).
+            reprocess: Se True le righe già presenti vengono sostituite, altrimenti restano invariate. \n
+        Returns:
+            int: Il numero di righe scritte. \n
+        '''
+        conflict = '''DO UPDATE SET snow_year = EXCLUDED.snow_year, zone_cells = EXCLUDED.zone_cells,
+            valid_cells = EXCLUDED.valid_cells, snow_cells = EXCLUDED.snow_cells,
+            swe_sum_mm = EXCLUDED.swe_sum_mm, swe_mean_mm = EXCLUDED.swe_mean_mm''' if reprocess else 'DO NOTHING'
+        written = 0
+        with stage('zonal', rows=len(results)), self.session.engine.begin() as connection:
+            create_zonal_table(connection, self.zonal_table)
+            for date, zones in results.items():
+                # Le medie delle zone senza celle valide restano NULL
+                params = {key: [None if np.isnan(value) else float(value) for value in array] if key == 'swe_mean_mm'
+                          else array.tolist() for key, array in zones.items()}
+                written += connection.execute(text(f'''
+                    INSERT INTO {self.zonal_table}
+                        (date, zone_id, snow_year, zone_cells, valid_cells, snow_cells, swe_sum_mm, swe_mean_mm)
+                    SELECT CAST(:date AS date), zone_id, :snow_year, zone_cells, valid_cells, snow_cells, swe_sum_mm, swe_mean_mm
+                    FROM unnest(CAST(:zone_id AS integer[]), CAST(:zone_cells AS integer[]), CAST(:valid_cells AS integer[]),
+                                CAST(:snow_cells AS integer[]), CAST(:swe_sum_mm AS double precision[]),
+                                CAST(:swe_mean_mm AS real[]))
+                        AS zone (zone_id, zone_cells, valid_cells, snow_cells, swe_sum_mm, swe_mean_mm)
+                    ON CONFLICT (date, zone_id) {conflict};
+                '''), {**params, "date": date, "snow_year": nivological_year(date)}).rowcount
+        logging.info(f"Statistiche zonali di {len(results)} date salvate nella tabella '{self.zonal_table}': {written} righe.")
+        return written